@@ -0,0 +1,277 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import numpy as np
+import pandas as pd
+
+from astwro.starlist import StarList, DAO, read_dao_file
+from .config import find_opt_file, read_opt_file
+
+_MINSKY = 20  # min number of sky pixels, as in daophot
+_MAXITER = 30  # max iterations of sky estimation, as in daophot
+_CHUNK_PIXELS = 2 ** 21  # stars are processed in chunks of about that many pixels
+_SKY_SAMPLE = 10000  # number of image pixels sampled for LOWBAD estimation
+
+
+class AperturePhotometry(object):
+    """
+    In-process aperture photometry, numpy counterpart of daophot PHOTOMETRY command (:meth:`Daophot.PHotometry`).
+
+    Image is read once (memory-mapped) and can be measured for many star lists. Options have daophot
+    semantics: apertures ``A1`` .. ``AC`` and sky annulus radii ``IS``, ``OS`` from `photo.opt` file,
+    gain ``GA`` and good data limits ``LO`` (sigmas below sky) and ``HI`` from `daophot.opt` file.
+    Aperture sums include partial pixels, the sky is daophot's mean-median-mode estimation in the annulus.
+    Magnitudes are ``25 - 2.5 log10(flux)``.
+
+    >>> ap = AperturePhotometry(fits_image(), IS=35, OS=50, apertures=[4, 8])
+    >>> stars = ap.photometry('i.coo')
+    >>> write_dao_file(stars, 'i.ap')
+
+    :var list apertures: apertures radii
+    :var float IS: inner sky radius
+    :var float OS: outer sky radius
+    :var float gain: photons per ADU
+    :var float lowbad: low good datum, default: estimated from image
+    :var float highbad: high good datum
+    """
+
+    def __init__(self, image, photoopt=None, daophotopt=None, options=None, IS=None, OS=None, apertures=None):
+        """
+        :param image: FITS file name or 2D array of pixels
+        :param str photoopt: photo.opt file, default: found as for :class:`Daophot`
+        :param str daophotopt: daophot.opt file, default: found as for :class:`Daophot`
+        :param dict options: daophot options, overrides `daophotopt` values, e.g. ``{'GA': 9.0, 'LO': 7.0}``
+        :param float IS: inner sky radius, overrides `photoopt` value
+        :param float OS: outer sky radius, overrides `photoopt` value
+        :param list apertures: apertures radii, overrides `photoopt` values
+        """
+        if isinstance(image, np.ndarray):
+            self.data = image
+            self.integer = image.dtype.kind in 'iu'
+        else:
+            from astropy.io import fits
+            try:
+                self.data, header = fits.getdata(image, header=True, memmap=True)
+            except ValueError:  # scaled (BZERO/BSCALE) integer image can not be memory-mapped
+                self.data, header = fits.getdata(image, header=True, memmap=False)
+            self.integer = header['BITPIX'] > 0
+        if photoopt is None:
+            photoopt = find_opt_file('photo.opt', mustexist=False)
+        photo = read_opt_file(photoopt) if photoopt else {}
+        if daophotopt is None:
+            daophotopt = find_opt_file('daophot.opt', mustexist=False)
+        dao = read_opt_file(daophotopt) if daophotopt else {}
+        dao.update((k[:2].upper(), float(v)) for k, v in (options or {}).items())
+
+        if apertures is None:
+            apertures = []
+            for i in range(1, 13):
+                a = photo.get('A{:X}'.format(i), 0.0)
+                if a <= 0:
+                    break
+                apertures.append(a)
+        if len(apertures) > 12:
+            raise ValueError('apertures list can contain maximum 12 elements')
+        self.apertures = list(apertures)
+        self.IS = IS if IS is not None else photo.get('IS', 0.0)
+        self.OS = OS if OS is not None else photo.get('OS', 0.0)
+        if not self.apertures or not self.OS:
+            raise ValueError('Apertures and IS and OS must be provided, explicitly or as photoopt file')
+        self.gain = dao.get('GA', 1.0)
+        self.readnoise = dao.get('RE', 0.0)
+        self.lowbad = None
+        self.highbad = dao.get('HI', 32766.5)
+        self.__lowsigma = dao.get('LO', 7.0)
+
+    def estimate_lowbad(self):
+        """Estimates low good datum as sky - LO * sky sigma, using sample of image pixels, sets and returns
+        :attr:`lowbad`"""
+        step = max(1, int(np.sqrt(self.data.size / _SKY_SAMPLE)))
+        sample = np.asarray(self.data[::step, ::step], dtype=np.float64).ravel()
+        sample = np.sort(sample[sample <= self.highbad])
+        sky, sigma, _, _ = _mmm(sample[np.newaxis, :], np.array([len(sample)]), self.highbad, self.integer)
+        self.lowbad = float(sky[0] - self.__lowsigma * sigma[0])
+        return self.lowbad
+
+    def photometry(self, stars='i.coo'):
+        """
+        Aperture photometry of stars.
+
+        If `stars` has daophot header with ``LOWBAD`` value (e.g. `coo` file from daophot FIND),
+        it is used as low good datum, unless :attr:`lowbad` is set.
+
+        :param stars: StarList or daophot file with `x` and `y` of stars
+        :return: StarList with columns of `ap` file (:data:`DAO.AP_FILE`): ``id``, ``x``, ``y``, ``mag``,
+                 ``A2``..., ``sky``, ``sky_err``, ``sky_skew``, ``mag_err``, ``A2_err``...; magnitudes
+                 are NaN for apertures with bad pixels or crossing image edge and for negative fluxes
+        :rtype: StarList
+        """
+        if not isinstance(stars, pd.DataFrame):
+            stars = read_dao_file(stars)
+        lowbad = self.lowbad
+        if lowbad is None and stars.DAO_hdr is not None and 'LOWBAD' in stars.DAO_hdr:
+            lowbad = float(stars.DAO_hdr['LOWBAD'])
+        if lowbad is None:
+            lowbad = self.estimate_lowbad()
+
+        x = stars.x.values.astype(np.float64)
+        y = stars.y.values.astype(np.float64)
+        naps = len(self.apertures)
+        mags = np.full((naps, len(x)), np.nan)
+        errs = np.full((naps, len(x)), np.nan)
+        sky = np.full((3, len(x)), np.nan)  # sky, sigma, skew
+
+        sky_offsets = _ring_offsets(self.IS - 1.5, self.OS + 1.5)
+        ap_offsets = _ring_offsets(0, max(self.apertures) + 2.0)
+        chunk = max(1, _CHUNK_PIXELS // len(sky_offsets[0]))
+        with np.errstate(invalid='ignore', divide='ignore'):  # failed stars are NaN
+            for start in range(0, len(x), chunk):
+                part = slice(start, start + chunk)
+                sky[:, part], mags[:, part], errs[:, part] = self.__measure(
+                    x[part], y[part], lowbad, sky_offsets, ap_offsets)
+
+        columns = ['id', 'x', 'y', 'mag'] + ['A{:X}'.format(n) for n in range(2, naps + 1)] \
+                  + ['sky', 'sky_err', 'sky_skew', 'mag_err'] + ['A{:X}_err'.format(n) for n in range(2, naps + 1)]
+        values = [stars.id.values, x, y] + list(mags) + list(sky) + list(errs)
+        ret = StarList(pd.DataFrame(dict(zip(columns, values)), columns=columns, index=stars.index))
+        ret.DAO_type = DAO.AP_FILE
+        ret.DAO_hdr = self.__header(stars.DAO_hdr, lowbad)
+        return ret
+
+    def __measure(self, x, y, lowbad, sky_offsets, ap_offsets):
+        # photometry of chunk of stars: (sky, sky sigma, skew), magnitudes and errors for apertures
+        ny, nx = self.data.shape
+        finite = np.isfinite(x) & np.isfinite(y)
+        x = np.where(finite, x, -self.OS)
+        y = np.where(finite, y, -self.OS)
+
+        # sky: sorted values of good pixels in annulus, padded with inf
+        values, rsq, inside = self.__pixels(x, y, sky_offsets)
+        good = inside & (rsq >= self.IS ** 2) & (rsq <= self.OS ** 2) & (values >= lowbad) & (values <= self.highbad)
+        values = np.sort(np.where(good, values, np.inf), axis=1)
+        skymod, sigma, skew, nsky = _mmm(values, good.sum(axis=1), self.highbad, self.integer)
+
+        # apertures: partial pixels included by fraction, linear in distance from star (as in daophot)
+        values, rsq, inside = self.__pixels(x, y, ap_offsets)
+        r = np.sqrt(rsq)
+        baddata = ~inside | ~(values >= lowbad) | (values > self.highbad)  # NaN values are bad too
+        values = np.where(baddata, 0.0, values)
+        mags = np.full((len(self.apertures), len(x)), np.nan)
+        errs = np.full((len(self.apertures), len(x)), np.nan)
+        for k, a in enumerate(self.apertures):
+            fraction = np.clip(a - r + 0.5, 0.0, 1.0)
+            area = fraction.sum(axis=1)
+            flux = (fraction * values).sum(axis=1) - skymod * area
+            bad = ((fraction > 0) & baddata).any(axis=1) \
+                | (x - a < 0.5) | (x + a > nx + 0.5) | (y - a < 0.5) | (y + a > ny + 0.5)
+            ok = finite & ~bad & (flux > 0) & np.isfinite(skymod)
+            flux = np.where(ok, flux, 1.0)
+            variance = area * sigma ** 2 + flux / self.gain + area ** 2 * sigma ** 2 / np.maximum(nsky, 1)
+            mags[k] = np.where(ok, 25.0 - 2.5 * np.log10(flux), np.nan)
+            err = 1.0857 * np.sqrt(variance) / flux
+            errs[k] = np.where(ok & (err < 9.9999), err, np.nan)  # daophot's 9.9999 is read as NaN
+        sky = np.array([skymod, sigma, skew])
+        sky[:, ~finite] = np.nan
+        return sky, mags, errs
+
+    def __pixels(self, x, y, offsets):
+        # pixels values around stars at offsets from pixel containing star center, squares of distances
+        # and mask of pixels inside image; daophot coordinates of pixel (i, j) center are (i + 1, j + 1)
+        ny, nx = self.data.shape
+        ox, oy = offsets
+        px = np.floor(x + 0.5).astype(np.int64)[:, np.newaxis] + ox
+        py = np.floor(y + 0.5).astype(np.int64)[:, np.newaxis] + oy
+        rsq = (px - x[:, np.newaxis]) ** 2 + (py - y[:, np.newaxis]) ** 2
+        inside = (px >= 1) & (px <= nx) & (py >= 1) & (py <= ny)
+        values = self.data[np.clip(py - 1, 0, ny - 1), np.clip(px - 1, 0, nx - 1)].astype(np.float64)
+        return values, rsq, inside
+
+    def __header(self, hdr, lowbad):
+        ny, nx = self.data.shape
+        ret = {'NX': nx, 'NY': ny, 'THRESH': 0.0, 'FRAD': 0.0, 'RNOISE': self.readnoise}
+        if hdr:
+            ret.update(hdr)
+        ret.update({'NL': 2, 'LOWBAD': lowbad, 'HIGHBAD': self.highbad, 'AP1': self.apertures[0],
+                    'PH/ADU': self.gain})
+        return dict((k, str(v)) for k, v in ret.items())
+
+
+def _ring_offsets(r_in, r_out):
+    # integer offsets (dx, dy) of ring r_in <= r <= r_out as arrays of shape (1, n)
+    r = int(np.ceil(r_out))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    rsq = dx ** 2 + dy ** 2
+    ring = (rsq >= max(r_in, 0) ** 2) & (rsq <= r_out ** 2)
+    return dx[ring][np.newaxis, :], dy[ring][np.newaxis, :]
+
+
+def _nint(v):
+    return np.floor(v + 0.5).astype(np.int64)
+
+
+def _mmm(sky, n, highbad, integer):
+    # daophot's MMM sky estimation, vectorized over rows of sorted sky values (padded with inf),
+    # n - numbers of values in rows; returns (mode, sigma, skew, number of used values), NaN for failed rows
+    m = len(n)
+    rows = np.arange(m)
+    nn = np.maximum(n, 1)
+    skymid = 0.5 * (sky[rows, (nn - 1) // 2] + sky[rows, nn // 2])  # median
+    # cumulative sums of deviations from median, for mean and sigma of any range of sorted values
+    delta = np.where(np.isfinite(sky), sky - skymid[:, np.newaxis], 0.0)
+    cs = np.zeros((m, sky.shape[1] + 1))
+    cs2 = np.zeros((m, sky.shape[1] + 1))
+    np.cumsum(delta, axis=1, out=cs[:, 1:])
+    np.cumsum(delta ** 2, axis=1, out=cs2[:, 1:])
+
+    def moments(lo, hi):
+        count = np.maximum(hi - lo, 1)
+        mean = (cs[rows, hi] - cs[rows, lo]) / count
+        sigma = np.sqrt(np.maximum(0.0, (cs2[rows, hi] - cs2[rows, lo]) / count - mean ** 2))
+        return mean + skymid, sigma
+
+    # the first pass: values symmetric around median
+    cut = np.minimum(np.minimum(skymid - sky[:, 0], sky[rows, nn - 1] - skymid), highbad - skymid)
+    lo = (sky < (skymid - cut)[:, np.newaxis]).sum(axis=1)
+    hi = (sky <= (skymid + cut)[:, np.newaxis]).sum(axis=1)
+    skymn, sigma = moments(lo, hi)
+    skymed = 0.5 * (sky[rows, np.maximum((lo + hi + 1) // 2 - 1, 0)] + sky[rows, np.minimum((lo + hi) // 2, nn - 1)])
+    skymod = np.where(skymed < skymn, 3.0 * skymed - 2.0 * skymn, skymn)
+
+    # rejection and recomputation loop, for rows not converged yet
+    failed = n < _MINSKY
+    active = ~failed
+    clamp = np.ones(m)
+    old = np.zeros(m)
+    for _ in range(_MAXITER):
+        failed |= active & (hi - lo < _MINSKY)
+        active &= ~failed
+        i = np.flatnonzero(active)
+        if not len(i):
+            break
+        r = np.log10(hi[i] - lo[i])
+        r = np.maximum(2.0, (-0.1042 * r + 1.1695) * r + 0.8895)  # Chauvenet rejection criterion
+        cut = r * sigma[i] + 0.5 * np.abs(skymn[i] - skymod[i])
+        if integer:
+            cut = np.maximum(cut, 1.5)
+        newlo = (sky[i] < (skymod[i] - cut)[:, np.newaxis]).sum(axis=1)
+        newhi = (sky[i] <= (skymod[i] + cut)[:, np.newaxis]).sum(axis=1)
+        redo = (newlo != lo[i]) | (newhi != hi[i])
+        lo[i], hi[i] = newlo, newhi
+        skymn, sigma = moments(lo, hi)
+        # median as mean of the central ~20% values
+        center = (lo[i] + 1 + hi[i]) / 2.0
+        side = _nint(0.2 * (hi[i] - lo[i])) / 2.0 + 0.25
+        j = np.clip(_nint(center - side), 1, None)
+        k = np.maximum(np.minimum(_nint(center + side), hi[i]), j)
+        skymed = (cs[i, k] - cs[i, j - 1]) / (k - j + 1) + skymid[i]
+        dmod = np.where(skymed < skymn[i], 3.0 * skymed - 2.0 * skymn[i], skymn[i]) - skymod[i]
+        clamp[i] = np.where(dmod * old[i] < 0, 0.5 * clamp[i], clamp[i])  # damping of oscillating mode
+        skymod[i] += clamp[i] * dmod
+        old[i] = dmod
+        active[i] = redo
+    failed |= active  # not converged
+    skew = (skymn - skymod) / np.maximum(1.0, sigma)
+    for v in (skymod, sigma, skew):
+        v[failed] = np.nan
+    return skymod, sigma, skew, hi - lo
@@ -0,0 +1,180 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import glob
+import json
+import time
+import multiprocessing
+
+import pandas as pd
+
+from .logger import logger as module_logger
+from .Daophot import Daophot
+from .Allstar import Allstar
+
+PROGRESS_FILE = 'batch_progress.json'  # progress of batch: one json record per finished image
+RESULT_FILES = ('coo', 'ap', 'lst', 'psf', 'als')  # runner dir files i.<ext> copied as <image name>.<ext>
+
+_SUMMARY_COLUMNS = ['image', 'status', 'found', 'sky', 'picked', 'psf_chi', 'als_stars', 'seconds', 'message']
+
+
+def image_photometry(image, output_dir='.', daophotopt=None, allstaropt=None, photoopt=None, options=None,
+                     allstar_options=None, apertures=None, IS=35, OS=50, psf_stars=50, faintest_mag=20.0):
+    """
+    Photometry chain of single image: daophot FIND, PHOTOMETRY, PICK and PSF followed by ALLSTAR.
+
+    Runners work in their own temporary runner directory. Results: ``i.coo``, ``i.ap``, ``i.lst``,
+    ``i.psf`` and ``i.als`` are copied into `output_dir` as ``<image name>.coo``, etc.
+
+    Default job of :func:`batch_photometry`, parameters other than `image` and `output_dir`
+    can be provided per image.
+
+    :param str image: FITS image path
+    :param str output_dir: directory for results
+    :param str daophotopt: daophot.opt file
+    :param str allstaropt: allstar.opt file
+    :param str photoopt: photo.opt file
+    :param dict options: daophot options, overrides `daophotopt`
+    :param dict allstar_options: allstar options, overrides `allstaropt`
+    :param list apertures: apertures for PHOTOMETRY, default: from `photoopt`
+    :param float IS: inner sky radius
+    :param float OS: outer sky radius
+    :param int psf_stars: number of stars to PICK for PSF
+    :param float faintest_mag: faintest magnitude of stars to PICK
+    :return: summary of image photometry, see :func:`batch_photometry`
+    :rtype: dict
+    """
+    name, _ = os.path.splitext(os.path.basename(image))
+    d = Daophot(image=image, daophotopt=daophotopt, options=options, batch=True)
+    a = Allstar(dir=d.dir, image=image, allstaropt=allstaropt, options=allstar_options, batch=True)
+    try:
+        d.FInd()
+        d.PHotometry(photoopt=photoopt, IS=IS, OS=OS, apertures=apertures)
+        d.PIck(number_of_stars_to_pick=psf_stars, faintest_mag=faintest_mag)
+        d.PSf()
+        d.run()
+        summary = {'found': int(d.FInd_result.stars), 'sky': d.FInd_result.sky, 'picked': d.PIck_result.stars}
+        if not d.PSf_result.converged:
+            summary.update(status='failed', message='PSF not converged')
+            return summary
+        summary['psf_chi'] = d.PSf_result.chi
+        a.ALlstar(stars='i.ap')
+        a.run()
+        summary['als_stars'] = a.ALlstars_result.stars_no[0]  # converged stars
+        for ext in RESULT_FILES:
+            d.copy_from_runner_dir('i.' + ext, os.path.join(output_dir, '{}.{}'.format(name, ext)))
+        summary['status'] = 'ok'
+        return summary
+    finally:
+        a.close()
+        d.close()
+
+
+def batch_photometry(images, output_dir='.', processes=None, image_options=None, resume=True, fn=None,
+                     **options):
+    """
+    Runs photometry chain (default: :func:`image_photometry`) for many images on the pool of processes.
+
+    Images are processed in parallel by `processes` worker processes, each image in it's own
+    runner directory. Progress is recorded in ``batch_progress.json`` in `output_dir` as soon as image
+    is processed; with `resume` set, images already processed successfully are not processed again, so
+    interrupted batch can be continued by the same call.
+
+    >>> summary = batch_photometry('night/*.fits', 'results', daophotopt='daophot.opt', apertures=[8])
+    >>> summary[summary.status != 'ok']
+
+    :param images: list of FITS files or glob pattern
+    :param str output_dir: directory for results and progress file, created if not exists
+    :param int processes: number of worker processes, default: number of CPUs
+    :param dict image_options: per image parameters of `fn` updating `options`: {image: {param: value}},
+                               where image is path as provided in `images` or file name
+    :param bool resume: skip images already processed successfully according to progress file
+    :param fn: photometry chain ``fn(image, output_dir, **options)`` returning dict of summary values,
+               must be importable (picklable) function, default: :func:`image_photometry`
+    :param options: parameters of `fn` common for all images
+    :return: summary table, row per image with columns `image`, `status` ('ok', 'failed' or 'error'),
+             `found`, `sky`, `picked`, `psf_chi`, `als_stars`, `seconds`, `message`
+             and other values returned by `fn`
+    :rtype: pd.DataFrame
+    """
+    if isinstance(images, (str, type(u''))):
+        images = sorted(glob.glob(os.path.expanduser(images)))
+    if image_options is None:
+        image_options = {}
+    if fn is None:
+        fn = image_photometry
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    logger = module_logger.getChild('batch_photometry')
+    progress_file = os.path.join(output_dir, PROGRESS_FILE)
+    done = _read_progress(progress_file) if resume else {}
+    rows = [done[image] for image in images if image in done]
+    tasks = []
+    for image in images:
+        if image in done:
+            continue
+        kwargs = dict(options)
+        kwargs.update(image_options.get(os.path.basename(image), {}))
+        kwargs.update(image_options.get(image, {}))
+        tasks.append((fn, image, output_dir, kwargs))
+    logger.info('Processing %d images (%d already done) with %s processes',
+                len(tasks), len(rows), processes or multiprocessing.cpu_count())
+    if tasks:
+        # images are processed in arbitrary order, one image per task to balance long and short ones;
+        # new process per few images releases memory and leftovers of crashed runs
+        pool = multiprocessing.Pool(processes, maxtasksperchild=10)
+        try:
+            with open(progress_file, 'a' if resume else 'w') as progress:
+                for n, row in enumerate(pool.imap_unordered(_run_task, tasks, chunksize=1), 1):
+                    progress.write(json.dumps(row) + '\n')
+                    progress.flush()
+                    rows.append(row)
+                    logger.info('[%d/%d] %s: %s %s', n, len(tasks), row['image'], row['status'],
+                                row.get('message') or '')
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    summary = pd.DataFrame(rows)
+    columns = _SUMMARY_COLUMNS + sorted(c for c in summary.columns if c not in _SUMMARY_COLUMNS)
+    summary = summary.reindex(columns=columns)
+    order = dict((image, i) for i, image in enumerate(images))
+    summary['_order'] = summary.image.map(order)
+    return summary.sort_values('_order').drop('_order', axis=1).reset_index(drop=True)
+
+
+def _run_task(task):
+    # executed in pool process, exceptions are reported in summary
+    fn, image, output_dir, kwargs = task
+    start = time.time()
+    try:
+        row = fn(image, output_dir, **kwargs)
+    except Exception as e:
+        row = {'status': 'error', 'message': '{}: {}'.format(type(e).__name__, e)}
+    row = dict(row)
+    row.setdefault('status', 'ok')
+    row['image'] = image
+    row['seconds'] = time.time() - start
+    return row
+
+
+def _read_progress(progress_file):
+    # successfully processed images: {image: summary row}, the last record of image wins
+    done = {}
+    if not os.path.isfile(progress_file):
+        return done
+    with open(progress_file) as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:  # last line of interrupted write
+                continue
+            if row.get('status') == 'ok':
+                done[row['image']] = row
+            else:
+                done.pop(row.get('image'), None)
+    return done
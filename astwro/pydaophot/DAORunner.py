@@ -7,14 +7,15 @@ import tempfile
 import random
 from collections import namedtuple
 from .Runner import Runner
+from .config import starlist_cache
 import astwro.starlist as sl
 
 
 class DAORunner(Runner):
     """base for daophot package runners runner"""
 
-    def __init__(self, dir=None, batch=False):
-        super(DAORunner, self).__init__(dir=dir, batch=batch)
+    def __init__(self, dir=None, batch=False, preserve_process=None):
+        super(DAORunner, self).__init__(dir=dir, batch=batch, preserve_process=preserve_process)
 
     def __deepcopy__(self, memo):
         return super(DAORunner, self).__deepcopy__(memo)
@@ -59,7 +60,7 @@ class DAORunner(Runner):
         :param  kwargs: additional parameters for extra processing in subclasses e.g. add_psf_errors=True
         :rtype: starlist.StarList
         """
-        s = sl.read_dao_file(self.absolute_path(filepath))
+        s = sl.read_dao_file(self.absolute_path(filepath), cache=starlist_cache())
         return self._process_starlist(s, **kwargs)
 
     def write_starlist(self, stars, filename=None, dao_file_type=None):
@@ -75,6 +76,7 @@ class DAORunner(Runner):
         if filename is None:
             ext = dao_file_type.extension if dao_file_type else '.stars'
             filename = self._runner_dir_file_name(signature=random.random(), suffix=ext)
+        self.rm_from_runner_dir(filename)  # may be hardlink shared with clones, do not overwrite in place
         sl.write_dao_file(stars, os.path.join(str(self.dir), filename), dao_type=dao_file_type)
         return filename
 
@@ -3,9 +3,11 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 import os
+from copy import copy
 from .DAORunner import DAORunner
 from .OutputProviders import *
 from .config import find_opt_file
+from .PsfModel import subtract_stars
 import astwro.starlist as sl
 
 class Daophot(DAORunner):
@@ -41,9 +43,11 @@ class Daophot(DAORunner):
 
     """
 
+    _prompt = 'Command:'
+    _exit_command = 'EXIT\n'
 
-    def __init__(self, dir=None, image=None, daophotopt=None, options=None, batch=False):
-        # type: ([str,object], [str], [str], [list,dict], bool) -> Daophot
+    def __init__(self, dir=None, image=None, daophotopt=None, options=None, batch=False, preserve_process=None):
+        # type: ([str,object], [str], [str], [list,dict], bool, bool) -> Daophot
         """
         :param str dir:          pathname or TmpDir object - working directory for daophot,
                                    if None temp dir will be used and deleted on `Daophot.close()`
@@ -56,6 +60,9 @@ class Daophot(DAORunner):
                                    setting options property has same effect; list of tuples or dict.
                                    Do not set WATCH PROGRESS to sth else than -2
         :param bool batch:         whether Daophot have to work in batch mode.
+        :param bool preserve_process: if True, single `daophot` process is kept alive and executes all runs,
+                                   image is attached and options are set only when changed since previous run,
+                                   process hung after error is killed after :attr:`persistent_timeout`
 
 
         .. attribute:: dir
@@ -73,7 +80,11 @@ class Daophot(DAORunner):
         if options:
             self.options.update(dict(options))
 
-        super(Daophot, self).__init__(dir=dir, batch=batch)
+        # image and options in effect in persistent daophot process, see `preserve_process`
+        self._session_image = None
+        self._session_options = None
+
+        super(Daophot, self).__init__(dir=dir, batch=batch, preserve_process=preserve_process)
         # base implementation of __init__ calls `_reset` also
         self._update_executable('daophot')
 
@@ -100,22 +111,32 @@ class Daophot(DAORunner):
 
         new.image = deepcopy(self.image, memo)
         new.options = deepcopy(self.options, memo)
+        new._session_image = None
+        new._session_options = None
         return new
 
     def _pre_run(self, wait):
         super(Daophot, self)._pre_run(wait)
-        if self.options:
+        continues = self._continues_process
+        explicit_options = self.OPtion_result is not None  # OPtions enqueued in this batch
+        # enqueued at beginning, so first ATTACH then OPTION will be executed
+        if self.options and not (continues and self._session_options == self.options):
             self._enqueueOPtions(self.options, on_beginning=True)
-        if self.image:
+            if not explicit_options:
+                self._session_options = copy(self.options)
+        if self.image and not (continues and self._session_image == self.image):
             self._equeueATtach(self.image, on_beginning=True)
 
-        # just for consume options daophot presents on the beginning
-        opt_processor = DPOP_OPtion()
-        if self.OPtion_result is None:
-            self.OPtion_result = opt_processor
-        self._insert_processing_step('', output_processor=opt_processor, on_beginning=True)
-        # Empty lines to unhang daophot after error (otherwise it waits for corrected input)
-        self._insert_processing_step('\n\n\n')
+        if not continues:
+            # just for consume options daophot presents on the beginning
+            opt_processor = DPOP_OPtion()
+            if self.OPtion_result is None:
+                self.OPtion_result = opt_processor
+            self._insert_processing_step('', output_processor=opt_processor, on_beginning=True)
+        if not self.preserve_process:
+            # Empty lines to unhang daophot after error (otherwise it waits for corrected input)
+            # persistent process waiting for input after error is killed after `persistent_timeout` instead
+            self._insert_processing_step('\n\n\n')
 
     def _on_exit(self):
         pass
@@ -128,6 +149,8 @@ class Daophot(DAORunner):
 
     def _equeueATtach(self, image_file, on_beginning=False):
         # type: (str, bool) -> DPOP_ATtach
+        if not on_beginning or self.ATtach_result is None:  # explicit ATtach in batch is executed later
+            self._session_image = image_file
         image_file, _ = self._prepare_input_file(image_file)
         processor = DPOP_ATtach()
         self._insert_processing_step('ATTACH {}\n'.format(image_file),
@@ -221,6 +244,8 @@ class Daophot(DAORunner):
                                             # else options is list of pairs
             commands += ''.join('%s=%.2f\n' % (k,float(v)) for k,v in options if v is not None)
             commands += '\n'
+        if not on_beginning:
+            self._session_options = None  # explicit OPTION, session options differs from `options`
         processor = DPOP_OPtion()
         self._insert_processing_step(commands, output_processor=processor, on_beginning=on_beginning)
         if self.OPtion_result is None or not on_beginning:
@@ -461,10 +486,40 @@ class Daophot(DAORunner):
             self.run()
         return processor
 
+    def subtract_stars(self, subtract, leave_in=None, subtracted_image='is.fits', psf_file='i.psf'):
+        # type: ([str,sl.StarList], [str,sl.StarList], str, str) -> np.ndarray
+        """
+        Subtracts stars from image in process, numpy counterpart of :meth:`SUbstar`.
+
+        Executed immediately (also in batch mode), after completion of already enqueued commands,
+        without daophot process. Stars are subtracted from :attr:`image` (see :func:`subtract_stars`),
+        result can be attached for next commands:
+
+        >>> d.subtract_stars('i.als', leave_in='i.lst')
+        >>> d.ATtach('is')
+
+        :param subtract: relative to work dir pathname of stars to subtract file, or StarList
+        :param leave_in: relative to work dir pathname of stars to be kept file, or StarList (default: None)
+        :param subtracted_image: relative to work dir pathname of output fits file (default is.fits)
+        :param psf_file: relative to work dir pathname of file with PSF (default i.psf)
+        :return: image with stars subtracted
+        """
+        self._get_ready_for_commands()  # wait for completion of commands producing input files
+        if not self.image:
+            raise Daophot.RunnerValueError('subtract_stars requires image')
+        if isinstance(subtract, str):
+            subtract = self.absolute_path(subtract)
+        if isinstance(leave_in, str):
+            leave_in = self.absolute_path(leave_in)
+        with self.timings.measure('subtract stars'):
+            return subtract_stars(self.image, self.absolute_path(psf_file), subtract, leave_in=leave_in,
+                                  output=self.absolute_path(subtracted_image))
+
     def GRoup(self, photometry='i.ap', psf_file='i.psf', critical_overlap=0.1, groups_file='i.grp'):
         # type: ([str,sl.StarList], str, float, str) -> DpOp_GRoup
         """
         Runs (or adds to execution queue in batch mode) daophot GROUP command to execution stack.
+        For grouping in process, without daophot, see :meth:`astwro.starlist.StarList.group`.
         
         :param str,StarList photometry: stars to be grouped
         :param str psf_file: file with PSF
@@ -1,7 +1,10 @@
 import re
+import time
 from logging import *
 import astwro.starlist
 from astwro.starlist import read_dao_file
+from .PsfModel import read_psf_file
+from .Timings import process_cpu_time
 
 # TODO: check for failure on all providers (raise_if_error)
 
@@ -32,10 +35,15 @@ class OutputProvider(AbstractOutputProvider):
     # Base class for elements of stream processors chain
     #    also can be used as dummy processor in chain
 
+    prompts = 0  # number of command prompts presented by process at the end of processed output
+
     def __init__(self, prev_in_chain=None):
         self.__stream = None
         self._prev_in_chain = prev_in_chain # previous output provider
         self.logger = getLogger('ResultParser')
+        self.timings = None  # Timings of runner, set when enqueued
+        self.wall_time = None  #: wall time of command (consuming of it's output), None until processed
+        self.cpu_time = None  #: CPU time of process during command, None if not available
 
     def _consume(self, stream):
         """ to be overridden
@@ -45,10 +53,28 @@ class OutputProvider(AbstractOutputProvider):
 
     def get_output_stream(self):
         if self.__stream is None:
-            self.__stream = self._prev_in_chain.get_output_stream()
-            self._consume(self.__stream)
+            stream = self._prev_in_chain.get_output_stream()
+            pid = getattr(stream, 'pid', None)
+            cpu = process_cpu_time(pid)
+            start = time.time()
+            self.__stream = stream
+            self._consume(stream)
+            self.wall_time = time.time() - start
+            if cpu is not None:
+                end_cpu = process_cpu_time(pid)
+                self.cpu_time = end_cpu - cpu if end_cpu is not None else None
+            if self.timings is not None:
+                self.timings.add('command ' + type(self).__name__, self.wall_time, self.cpu_time)
         return self.__stream
 
+    def _read_dao_file(self, filename, **kwargs):
+        # read_dao_file recorded in runner's timings
+        start = time.time()
+        starlist = read_dao_file(filename, **kwargs)
+        if self.timings is not None:
+            self.timings.add('parse starlist', time.time() - start)
+        return starlist
+
     @property
     def success(self):
         """True if command succeed and output is ready """
@@ -92,13 +118,18 @@ class OutputLinesProcessor(OutputProvider):
 
 
 class OutputBufferedProcessor(OutputLinesProcessor):
-    __buffer = ''
+    # Collects lines of command output, joined into buffer once, on first request
+
+    def __init__(self, prev_in_chain=None):
+        self.__lines = []
+        self.__buffer = None
+        super(OutputBufferedProcessor, self).__init__(prev_in_chain=prev_in_chain)
 
     def _process_line(self, line, counter):
         """ processes line-by-line output
             return True if it's last line.
             If overridden, this base impl should be called """
-        self.__buffer += line
+        self.__lines.append(line)
         return self._is_last_one(line, counter)
 
     def _is_last_one(self, line, counter):
@@ -106,8 +137,12 @@ class OutputBufferedProcessor(OutputLinesProcessor):
             To be overridden """
 
     def get_buffer(self):
-        self.get_output_stream()  # tigers processing
-        self.logger.debug("Buffer of output obtained: " + self.__buffer)
+        """Output of the command, waits until command finishes if process is still running"""
+        if self.__buffer is None:
+            self.get_output_stream()  # triggers processing
+            self.__buffer = ''.join(self.__lines)
+            self.__lines = None
+            self.logger.debug("Buffer of output obtained: %s", self.__buffer)
         return self.__buffer
 
 # Daophot regexps:
@@ -146,6 +181,7 @@ r_alls = re.compile(r'(\d+) +(\d+) +(\d+) +(\d+).*\n')
 #  DAOPHOT
 
 class DaophotCommandOutputProcessor(OutputBufferedProcessor):
+    prompts = 1
 
     def _is_last_one(self, line, counter):
         return r_command.search(line) is not None
@@ -212,7 +248,7 @@ class DpOp_FInd(DaophotCommandOutputProcessor):
     def found_starlist(self):
         """StarList with found stars"""
         if self.__starlist is None and self.starlist_file:
-            self.__starlist = read_dao_file(self.starlist_file)
+            self.__starlist = self._read_dao_file(self.starlist_file)
         return self.__starlist
 
     @property
@@ -289,7 +325,7 @@ class DpOp_PHotometry(DaophotCommandOutputProcessor):
         :rtype: astwro.starlist.StarList 
         """
         if self.__starlist is None and self.photometry_file:
-            self.__starlist = read_dao_file(self.photometry_file)
+            self.__starlist = self._read_dao_file(self.photometry_file)
         return self.__starlist
 
 
@@ -317,7 +353,7 @@ class DpOp_PIck(DaophotCommandOutputProcessor):
     def picked_starlist(self):
         """StarList with picked stars"""
         if self.__starlist is None and self.picked_stars_file:
-            self.__starlist = read_dao_file(self.picked_stars_file)
+            self.__starlist = self._read_dao_file(self.picked_stars_file)
         return self.__starlist
 
 
@@ -328,16 +364,30 @@ class DpOp_PSf(DaophotCommandOutputProcessor):
         self.__data = None
         self.__errors = None
         self.__neilist = None
+        self.__psf = None
         self.psf_file = psf_file  #: Patch to output file with PSF function
         self.nei_file = nei_file  #: Patch to output neighbours file 
         self.err_file = err_file  #: Patch to output errors file
         super(DpOp_PSf, self).__init__(prev_in_chain=prev_in_chain)
 
+    @property
+    def psf(self):
+        """PSF model read from :attr:`psf_file`, evaluated in numpy
+
+        :rtype: PsfModel
+        """
+        if self.__psf is None and self.psf_file:
+            start = time.time()
+            self.__psf = read_psf_file(self.psf_file)
+            if self.timings is not None:
+                self.timings.add('parse psf', time.time() - start)
+        return self.__psf
+
     @property
     def nei_starlist(self):
         """StarList with neighbours stars"""
         if self.__neilist is None and self.nei_file:
-            self.__neilist = read_dao_file(self.nei_file)
+            self.__neilist = self._read_dao_file(self.nei_file)
         return self.__neilist
 
     @property
@@ -442,7 +492,7 @@ class DpOp_NEda(DaophotCommandOutputProcessor):
     def neda_starlist(self):
         """stars list with neda photometry"""
         if self.__nedalist is None and self.neda_file:
-            self.__nedalist = read_dao_file(self.neda_file)
+            self.__nedalist = self._read_dao_file(self.neda_file)
         return self.__nedalist
 
 
@@ -494,7 +544,7 @@ class AsOp_result(OutputBufferedProcessor):
         # type: () -> {astwro.starlist.StarList}
         """StarList of stars with profile photometry results        """
         if self.__als_stars is None and self.profile_photometry_file:
-            self.__als_stars = read_dao_file(self.profile_photometry_file)
+            self.__als_stars = self._read_dao_file(self.profile_photometry_file, engine='numpy')
         return self.__als_stars
 
 
@@ -0,0 +1,356 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import re
+import numpy as np
+
+from astwro.starlist import read_dao_file
+
+__all__ = ['PsfModel', 'read_psf_file', 'subtract_stars']
+
+_NUMBER = re.compile(r'[-+]?\d+\.?\d*(?:[eEdD][-+]?\d+)?')
+_LN2 = np.log(2.0)
+_CHUNK_PIXELS = 2 ** 21  # stars are rendered in chunks of about that many pixels
+
+# 4-point Gauss-Legendre quadrature over pixel [-0.5, 0.5]
+_GL_X = np.array([-0.4305681557970262, -0.1699905217924281, 0.1699905217924281, 0.4305681557970262])
+_GL_W = np.array([0.1739274225687269, 0.3260725774312731, 0.3260725774312731, 0.1739274225687269])
+
+
+def read_psf_file(filename):
+    """
+    Reads daophot PSF file (e.g. ``i.psf`` created by daophot PSF command)
+
+    :param str filename: PSF file
+    :rtype: PsfModel
+    """
+    with open(filename) as f:
+        header = f.readline()
+        params = f.readline()
+        table = f.read()
+    fields = header.split()
+    label = fields[0]
+    npsf, npar, nexp, nfrac = [int(v) for v in fields[1:5]]
+    psfmag, bright, xpsf, ypsf = [float(v) for v in fields[5:9]]
+    # Fortran E format may glue negative numbers together, find numbers by regexp
+    par = [float(v.upper().replace('D', 'E')) for v in _NUMBER.findall(params)][:npar]
+    values = np.array([v.upper().replace('D', 'E') for v in _NUMBER.findall(table)], dtype=np.float64)
+    nterm = max(nexp, 0) + nfrac
+    if len(values) < nterm * npsf * npsf:
+        raise ValueError('PSF file {} truncated: {} lookup table values, {} expected'.format(
+            filename, len(values), nterm * npsf * npsf))
+    tables = values[:nterm * npsf * npsf].reshape(nterm, npsf, npsf)
+    return PsfModel(label, par, tables, psfmag, bright, xpsf, ypsf, nexp=nexp, nfrac=nfrac)
+
+
+class PsfModel(object):
+    """
+    Daophot PSF model: analytic profile plus look-up tables of corrections, constant or variable
+    with position in the image (see :func:`read_psf_file`).
+
+    Model is evaluated in numpy as daophot does (function USEPSF): analytic profile integrated over pixels
+    and bicubic interpolation of look-up tables (tabulated at half-pixel spacing), vectorized over
+    many points and stars. Coordinates are daophot ones: center of the pixel ``image[j, i]`` is at
+    ``(i + 1, j + 1)``.
+
+    >>> psf = read_psf_file('i.psf')
+    >>> residuals = psf.subtract(image, als_stars)
+
+    :var str label: analytic profile: 'GAUSSIAN', 'MOFFAT15', 'MOFFAT25', 'MOFFAT35', 'LORENTZ', 'PENNY1', 'PENNY2'
+    :var list par: parameters of analytic profile, e.g. HWHM in x and y for Gaussian
+    :var np.ndarray tables: look-up tables of shape (terms, NPSF, NPSF)
+    :var float psfmag: magnitude of star of model brightness
+    :var float bright: height of analytic profile for `psfmag` star
+    :var float radius: radius of the model (look-up tables coverage) in pixels
+    """
+
+    def __init__(self, label, par, tables, psfmag, bright, xpsf, ypsf, nexp=1, nfrac=0):
+        """
+        :param str label: analytic profile name
+        :param list par: parameters of analytic profile
+        :param np.ndarray tables: look-up tables of shape (nexp + nfrac, NPSF, NPSF)
+        :param float psfmag: magnitude of star of model brightness
+        :param float bright: height of analytic profile
+        :param float xpsf: x of image center, reference of variable PSF expansion
+        :param float ypsf: y of image center
+        :param int nexp: number of position dependent terms: 0 (only analytic), 1 (constant), 3 or 6 (variable)
+        :param int nfrac: number of pixel phase dependent terms: 0 or 5
+        """
+        if label.upper() not in _PROFILES:
+            raise ValueError('Unknown analytic PSF profile: {}'.format(label))
+        self.label = label.upper()
+        self.par = list(par)
+        self.tables = np.asarray(tables, dtype=np.float64)
+        self.psfmag = psfmag
+        self.bright = bright
+        self.xpsf = xpsf
+        self.ypsf = ypsf
+        self.nexp = nexp
+        self.nfrac = nfrac
+        self.npsf = self.tables.shape[-1] if self.tables.size else 0
+        # bicubic interpolation needs columns LX-1..LX+2 of table
+        self.radius = (self.npsf - 3) / 4.0 if self.npsf else float('inf')
+
+    def __repr__(self):
+        return 'PsfModel({}, par={}, terms={}, npsf={})'.format(self.label, self.par, len(self.tables), self.npsf)
+
+    def evaluate(self, dx, dy, x=None, y=None):
+        """
+        Model values at offsets from star center, for star of magnitude :attr:`psfmag`.
+        Arguments are broadcast against each other, e.g. (stars, 1) `x` and (stars, pixels) `dx`.
+
+        :param dx: x offsets of pixels centers from star center
+        :param dy: y offsets of pixels centers from star center
+        :param x: x of star, required for variable PSF
+        :param y: y of star, required for variable PSF
+        :return: array of model values, 0 outside of :attr:`radius`
+        """
+        dx = np.asarray(dx, dtype=np.float64)
+        dy = np.asarray(dy, dtype=np.float64)
+        dx, dy = np.broadcast_arrays(dx, dy)
+        inside = dx ** 2 + dy ** 2 < self.radius ** 2
+        dx = np.where(inside, dx, 0.0)
+        dy = np.where(inside, dy, 0.0)
+        value = self.bright * _PROFILES[self.label](dx, dy, self.par)
+        if len(self.tables):
+            size = self.npsf * self.npsf
+            for k, term in enumerate(self.__terms(dx, dy, x, y)):
+                value = value + term * self.__interpolate(self.tables.ravel(), k * size, dx, dy)
+        return np.where(inside, value, 0.0)
+
+    def __interpolate(self, tables, base, dx, dy):
+        # bicubic interpolation in look-up table starting at index `base` of flat `tables`
+        middle = (self.npsf + 1) // 2
+        xx = 2.0 * dx + middle  # Fortran indices of table
+        yy = 2.0 * dy + middle
+        lx = np.floor(xx).astype(np.int64)
+        ly = np.floor(yy).astype(np.int64)
+        return _bicubic(tables, base + (ly - 2) * self.npsf + lx - 2, self.npsf, xx - lx, yy - ly)
+
+    def __terms(self, dx, dy, x, y):
+        # coefficients of look-up tables: position dependent expansion and pixel phase terms
+        terms = []
+        if self.nexp >= 1:
+            terms.append(1.0)
+        if self.nexp >= 3:
+            if x is None or y is None:
+                raise ValueError('Star position (x, y) required for variable PSF')
+            deltax = (np.asarray(x, dtype=np.float64) - 1.0) / self.xpsf - 1.0
+            deltay = (np.asarray(y, dtype=np.float64) - 1.0) / self.ypsf - 1.0
+            terms += [deltax, deltay]
+            if self.nexp >= 6:
+                terms += [1.5 * deltax ** 2 - 0.5, deltax * deltay, 1.5 * deltay ** 2 - 0.5]
+        if self.nfrac > 0:
+            fx = -2.0 * (dx - np.round(dx))
+            fy = -2.0 * (dy - np.round(dy))
+            terms += [fx, fy, 1.5 * fx ** 2 - 0.5, fx * fy, 1.5 * fy ** 2 - 0.5]
+        return terms
+
+    def render(self, stars, shape, radius=None):
+        """
+        Image of stars: sum of models scaled by magnitudes.
+
+        :param stars: StarList (or DataFrame) with `x`, `y` and `mag` columns, stars with NaN values are skipped
+        :param tuple shape: (rows, columns) of the image
+        :param float radius: radius of rendered model, default and max: :attr:`radius`
+        :rtype: np.ndarray
+        """
+        ny, nx = shape
+        radius = self.radius if radius is None else min(radius, self.radius)
+        x = np.asarray(stars.x, dtype=np.float64)
+        y = np.asarray(stars.y, dtype=np.float64)
+        scale = 10.0 ** (-0.4 * (np.asarray(stars.mag, dtype=np.float64) - self.psfmag))
+        valid = np.isfinite(x) & np.isfinite(y) & np.isfinite(scale)
+        x, y, scale = x[valid], y[valid], scale[valid]
+        r = int(np.ceil(radius)) + 1
+        oy, ox = np.mgrid[-r:r + 1, -r:r + 1]
+        disk = ox ** 2 + oy ** 2 <= (radius + 1) ** 2
+        ox, oy = ox[disk][np.newaxis, :], oy[disk][np.newaxis, :]
+        image = np.zeros(ny * nx)
+        size = self.npsf * self.npsf
+        chunk = max(1, min(_CHUNK_PIXELS // ox.size, _CHUNK_PIXELS // max(size, 1)))
+        for start in range(0, len(x), chunk):
+            xs, ys = x[start:start + chunk, np.newaxis], y[start:start + chunk, np.newaxis]
+            px = np.floor(xs + 0.5).astype(np.int64) + ox  # pixels around star, daophot coordinates
+            py = np.floor(ys + 0.5).astype(np.int64) + oy
+            dx, dy = px - xs, py - ys
+            use = (px >= 1) & (px <= nx) & (py >= 1) & (py <= ny) & (dx ** 2 + dy ** 2 < radius ** 2)
+            dx, dy = np.where(use, dx, 0.0), np.where(use, dy, 0.0)
+            if self.label == 'GAUSSIAN':  # separable: integrals over columns and rows of pixels
+                rows = np.arange(len(xs))[:, np.newaxis]
+                gx = _gauss_integral(np.arange(-r, r + 1) + (np.floor(xs + 0.5) - xs), self.par[0])
+                gy = _gauss_integral(np.arange(-r, r + 1) + (np.floor(ys + 0.5) - ys), self.par[1])
+                values = self.bright / (self.par[0] * self.par[1]) * gx[rows, ox + r] * gy[rows, oy + r]
+            else:
+                values = self.bright * _PROFILES[self.label](dx, dy, self.par)
+            if len(self.tables) and not self.nfrac:
+                # terms depend on star position only: one combined table per star
+                terms = np.array(np.broadcast_arrays(*self.__terms(dx, dy, xs, ys)))[:, :, 0]
+                combined = np.dot(terms.T, self.tables.reshape(len(self.tables), size))
+                # pixels are on lattice of table (step 2): interpolation weights are the same for all
+                # pixels of star, table indices are integer offsets
+                middle = (self.npsf + 1) // 2
+                bx = 2.0 * (np.floor(xs + 0.5) - xs) + middle
+                by = 2.0 * (np.floor(ys + 0.5) - ys) + middle
+                lx, ly = np.floor(bx), np.floor(by)
+                corner = (2 * oy + ly.astype(np.int64) - 2) * self.npsf + 2 * ox + lx.astype(np.int64) - 2
+                corner = np.where(use, corner, (middle - 2) * self.npsf + middle - 2)
+                corner += np.arange(len(xs))[:, np.newaxis] * size
+                values = values + _bicubic(combined.ravel(), corner, self.npsf, bx - lx, by - ly)
+            elif len(self.tables):
+                values = self.evaluate(dx, dy, xs, ys)
+            values = values * scale[start:start + chunk, np.newaxis]
+            image += np.bincount(((py - 1) * nx + px - 1)[use], weights=values[use], minlength=ny * nx)
+        return image.reshape(ny, nx)
+
+    def subtract(self, image, stars, radius=None):
+        """
+        Subtracts stars from image, numpy counterpart of daophot SUBSTAR
+
+        :param np.ndarray image: image
+        :param stars: StarList with `x`, `y` and `mag` columns
+        :param float radius: radius of subtracted model, default: :attr:`radius`
+        :return: new image with stars subtracted
+        :rtype: np.ndarray
+        """
+        return np.asarray(image, dtype=np.float64) - self.render(stars, np.shape(image), radius)
+
+
+def subtract_stars(image, psf, stars, leave_in=None, output=None, radius=None):
+    """
+    Subtracts stars from image in one vectorized pass, numpy replacement of daophot SUBSTAR.
+
+    As in SUBSTAR, stars of `leave_in` list (matched by id) are not subtracted.
+    Image file is memory-mapped, result is written (if `output` provided) as 32-bit float FITS
+    with header of the source image.
+
+    >>> subtract_stars('NGC6871.fits', 'i.psf', 'i.als', leave_in='i.lst', output='is.fits')
+
+    :param image: FITS file or image array
+    :param psf: daophot PSF file or :class:`PsfModel`
+    :param stars: StarList or daophot file of stars to subtract
+    :param leave_in: StarList, daophot file or ids of stars to be kept
+    :param str output: FITS file for result, overwritten if exists
+    :param float radius: radius of subtracted model, default: :attr:`PsfModel.radius`
+    :return: image with stars subtracted
+    :rtype: np.ndarray
+    """
+    from astropy.io import fits
+    if not isinstance(psf, PsfModel):
+        psf = read_psf_file(psf)
+    stars = _starlist(stars)
+    if leave_in is not None:
+        if isinstance(leave_in, (str, type(u''))) or hasattr(leave_in, 'columns'):
+            leave_in = _starlist(leave_in).id
+        stars = stars[~np.in1d(np.asarray(stars.id), np.asarray(leave_in))]
+    header = None
+    if isinstance(image, (str, type(u''))):
+        try:
+            image, header = fits.getdata(image, header=True, memmap=True)
+        except ValueError:  # scaled (BZERO/BSCALE) integer image can not be memory-mapped
+            image, header = fits.getdata(image, header=True, memmap=False)
+    result = psf.subtract(image, stars, radius)
+    if output is not None:
+        if os.path.lexists(output):
+            os.remove(output)  # may be hardlink shared with other runner directories
+        fits.PrimaryHDU(result.astype(np.float32), header=header).writeto(output)
+    return result
+
+
+def _starlist(stars):
+    # StarList from daophot file, with `id` column
+    if isinstance(stars, (str, type(u''))):
+        stars = read_dao_file(stars)
+    if 'id' not in stars.columns:
+        stars = stars.assign(id=stars.index)
+    return stars
+
+
+def _bicubic(tables, corner, npsf, tx, ty):
+    # daophot's BICUBC interpolation (Catmull-Rom spline) in table of width npsf,
+    # between the second and the third of 4x4 values starting at flat index `corner`
+    wx = _cubic_weights(tx)
+    wy = _cubic_weights(ty)
+    value = 0.0
+    for m in range(4):
+        row = 0.0
+        for n in range(4):
+            row = row + wx[n] * tables.take(corner + (m * npsf + n))
+        value = value + wy[m] * row
+    return value
+
+
+def _cubic_weights(t):
+    # weights of four table values for interpolation at t in [0, 1) between the second and the third
+    t2 = t * t
+    t3 = t2 * t
+    return (-0.5 * t + t2 - 0.5 * t3,
+            1.0 - 2.5 * t2 + 1.5 * t3,
+            0.5 * t + 2.0 * t2 - 1.5 * t3,
+            -0.5 * t2 + 0.5 * t3)
+
+
+def _pixel_integral(fn, dx, dy):
+    # integral of fn(x, y) over pixel centered at (dx, dy), Gauss-Legendre quadrature
+    total = 0.0
+    for xi, wi in zip(_GL_X, _GL_W):
+        for yj, wj in zip(_GL_X, _GL_W):
+            total = total + wi * wj * fn(dx + xi, dy + yj)
+    return total
+
+
+def _gauss_integral(d, hwhm):
+    # integral of exp(-ln2 (x / hwhm)^2) over pixel centered at d
+    from scipy.special import erf
+    c = np.sqrt(_LN2) / hwhm
+    return 0.5 * np.sqrt(np.pi) / c * (erf(c * (d + 0.5)) - erf(c * (d - 0.5)))
+
+
+def _gaussian(dx, dy, par):
+    return _gauss_integral(dx, par[0]) * _gauss_integral(dy, par[1]) / (par[0] * par[1])
+
+
+def _moffat(beta):
+    # Moffat function (beta - 1) / (ax ay [1 + alpha ((x/p1)^2 + (y/p2)^2 + xy p3)]^beta), where
+    # p1, p2 are half widths at half maximum: ax^2 = p1^2 / alpha, alpha = 2^(1/beta) - 1,
+    # alpha scales the cross term too, as in daophot's PROFIL
+    def profile(dx, dy, par):
+        alpha = 2.0 ** (1.0 / beta) - 1.0
+        p1sq, p2sq = par[0] ** 2, par[1] ** 2
+        norm = (beta - 1.0) * alpha / (par[0] * par[1])
+        return _pixel_integral(
+            lambda x, y: norm / (1.0 + alpha * (x * x / p1sq + y * y / p2sq + x * y * par[2])) ** beta, dx, dy)
+    return profile
+
+
+def _lorentz(dx, dy, par):
+    return _pixel_integral(
+        lambda x, y: 1.0 / (1.0 + x * x / par[0] ** 2 + y * y / par[1] ** 2 + x * y * par[2]), dx, dy)
+
+
+def _penny(tilted):
+    # Gaussian core (fraction p3) plus Lorentzian wings, Gaussian tilted by p4 in both;
+    # Lorentzian elongated along x or y in PENNY1, tilted by p5 in PENNY2
+    def profile(dx, dy, par):
+        p1sq, p2sq = par[0] ** 2, par[1] ** 2
+        gxy = par[3]
+        lxy = par[4] if tilted else 0.0
+
+        def fn(x, y):
+            rsq = x * x / p1sq + y * y / p2sq
+            return par[2] * np.exp(-_LN2 * (rsq + x * y * gxy)) + (1.0 - par[2]) / (1.0 + rsq + x * y * lxy)
+        return _pixel_integral(fn, dx, dy)
+    return profile
+
+
+_PROFILES = {
+    'GAUSSIAN': _gaussian,
+    'MOFFAT15': _moffat(1.5),
+    'MOFFAT25': _moffat(2.5),
+    'MOFFAT35': _moffat(3.5),
+    'LORENTZ': _lorentz,
+    'PENNY1': _penny(False),
+    'PENNY2': _penny(True),
+}
@@ -0,0 +1,170 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import shutil
+import hashlib
+import threading
+from tempfile import mkdtemp
+
+from astwro.utils import link_or_copy
+
+_OUTPUT = 'stdout.txt'
+_ERRORS = 'stderr.txt'
+_FILES = 'files'
+
+_digests = {}  # (path, size, mtime, inode) -> digest, avoids re-hashing of unchanged (e.g. image) files
+_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    """
+    Returns SHA1 hex digest of file content, 'missing' if file does not exist.
+
+    Digests are memorized by file size, modification time and inode, so unchanged files are hashed once.
+
+    :param str path: file path, symlinks are followed
+    :rtype: str
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 'missing'
+    sig = (os.path.realpath(path), st.st_size, st.st_mtime, st.st_ino)
+    with _digests_lock:
+        digest = _digests.get(sig)
+    if digest is None:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        with _digests_lock:
+            _digests[sig] = digest
+    return digest
+
+
+class ResultsCache(object):
+    """
+    Disk cache of runners results: output (stdout, stderr) and output files of commands, stored under
+    content based keys (see :meth:`Runner.run`).
+
+    Size of cache directory is bounded by `max_size`, least recently used entries are evicted.
+    Cache directory can be shared by many runners and processes.
+
+    Files are restored into runner directory as hardlinks to cache entries (if on the same filesystem),
+    as runners never modify files in place.
+
+    >>> d = Daophot(image=fits_image())
+    >>> d.results_cache = ResultsCache('~/.cache/pydaophot/results')
+    >>> d.FInd()  # executed first time only, restored from cache later
+
+    :var int hits: number of restored results
+    :var int misses: number of lookups for not cached results
+    """
+
+    def __init__(self, directory, max_size=1024 ** 3):
+        """
+        :param str directory: cache directory, created if not exists
+        :param int max_size: max size of cache directory in bytes
+        """
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def __repr__(self):
+        return 'ResultsCache({}, hits={}, misses={})'.format(self.directory, self.hits, self.misses)
+
+    def __entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key, target_dir):
+        """
+        Restores result: output files of entry `key` are placed into `target_dir`, replacing existing ones.
+
+        :param str key: entry key
+        :param str target_dir: directory for output files
+        :return: tuple (stdout, stderr) or None if there is no such entry
+        """
+        entry = self.__entry(key)
+        try:
+            with open(os.path.join(entry, _OUTPUT), 'rb') as f:
+                output = f.read().decode(encoding='ascii')
+            with open(os.path.join(entry, _ERRORS), 'rb') as f:
+                errors = f.read().decode(encoding='ascii')
+            for name in os.listdir(os.path.join(entry, _FILES)):
+                dst = os.path.join(target_dir, name)
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                link_or_copy(os.path.join(entry, _FILES, name), dst)
+            os.utime(entry, None)  # recently used
+        except (IOError, OSError):  # no entry, or evicted meanwhile
+            with self.__lock:
+                self.misses += 1
+            return None
+        with self.__lock:
+            self.hits += 1
+        return output, errors
+
+    def put(self, key, output, errors, source_dir, files):
+        """
+        Stores result under `key` and evicts least recently used entries if cache exceeds `max_size`
+
+        :param str key: entry key
+        :param str output: stdout of process
+        :param str errors: stderr of process
+        :param str source_dir: directory of output files
+        :param files: names of output files in `source_dir`, missing ones are skipped
+        """
+        tmp = mkdtemp(prefix='.tmp', dir=self.directory)
+        try:
+            with open(os.path.join(tmp, _OUTPUT), 'wb') as f:
+                f.write(output.encode(encoding='ascii'))
+            with open(os.path.join(tmp, _ERRORS), 'wb') as f:
+                f.write(errors.encode(encoding='ascii'))
+            os.mkdir(os.path.join(tmp, _FILES))
+            for name in files:
+                src = os.path.join(source_dir, name)
+                if os.path.isfile(src):
+                    link_or_copy(src, os.path.join(tmp, _FILES, name))
+            os.rename(tmp, self.__entry(key))
+        except (IOError, OSError):  # e.g. stored meanwhile by another runner
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self, max_size=None):
+        """
+        Removes least recently used entries until size of cache is below `max_size`
+
+        :param int max_size: size limit in bytes, default: :attr:`max_size`
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = []
+        total = 0
+        for key in os.listdir(self.directory):
+            entry = self.__entry(key)
+            if key.startswith('.tmp') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(root, f)) for root, _, fs in os.walk(entry) for f in fs)
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:  # evicted meanwhile
+                continue
+            total += size
+        entries.sort()
+        for _, size, entry in entries:
+            if total <= max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Removes all entries"""
+        self.evict(max_size=0)
@@ -3,29 +3,175 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 import os
-import sys
+import re
+import time
 import shutil
 import hashlib
+import threading
 from copy import deepcopy
 try:
-    # noinspection PyCompatibility
-    from StringIO import StringIO  # python2
+    import Queue as queue  # python2
 except ImportError:
-    from io import StringIO  # python3
+    import queue  # python3
 import subprocess as sp
-try:
-    # noinspection PyUnresolvedReferences
-    from subprocess import TimeoutExpired  # python 3 only
-except ImportError:
-    pass
 
 #from . import logger as module_logger
 from .logger import logger as module_logger
 from .OutputProviders import StreamKeeper, OutputProvider
-from .config import dao_config
+from .config import dao_config, runners_base_dir, results_cache
+from .ResultsCache import file_digest
+from .Timings import Timings, process_cpu_time, wait_process
 from astwro.utils import tmpdir, TmpDir
 
 
+def _line_end(prompt):
+    # regexp of line end: newline or command prompt (bytes)
+    if prompt:
+        return re.compile(b'\n|' + re.escape(prompt.encode(encoding='ascii')))
+    return re.compile(b'\n')
+
+
+def _find_executable(executable):
+    # absolute path of executable, None if not found
+    try:
+        from shutil import which  # python3
+    except ImportError:
+        from distutils.spawn import find_executable as which
+    path = which(executable)
+    return os.path.realpath(path) if path else None
+
+
+class _ProcessOutput(object):
+    """
+    Lines of underlying process stdout, iterated by output processors chain while process is running.
+
+    Output is read by background thread as soon as it is produced, line ends with newline or command prompt,
+    so output of the command is complete when it's prompt appears. Reading stops on process exit (EOF)
+    or when `expected_prompts` prompts were presented (persistent process).
+    """
+
+    def __init__(self, process, prompt=None, expected_prompts=None, timeout=None, on_timeout=None):
+        self.eof = False  #: True if process closed stdout
+        self.__timeout = timeout
+        self.__on_timeout = on_timeout
+        self.__prompt = prompt.encode(encoding='ascii') if prompt else None
+        self.__expected = expected_prompts
+        self.__line_end = _line_end(prompt)
+        self.__chunks = []
+        self.__lines = queue.Queue()
+        self.__finished = False
+        self.pid = process.pid  #: process id, for CPU time measurement
+        self.__thread = threading.Thread(target=self.__pump, args=(process.stdout.fileno(),),
+                                         name='pydaophot-stdout')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __pump(self, fd):
+        pending = b''
+        prompts = 0
+        try:
+            while self.__expected is None or prompts < self.__expected:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    self.eof = True
+                    break
+                self.__chunks.append(chunk)
+                pending += chunk
+                start = 0
+                for m in self.__line_end.finditer(pending):
+                    self.__lines.put(pending[start:m.end()].decode(encoding='ascii'))
+                    start = m.end()
+                    if m.group() == self.__prompt:
+                        prompts += 1
+                pending = pending[start:]
+        except (IOError, OSError, ValueError):  # stream closed, process killed
+            self.eof = True
+        finally:
+            if pending:
+                self.__lines.put(pending.decode(encoding='ascii'))
+            self.__lines.put(None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.__finished:
+            raise StopIteration
+        try:
+            line = self.__lines.get(True, self.__timeout) if self.__timeout else self.__lines.get()
+        except queue.Empty:
+            self.__on_timeout()
+            raise
+        if line is None:
+            self.__finished = True
+            raise StopIteration
+        return line
+
+    next = __next__  # python2
+
+    def read_all(self):
+        """Waits for end of reading, returns whole output"""
+        for _ in self:
+            pass
+        self.__thread.join()
+        return b''.join(self.__chunks).decode(encoding='ascii')
+
+
+class _RecordedOutput(object):
+    """Lines of recorded output (e.g. restored from :class:`ResultsCache`), split as in :class:`_ProcessOutput`"""
+
+    eof = True
+    pid = None
+
+    def __init__(self, output, prompt=None):
+        self.__output = output
+        text = output.encode(encoding='ascii')
+        ends = [m.end() for m in _line_end(prompt).finditer(text)]
+        if not ends or ends[-1] < len(text):
+            ends.append(len(text))
+        self.__lines = iter([text[s:e].decode(encoding='ascii') for s, e in zip([0] + ends[:-1], ends)])
+
+    def __iter__(self):
+        return self.__lines
+
+    def read_all(self):
+        """Returns whole output"""
+        for _ in self.__lines:
+            pass
+        return self.__output
+
+
+class _ErrorsDrain(object):
+    """Collects stderr of process by background thread for process lifetime"""
+
+    def __init__(self, process):
+        self.__chunks = []
+        self.__taken = 0
+        self.__thread = threading.Thread(target=self.__drain, args=(process.stderr.fileno(),),
+                                         name='pydaophot-stderr')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __drain(self, fd):
+        try:
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    return
+                self.__chunks.append(chunk)
+        except (IOError, OSError, ValueError):  # stream closed
+            pass
+
+    def take(self, wait=False):
+        """Returns stderr output collected since previous call, if `wait` - waits for EOF first"""
+        if wait:
+            self.__thread.join()
+        n = len(self.__chunks)
+        chunks = self.__chunks[self.__taken:n]
+        self.__taken = n
+        return b''.join(chunks).decode(encoding='ascii')
+
+
 class Runner(object):
     """
     Base class for specific runners.
@@ -51,17 +197,32 @@ class Runner(object):
         pass
 
     raise_on_nonzero_exitcode = True
-    preserve_process = False  # not implemented
+    preserve_process = False  #: keep underlying process alive between runs, see :meth:`run`
+    persistent_timeout = 300  #: seconds of silence of persistent process after which it is killed as hung, None: never
+    _prompt = None  # command prompt of underlying process, required for `preserve_process`
+    _exit_command = ''  # command which terminates persistent process gracefully
 
-    def __init__(self, dir=None, batch=False):
+    def __init__(self, dir=None, batch=False, preserve_process=None):
         """
         :param dir: path name or TmpDir object, in not provided new temp dir will be used
         :param bool batch:      whether Daophot have to work in batch mode.
+        :param bool preserve_process: whether underlying process have to be kept alive between runs,
+                                if None, class default :attr:`preserve_process` is used
         """
         self.logger = module_logger.getChild(type(self).__name__)
         self.executable = None
         self.batch_mode = batch
         self.__stream_keeper = None
+        self.__persistent_process = None
+        self.__errors = None  # stderr collector of current process
+        self.__continues_process = False
+        self.written_bytes = 0  #: peak size of files written by runner into runner directory, updated by runs
+        self.results_cache = results_cache()  #: :class:`ResultsCache` of runs results or None, see :meth:`run`
+        self.timings = Timings()  #: :class:`Timings` of stages of runs
+        if preserve_process is not None:
+            self.preserve_process = preserve_process
+        if self.preserve_process and self._prompt is None:
+            raise Runner.RunnerValueError('{} does not support preserve_process mode'.format(type(self).__name__))
 
         self._prepare_dir(dir)
         self._reset()
@@ -74,6 +235,10 @@ class Runner(object):
         self.returncode = None
         self.__process = None
         self.__commands = ''
+        self.__files = set(), set()  # local names of (input, output) files of queued commands
+        self.__results_key = None
+        self.__run_start = None  # wall time of run start
+        self.__process_start = None  # (wall time, process CPU time) when process takes commands
         self.ext_output_files = set()
 
         if self.__stream_keeper is not None:
@@ -89,9 +254,17 @@ class Runner(object):
         memo[id(self)] = new
 
         new.__stream_keeper = None
+        new.__persistent_process = None  # clone starts it's own process
+        new.__errors = None
+        new.written_bytes = 0
+        new.results_cache = self.results_cache
+        new.timings = Timings()
+        new.__continues_process = False
         new._reset()
         new.logger = self.logger
         new.executable = self.executable
+        new.preserve_process = self.preserve_process
+        new.persistent_timeout = self.persistent_timeout
         # new.output = self.output
         # new.stderr = self.stderr
         # new.returncode = self.returncode
@@ -121,14 +294,57 @@ class Runner(object):
 
         If *runner directory* was provided in constructor, clone will share the same dir, else, if
         *runner directory* is temp dir created implicitly by runner, clone will create it's own one, and
-        content of *runner directory* will be copied from source to clone."""
+        content of *runner directory* will be cloned from source: files are hardlinked (symlinks recreated),
+        so cloning does not depend on files sizes. Runners replace files rather than modify them in place,
+        so source and clone do not affect each other, see :func:`astwro.utils.clone_tree`."""
         return deepcopy(self)
 
     def close(self):
         """Cleans things up."""
         self._on_exit()
+        self.stop_process()
         self.dir = None
 
+    def stop_process(self):
+        """Terminates persistent underlying process (if any), see :attr:`preserve_process`.
+
+        Next run will start new process."""
+        process = getattr(self, '_Runner__persistent_process', None)
+        if process is None:
+            return
+        self.__persistent_process = None
+        if process.poll() is None:
+            try:
+                if self._exit_command:
+                    process.stdin.write(self._exit_command.encode(encoding='ascii'))
+                process.stdin.close()
+            except (IOError, OSError, ValueError):
+                pass
+            for _ in range(20):  # give process a while to finish gracefully
+                if process.poll() is not None:
+                    break
+                time.sleep(0.05)
+            else:
+                process.kill()
+                process.wait()
+        for stream in (process.stdin, process.stdout, process.stderr):
+            try:
+                stream.close()
+            except (IOError, OSError, ValueError):
+                pass
+
+    @property
+    def process_alive(self):
+        """Whether persistent underlying process (see :attr:`preserve_process`) is alive,
+        and will execute next run"""
+        return self.__persistent_process is not None and self.__persistent_process.poll() is None
+
+    @property
+    def _continues_process(self):
+        """True if current run is executed by the same process as previous one.
+        Subclasses can check it in `_pre_run` to skip session setup (e.g. initial outputs)"""
+        return self.__continues_process
+
     @property
     def mode(self):
         """Either "normal" or "batch". In batch mode, commands are not executed but collected
@@ -156,7 +372,9 @@ class Runner(object):
 
     def _prepare_dir(self, dir=None, init_files=True):
         if dir is None:
-            dir = tmpdir(prefix='pydaophot_tmp')
+            # clones hardlink files: runner never modifies files in place, outputs are removed before commands
+            base_dirs, min_free = runners_base_dir()
+            dir = tmpdir(prefix='pydaophot_tmp', base_dir=base_dirs, min_free=min_free, clone_mode='link')
         elif isinstance(dir, str):
             dir = tmpdir(use_existing=dir)
         elif not isinstance(dir, TmpDir):
@@ -168,8 +386,10 @@ class Runner(object):
     def copy_to_runner_dir(self, source, filename=None):
         """Copies source file to  runner dir under name filename or the same
         as original if filename is None. Overwrites existing file."""
-        dst = self.dir.path if filename is None else os.path.join(self.dir.path, filename)
-        shutil.copy(source, dst)
+        if filename is None:
+            filename = os.path.basename(source)
+        self.rm_from_runner_dir(filename)  # may be hardlink shared with clones, do not overwrite in place
+        shutil.copy(source, os.path.join(self.dir.path, filename))
 
     def link_to_runner_dir(self, source, link_filename=None):
         # type: (str, str) -> None
@@ -283,6 +503,7 @@ class Runner(object):
         if output:
             # remove runner dir file if exist
             self.rm_from_runner_dir(local)
+        self.__files[1 if output else 0].add(local)
 
         return local, absolute
 
@@ -297,36 +518,83 @@ class Runner(object):
         executed immediately. In "batch" :meth:`mode <mode>`, commands  execution is queued and postponed
         until :meth:`.run`
 
+        If :attr:`preserve_process` is set, underlying process is not terminated after commands execution,
+        next runs feed commands to the same process, end of each command output is detected by command prompt.
+
+        Output of the process is parsed while it is produced: results of the command are available
+        as soon as the command finishes, e.g. after ``run(wait=False)`` accessing ``FInd_result.stars``
+        waits for `FIND` only, not for the following commands. Output files outside *runner directory*
+        are updated after all commands finish (:meth:`wait_for_results`).
+
+        If :attr:`results_cache` is set (see ``[cache]`` section of `pydaophot.cfg`), results of commands
+        are stored in :class:`ResultsCache` under key build from commands, content of input files
+        (including image and `opt` files in *runner directory*) and executable. When the same commands
+        are run on the same inputs again, output and output files are restored from cache,
+        process is not started. Cache is not used with :attr:`preserve_process`.
+
         :param bool wait:
             If false,  :meth:`run` exits without waiting for finishing commands executions (asynchronous processing).
-            Call :meth:`wait_for_results` before accessing results.
+            Call :meth:`wait_for_results` to wait for all commands.
         :return: None
         """
+        self.__continues_process = self.preserve_process and self.process_alive
+        self.__run_start = time.time()
         self._pre_run(wait)
+        if self.results_cache is not None and not self.preserve_process:
+            with self.timings.measure('cache'):
+                self.__results_key = self.__compute_results_key()
+                cached = self.results_cache.get(self.__results_key, self.dir.path)
+            if cached is not None:
+                self.logger.debug('Results restored from cache, key: %s', self.__results_key)
+                self.__stream_keeper.stream = _RecordedOutput(cached[0], self._prompt)
+                self.__processors_chain_last.get_output_stream()
+                self.output = self.__stream_keeper.stream.read_all()
+                self.__complete(cached[1], 0)
+                return
+        if self.__continues_process:
+            self.__process = self.__persistent_process
+            self.__process_start = time.time(), process_cpu_time(self.__process.pid)
+        else:
+            self.stop_process()  # dead persistent process if any
+            with self.timings.measure('spawn'):
+                self.__process = self.__start_process()
+            self.__process_start = time.time(), 0.0
+            self.__errors = _ErrorsDrain(self.__process)
+            if self.preserve_process:
+                self.__persistent_process = self.__process
+        self.logger.debug('STDIN:\n%s', self.__commands)
+        if self.preserve_process:
+            stream = _ProcessOutput(self.__process, self._prompt, expected_prompts=self.__expected_prompts(),
+                                    timeout=self.persistent_timeout, on_timeout=self.__kill_hung_process)
+        else:
+            stream = _ProcessOutput(self.__process, self._prompt)
+        self.__stream_keeper.stream = stream
+        feed_start = time.time()
         try:
-            self.__process = sp.Popen([self.executable],
-                                      stdin=sp.PIPE,
-                                      stdout=sp.PIPE,
-                                      stderr=sp.PIPE,
-                                      cwd=self.dir.path)
+            self.__process.stdin.write(self.__commands.encode(encoding='ascii'))
+            if self.preserve_process:
+                self.__process.stdin.flush()
+            else:
+                self.__process.stdin.close()  # EOF for process
+        except (IOError, OSError):  # process already exited, output tells why
+            pass
+        self.timings.add('feed', time.time() - feed_start)
+        if wait:
+            self.__communicate()
+
+    def __start_process(self):
+        try:
+            return sp.Popen([self.executable],
+                            stdin=sp.PIPE,
+                            stdout=sp.PIPE,
+                            stderr=sp.PIPE,
+                            cwd=self.dir.path,
+                            close_fds=os.name == 'posix')  # do not leak pipes of other runners
         except OSError as e:
             self.logger.error(
                 'Executable: %s is expected in PATH, configure executable name/path in ~/pydaophot.cfg e.g.',
                 self.executable)
             raise e
-        self.logger.debug('STDIN:\n' + self.__commands)
-        if wait:
-            self.__communicate(self.__commands)
-        else:
-            if sys.version_info[0] > 2:  # python 3 has timeout in communicate
-                try:
-                    self.__communicate(self.__commands, timeout=0.01)
-                except TimeoutExpired:
-                    pass
-            else:  # python 2 - write directly to stdin and close it to flush end generate EOF
-                self.__process.stdin.write(self.__commands)
-                self.__process.stdin.close()
-                self.__process.stdin = None
 
     def is_ready_to_run(self):
         """
@@ -334,7 +602,7 @@ class Runner(object):
 
         :return: bool
         """
-        return self.__commands and self.__process is None
+        return self.__commands and self.__process is None and self.output is None
 
     @property
     def running(self):
@@ -366,23 +634,88 @@ class Runner(object):
         if self.is_ready_to_run():
             self.run(wait=True)
 
-    def __communicate(self, inpt=None, timeout=None):
-        i = inpt.encode(encoding='ascii') if inpt else None
-        o, e = self.__process.communicate(i, timeout=timeout) if timeout else self.__process.communicate(i)
-        self.output = o.decode('ascii')
-        self.stderr = e.decode('ascii')
-        self.logger.debug('STDOUT:\n' + self.output)
-        self.__stream_keeper.stream = StringIO(self.output)
-        self.returncode = self.__process.returncode
-        if self.returncode < 0:
+    def __communicate(self):
+        stream = self.__stream_keeper.stream
+        process = self.__process
+        # fill chained processors buffers, then read rest of output
+        self.__processors_chain_last.get_output_stream()
+        self.output = stream.read_all()
+        if process is not self.__persistent_process:
+            cpu = wait_process(process)
+            self.timings.add('process', time.time() - self.__process_start[0], cpu)
+            errors = self.__errors.take(wait=True)
+            if process.returncode == 0 and self.__results_key is not None:
+                with self.timings.measure('cache'):
+                    self.results_cache.put(self.__results_key, self.output, errors, self.dir.path,
+                                           self.__files[1])
+        else:
+            errors = self.__errors.take()
+            cpu = process_cpu_time(process.pid)
+            if stream.eof:  # persistent process has exited (e.g. on EXIT command or crash)
+                cpu = wait_process(process)
+                self.stop_process()
+            if cpu is not None and self.__process_start[1] is not None:
+                cpu -= self.__process_start[1]
+            self.timings.add('process', time.time() - self.__process_start[0], cpu)
+        self.__complete(errors, process.returncode)
+
+    def __complete(self, errors, returncode):
+        # finishes run of process or restored from cache, when output is already read
+        self.stderr = errors
+        self.logger.debug('STDOUT:\n%s', self.output)
+        self.returncode = returncode
+        if self.returncode is not None and self.returncode < 0:
             self.logger.warning('{} process finished with error code {}'.format(self.executable, self.returncode))
             if self.raise_on_nonzero_exitcode:
                 raise Runner.ExitError('Execution failed, exit code {}'.format(self.returncode), self.returncode)
         # copy results - output files from runners directory to user specified path
-        for f in self.ext_output_files:
-            self.copy_from_runner_dir(self._runner_dir_file_name(f), f)
-        # fill chained processors buffers
-        self.__processors_chain_last.get_output_stream()
+        if self.ext_output_files:
+            with self.timings.measure('copy'):
+                for f in self.ext_output_files:
+                    self.copy_from_runner_dir(self._runner_dir_file_name(f), f)
+        # files shared with clones (hardlinks) were not written by this runner
+        self.written_bytes = max(self.written_bytes, self.dir.disk_usage(shared=False))
+        if self.__run_start is not None:
+            self.timings.add('run', time.time() - self.__run_start)
+
+    def __compute_results_key(self):
+        # key of results in cache: executable, commands with input files replaced by content digests,
+        # and `opt` files read implicitly by process; temporary names of input files do not affect key
+        inputs = self.__files[0] - self.__files[1]
+        h = hashlib.sha1()
+        executable = _find_executable(self.executable)
+        h.update('{} {}\n'.format(executable, file_digest(executable) if executable else None).encode('ascii'))
+        for token in re.split(r'(\s+)', self.__commands):
+            if token in inputs:
+                path = os.path.join(self.dir.path, token)
+                if os.path.splitext(token)[1]:
+                    token = file_digest(path)
+                else:  # image name without extension, daophot and allstar open it with implicit .fits
+                    token = file_digest(path) + ' ' + file_digest(path + '.fits')
+            h.update(token.encode('ascii'))
+        for name in sorted(os.listdir(self.dir.path)):
+            if name.lower().endswith('.opt'):
+                h.update('\n{} {}'.format(name, file_digest(os.path.join(self.dir.path, name))).encode('ascii'))
+        return h.hexdigest()
+
+    def __kill_hung_process(self):
+        process = self.__process
+        self.logger.error('{} persistent process silent for {}s, killing it'.format(
+            self.executable, self.persistent_timeout))
+        process.kill()
+        process.wait()
+        self.stop_process()
+        self._reset()  # run abandoned, next run starts new process
+        raise Runner.ExitError('Persistent process hung, killed', process.returncode)
+
+    def __expected_prompts(self):
+        """Number of command prompts which will be presented by process for enqueued commands"""
+        n = 0
+        processor = self.__processors_chain_last
+        while isinstance(processor, OutputProvider):
+            n += processor.prompts
+            processor = processor._prev_in_chain
+        return n
 
 
     def _get_ready_for_commands(self):
@@ -400,12 +733,15 @@ class Runner(object):
             if not isinstance(output_processor, OutputProvider):
                 raise Runner.RunnerTypeError('output_processor must OutputProvider subclass')
             output_processor.logger = self.logger
+            output_processor.timings = self.timings
             #  chain organisation:
             # [stream_keeper]<-[processors_chain_first]<-[]<-[]<-[processors_chain_last]
             if on_beginning:
                 output_processor._prev_in_chain = self.__stream_keeper
                 if self.__processors_chain_first is not None:
                     self.__processors_chain_first._prev_in_chain = output_processor
+                else:
+                    self.__processors_chain_last = output_processor
                 self.__processors_chain_first = output_processor
             else:
                 output_processor._prev_in_chain = self.__processors_chain_last
@@ -0,0 +1,155 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Timings(object):
+    """
+    Wall and CPU times of runners stages, aggregated by stage name.
+
+    Every :class:`Runner` records its stages in own :attr:`Runner.timings`:
+
+    * ``spawn`` - start of the process,
+    * ``feed`` - writing commands to process stdin,
+    * ``process`` - process execution, CPU time of process (user + system),
+    * ``command <processor>`` - execution of single command (e.g. ``command DpOp_PSf``), measured by output
+      processor of the command while consuming command's output, CPU time of process if available (Linux),
+    * ``copy`` - copying of output files to external paths (see :meth:`Runner.copy_from_runner_dir`),
+    * ``cache`` - lookup and storing of results in :class:`ResultsCache`,
+    * ``parse starlist``, ``parse psf`` - reading of output files by output processors,
+    * ``run`` - whole run, from :meth:`Runner.run` to results.
+
+    CPU time is measured for processes only, in-process stages have CPU time 0.
+
+    >>> d.timings.callbacks.append(lambda stage, wall, cpu: print(stage, wall, cpu))
+    >>> print(Timings.merged(r.timings for r in runners).report())
+
+    :var list callbacks: functions ``fn(stage, wall, cpu)`` called on every recorded stage
+    """
+
+    def __init__(self):
+        self.callbacks = []
+        self.__stages = OrderedDict()  # stage -> [count, wall, cpu]
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        return 'Timings({} stages)'.format(len(self.__stages))
+
+    def add(self, stage, wall, cpu=None, count=1):
+        """
+        Records execution of stage
+
+        :param str stage: stage name
+        :param float wall: wall time in seconds
+        :param float cpu: CPU time in seconds, if known
+        :param int count: number of executions
+        """
+        with self.__lock:
+            record = self.__stages.setdefault(stage, [0, 0.0, 0.0])
+            record[0] += count
+            record[1] += wall
+            record[2] += cpu or 0.0
+        for callback in self.callbacks:
+            callback(stage, wall, cpu)
+
+    @contextmanager
+    def measure(self, stage):
+        """Context manager recording wall time of enclosed code as `stage`"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.time() - start)
+
+    def stages(self):
+        """
+        :return: dict {stage: (count, wall, cpu)} of totals of stages
+        """
+        with self.__lock:
+            return OrderedDict((stage, tuple(record)) for stage, record in self.__stages.items())
+
+    def update(self, other):
+        """Adds totals of `other` :class:`Timings`"""
+        for stage, (count, wall, cpu) in other.stages().items():
+            with self.__lock:
+                record = self.__stages.setdefault(stage, [0, 0.0, 0.0])
+                record[0] += count
+                record[1] += wall
+                record[2] += cpu
+
+    def reset(self):
+        """Clears recorded totals"""
+        with self.__lock:
+            self.__stages.clear()
+
+    @staticmethod
+    def merged(timings):
+        """
+        Aggregates many :class:`Timings`, e.g. of workers of :class:`WorkersPool`
+
+        :param timings: iterable of :class:`Timings`
+        :rtype: Timings
+        """
+        total = Timings()
+        for t in timings:
+            total.update(t)
+        return total
+
+    def report(self):
+        """
+        :return: text table of stages: count, total wall and CPU time, mean wall time per execution
+        :rtype: str
+        """
+        stages = self.stages()
+        width = max([len(s) for s in stages] + [5])
+        lines = ['{:<{w}} {:>8} {:>10} {:>10} {:>10}'.format('stage', 'count', 'wall [s]', 'cpu [s]', 'mean [ms]',
+                                                            w=width)]
+        for stage, (count, wall, cpu) in sorted(stages.items(), key=lambda item: -item[1][1]):
+            lines.append('{:<{w}} {:>8d} {:>10.3f} {:>10.3f} {:>10.2f}'.format(
+                stage, count, wall, cpu, 1000.0 * wall / count if count else 0.0, w=width))
+        return '\n'.join(lines)
+
+
+def process_cpu_time(pid):
+    """
+    CPU time (user + system) of running process, read from ``/proc`` (Linux only)
+
+    :param int pid: process id
+    :return: time in seconds or None if not available
+    """
+    if pid is None:
+        return None
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+    except (IOError, OSError, IndexError, ValueError, AttributeError):
+        return None
+
+
+def wait_process(process):
+    """
+    Waits for `process` (:class:`subprocess.Popen`) termination, like ``process.wait()``,
+    returns CPU time (user + system) of terminated process from it's resource usage (:func:`os.wait4`).
+
+    :return: time in seconds or None if not available (e.g. not POSIX system)
+    """
+    if process.returncode is None and hasattr(os, 'wait4'):
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+        except OSError:  # already reaped
+            pass
+        else:
+            if os.WIFSIGNALED(status):
+                process.returncode = -os.WTERMSIG(status)
+            else:
+                process.returncode = os.WEXITSTATUS(status)
+            return usage.ru_utime + usage.ru_stime
+    process.wait()
+    return None
@@ -0,0 +1,294 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import sys
+import threading
+import multiprocessing
+try:
+    import Queue as queue  # python2
+except ImportError:
+    import queue  # python3
+
+from .logger import logger as module_logger
+from .Allstar import Allstar
+from .Timings import Timings
+
+
+class Worker(object):
+    """
+    Pair of :class:`Daophot` and :class:`Allstar` runners sharing runner directory, working in batch mode.
+
+    For compatibility with code using ``{'daophot': d, 'allstar': a}`` dictionaries, runners are also
+    accessible as ``worker['daophot']`` and ``worker['allstar']``.
+
+    :var Daophot daophot: daophot runner
+    :var Allstar allstar: allstar runner, uses directory of :attr:`daophot`
+    """
+
+    def __init__(self, daophot, allstar):
+        self.daophot = daophot
+        self.allstar = allstar
+
+    def __getitem__(self, key):
+        if key not in ('daophot', 'allstar'):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def close(self):
+        """Closes runners, temporary runner directory is deleted"""
+        self.allstar.close()
+        self.daophot.close()
+
+
+class Job(object):
+    """
+    Results of job submitted to :class:`WorkersPool`, similar to ``concurrent.futures.Future``
+    """
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.worker = None  #: Worker which executed (or executes) job
+        self.__result = None
+        self.__exc_info = None
+        self.__done = threading.Event()
+        self.__callbacks = []
+        self.__lock = threading.Lock()
+
+    def done(self):
+        """True if job execution has finished"""
+        return self.__done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for job completion and returns value returned by job function.
+        Exception raised by job function is re-raised.
+
+        :param float timeout: max seconds to wait, None - wait for ever
+        """
+        self.exception(timeout)
+        if self.__exc_info is not None:
+            # noinspection PyUnresolvedReferences
+            _reraise(*self.__exc_info)
+        return self.__result
+
+    def exception(self, timeout=None):
+        """Waits for job completion and returns exception raised by job function or None"""
+        if not self.__done.wait(timeout):
+            raise RuntimeError('Job not finished in {}s'.format(timeout))
+        return self.__exc_info[1] if self.__exc_info is not None else None
+
+    def add_done_callback(self, fn):
+        """Calls ``fn(job)`` when job is finished (immediately if already finished)"""
+        with self.__lock:
+            if not self.done():
+                self.__callbacks.append(fn)
+                return
+        fn(self)
+
+    def _execute(self, worker):
+        self.worker = worker
+        try:
+            self.__result = self.fn(worker, *self.args, **self.kwargs)
+        except BaseException:  # including SystemExit, re-raised by result() rather than killing worker thread
+            self.__exc_info = sys.exc_info()
+        finally:
+            self.__finish()
+
+    def _cancel(self):
+        # finishes not started job, result() raises RuntimeError
+        try:
+            raise RuntimeError('Job cancelled, WorkersPool closed')
+        except RuntimeError:
+            self.__exc_info = sys.exc_info()
+        self.__finish()
+
+    def __finish(self):
+        with self.__lock:
+            self.__done.set()
+            callbacks = self.__callbacks
+            self.__callbacks = []
+        for fn in callbacks:
+            fn(self)
+
+
+if sys.version_info[0] > 2:
+    def _reraise(tp, value, tb):
+        raise value.with_traceback(tb)
+else:
+    exec('def _reraise(tp, value, tb):\n    raise tp, value, tb\n')
+
+
+def as_completed(jobs):
+    """
+    Generator yielding jobs in order of completion
+
+    :param list[Job] jobs: jobs to wait for
+    """
+    finished = queue.Queue()
+    jobs = list(jobs)
+    for job in jobs:
+        job.add_done_callback(finished.put)
+    for _ in jobs:
+        yield finished.get()
+
+
+def psf_allstar(worker, psf_stars, allstar_stars='i.ap', photometry='i.ap'):
+    """
+    Default job of :class:`WorkersPool`: daophot PSF for `psf_stars` followed by allstar on `allstar_stars`
+
+    :param Worker worker: executing worker
+    :param psf_stars: PSF stars file or StarList
+    :param allstar_stars: stars for allstar file or StarList
+    :param photometry: aperture photometry file or StarList for PSF
+    :return: tuple (DpOp_PSf, AsOp_result), where second is None if PSF did not converge.
+             :attr:`AsOp_result.als_stars` is already read, runner dir can be reused for next job
+    """
+    d = worker.daophot
+    a = worker.allstar
+    d.PSf(photometry=photometry, psf_stars=psf_stars)
+    d.run()
+    if not d.PSf_result.converged:
+        return d.PSf_result, None
+    a.ALlstar(stars=allstar_stars)
+    a.run()
+    _ = a.ALlstars_result.als_stars  # read before runner dir will be used by next job
+    return d.PSf_result, a.ALlstars_result
+
+
+class WorkersPool(object):
+    """
+    Pool of :class:`Worker` objects (:class:`Daophot` and :class:`Allstar` pairs) executing submitted jobs
+    in parallel.
+
+    Each worker is prepared once: it's runner directory is the clone of template `daophot` runner
+    directory (with files created by previous commands e.g. ``i.ap``), options and image are inherited
+    from template. Jobs are functions called as ``fn(worker, *args, **kwargs)`` by the first free worker,
+    in worker's own thread. Runners of workers operates in batch mode, job functions should call ``run()``.
+
+    >>> pool = WorkersPool(dp, workers=8)
+    >>> jobs = [pool.submit(psf_stars=s, allstar_stars='als.ap') for s in candidates_sets]
+    >>> for job in as_completed(jobs):
+    ...     psf, als = job.result()
+    >>> pool.close()
+    """
+
+    def __init__(self, daophot, workers=None, allstar_options=None, allstaropt=None, preserve_process=None,
+                 logger=None):
+        # type: (Daophot, int, dict, str, bool, object) -> WorkersPool
+        """
+        :param Daophot daophot:  template runner, cloned for each worker
+        :param int workers:      number of workers, default: number of CPUs
+        :param dict allstar_options: options for workers :class:`Allstar` runners
+        :param str allstaropt:   allstar.opt file for workers :class:`Allstar` runners
+        :param bool preserve_process: if not None overrides daophot's :attr:`Runner.preserve_process` of workers
+        :param logger:           logger for workers runners, default: template's logger
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.logger = module_logger.getChild(type(self).__name__)
+        self.workers = []  #: list of :class:`Worker`
+        for _ in range(workers):
+            d = daophot.clone()
+            d.batch_mode = True
+            if preserve_process is not None:
+                d.preserve_process = preserve_process
+            a = Allstar(dir=d.dir, image=d.image, allstaropt=allstaropt, batch=True, options=allstar_options)
+            if logger is not None:
+                d.logger = logger
+                a.logger = logger
+            self.workers.append(Worker(d, a))
+        self.__jobs = queue.Queue()
+        self.__threads = []
+        for i, w in enumerate(self.workers):
+            t = threading.Thread(target=self.__work, args=(w,), name='pydaophot-worker-{}'.format(i))
+            t.daemon = True
+            t.start()
+            self.__threads.append(t)
+        self.logger.debug('Pool of {} workers started'.format(workers))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close(cancel=type_ is not None)
+
+    def __len__(self):
+        return len(self.workers)
+
+    def __work(self, worker):
+        while True:
+            job = self.__jobs.get()
+            if job is None:  # closing
+                return
+            job._execute(worker)
+
+    @property
+    def written_bytes(self):
+        """List of peak sizes of files written by workers into their runner directories
+        (see :attr:`Runner.written_bytes`), helps to estimate space needed for runner directories"""
+        return [max(w.daophot.written_bytes, w.allstar.written_bytes) for w in self.workers]
+
+    def timings(self, reset=False):
+        """
+        Returns :class:`Timings` of workers runners aggregated, e.g. to find out which stage of jobs takes time
+
+        :param bool reset: clear timings of runners, so next call reports stages executed since this one
+        :rtype: Timings
+        """
+        runners = [r for w in self.workers for r in (w.daophot, w.allstar)]
+        total = Timings.merged(r.timings for r in runners)
+        if reset:
+            for r in runners:
+                r.timings.reset()
+        return total
+
+    def submit(self, fn=None, *args, **kwargs):
+        """
+        Enqueues job for execution by the first free worker.
+
+        :param fn: job function called ``fn(worker, *args, **kwargs)``, default: :func:`psf_allstar`
+        :return: job object providing results
+        :rtype: Job
+        """
+        if not self.__threads:
+            raise RuntimeError('WorkersPool closed')
+        if fn is None:
+            fn = psf_allstar
+        job = Job(fn, args, kwargs)
+        self.__jobs.put(job)
+        return job
+
+    def map(self, fn, *iterables):
+        """
+        Executes ``fn(worker, *items)`` for items of iterables in parallel,
+        returns list of results in order of iterables.
+        """
+        jobs = [self.submit(fn, *items) for items in zip(*iterables)]
+        return [job.result() for job in jobs]
+
+    def close(self, cancel=False):
+        """
+        Waits for enqueued jobs, stops workers threads and closes workers runners
+
+        Used as context manager, pool is closed on exit from ``with`` block, jobs not started yet
+        are cancelled if the block is left by exception (e.g. ``KeyboardInterrupt``).
+
+        :param bool cancel: do not wait for jobs not started yet, their :meth:`Job.result` raises ``RuntimeError``
+        """
+        while cancel:
+            try:
+                job = self.__jobs.get_nowait()
+            except queue.Empty:
+                break
+            job._cancel()
+        for _ in self.__threads:
+            self.__jobs.put(None)
+        for t in self.__threads:
+            t.join()
+        self.__threads = []
+        for w in self.workers:
+            w.close()
+        self.workers = []
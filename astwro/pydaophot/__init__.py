@@ -1,5 +1,11 @@
 from .Daophot import Daophot
 from .Allstar import Allstar
+from .WorkersPool import WorkersPool, Worker, Job, as_completed, psf_allstar
+from .ResultsCache import ResultsCache
+from .Timings import Timings
+from .BatchPhotometry import batch_photometry, image_photometry
+from .AperturePhotometry import AperturePhotometry
+from .PsfModel import PsfModel, read_psf_file, subtract_stars
 #from .ASRunner import ASRunner
 #from .dao import allstar, daophot, daophot_cfg
 from _version import __version__, __version_info__
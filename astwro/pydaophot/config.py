@@ -6,11 +6,15 @@ try:
     from ConfigParser import ConfigParser, NoOptionError, NoSectionError # python 2
 except ImportError:
     from configparser import ConfigParser, NoOptionError, NoSectionError # python3
-import os, shutil, multiprocessing, logging
+import os, shutil, multiprocessing, threading, logging
 from .logger import logger
 
 class __SinglethonConfig:
     config = None
+    results_cache = None
+
+
+_results_cache_lock = threading.Lock()  # creation of shared results cache
 
 
 
@@ -73,6 +77,87 @@ def create_dao_config_file(destpath='.'):
     shutil.copy(os.path.join(get_package_config_path(), 'pydaophot.cfg'), destpath)
 
 
+def starlist_cache():
+    """Returns `cache` argument for :func:`astwro.starlist.read_dao_file` configured in ``[cache]`` section
+    of pydaophot.cfg: None (no cache), True (sidecar files next to daophot files) or cache directory
+
+    :rtype: bool|str|None
+    """
+    config = dao_config()
+    try:
+        if not config.getboolean('cache', 'starlists'):
+            return None
+    except (NoOptionError, NoSectionError, ValueError):
+        return None
+    try:
+        directory = config.get('cache', 'starlists_dir')
+    except (NoOptionError, NoSectionError):
+        directory = None
+    return os.path.expanduser(directory) if directory else True
+
+
+def results_cache():
+    """Returns shared :class:`ResultsCache` of runners results configured in ``[cache]`` section
+    of pydaophot.cfg, or None if cache of results is not enabled
+
+    :rtype: ResultsCache|None
+    """
+    config = dao_config()
+    try:
+        if not config.getboolean('cache', 'results'):
+            return None
+    except (NoOptionError, NoSectionError, ValueError):
+        return None
+    try:
+        directory = config.get('cache', 'results_dir')
+    except (NoOptionError, NoSectionError):
+        directory = '~/.cache/pydaophot/results'
+    try:
+        max_size = config.getint('cache', 'results_max_size')
+    except (NoOptionError, NoSectionError, ValueError):
+        max_size = 1024
+    with _results_cache_lock:
+        if __SinglethonConfig.results_cache is None:
+            from .ResultsCache import ResultsCache
+            __SinglethonConfig.results_cache = ResultsCache(directory, max_size * 1024 * 1024)
+    return __SinglethonConfig.results_cache
+
+
+def runners_base_dir():
+    """Returns base directories policy for runners temporary directories, configured in ``[dirs]`` section
+    of pydaophot.cfg: list of directories in order of preference (default: ``/dev/shm``, RAM-backed)
+    and min free space (and memory for RAM-backed) in bytes which directory have to provide.
+    System temp dir is used when none of directories is suitable, see :func:`astwro.utils.select_base_dir`
+
+    :rtype: (list[str], int)
+    """
+    config = dao_config()
+    try:
+        dirs = [d for d in config.get('dirs', 'runners').split(os.pathsep) if d.strip()]
+    except (NoOptionError, NoSectionError):
+        dirs = ['/dev/shm']
+    try:
+        min_free = config.getint('dirs', 'runners_min_free')
+    except (NoOptionError, NoSectionError, ValueError):
+        min_free = 1024
+    return [os.path.expanduser(d.strip()) for d in dirs], min_free * 1024 * 1024
+
+
+def read_opt_file(filename):
+    """Reads daophot `opt` file (e.g. photo.opt) into dict of values by two letter upper-case keys
+    (as recognized by daophot), e.g. ``{'A1': 8.0, 'IS': 35.0, 'OS': 50.0}``
+
+    :rtype: dict
+    """
+    options = {}
+    with open(filename) as f:
+        for line in f:
+            key, sep, value = line.partition('=')
+            if sep and key.strip():
+                options[key.strip()[:2].upper()] = float(value)
+    return options
+
+
 def find_opt_file(filename, mustexist=True):
     """Searches for opt file (e.g. daophot.opt) in working dir, configuration, default module file"""
     # 1. in local working dir
@@ -0,0 +1,40 @@
+import os
+import unittest
+import numpy as np
+import astwro.sampledata as data
+import astwro.starlist as sl
+from astwro.pydaophot import AperturePhotometry
+
+
+class TestAperturePhotometry(unittest.TestCase):
+
+    def test_synthetic_star(self):
+        rs = np.random.RandomState(1)
+        image = rs.normal(100.0, 5.0, size=(200, 200))
+        yy, xx = np.mgrid[1:201, 1:201]
+        image += 10000.0 / (2 * np.pi * 1.5 ** 2) * np.exp(-((xx - 100.3) ** 2 + (yy - 99.6) ** 2) / (2 * 1.5 ** 2))
+        stars = sl.StarList({'id': [1, 2], 'x': [100.3, 3.0], 'y': [99.6, 50.0]}, columns=['id', 'x', 'y'])
+        ap = AperturePhotometry(image, IS=20, OS=30, apertures=[8, 2], options={'GA': 1.0, 'HI': 60000})
+        res = ap.photometry(stars)
+        self.assertAlmostEqual(res.mag.iloc[0], 25 - 2.5 * np.log10(10000.0), delta=0.01)
+        self.assertGreater(res.A2.iloc[0], res.mag.iloc[0])  # smaller aperture
+        self.assertAlmostEqual(res.sky.iloc[0], 100.0, delta=0.5)
+        self.assertTrue(np.isnan(res.mag.iloc[1]))  # aperture crosses image edge
+        self.assertFalse(np.isnan(res.sky.iloc[1]))
+
+    @unittest.skipUnless(os.path.isfile(data.fits_image()), 'sample image not available')
+    def test_compare_daophot(self):
+        dao = sl.read_dao_file(data.ap_file())
+        ap = AperturePhotometry(data.fits_image(), daophotopt=os.path.join(os.path.dirname(data.ap_file()),
+                                                                             'daophot.opt'),
+                                IS=35, OS=50, apertures=[8])
+        res = ap.photometry(data.coo_file())
+        res = res.loc[dao.index]
+        both = dao.mag.notnull() & res.mag.notnull()
+        self.assertGreater(both.sum(), 0.95 * dao.mag.notnull().sum())
+        self.assertLess(np.median(np.abs(res.sky - dao.sky)), 0.05)
+        bright = both & (dao.mag_err < 0.05)
+        dmag = np.abs(res.mag[bright] - dao.mag[bright])
+        self.assertLess(np.median(dmag), 0.005)
+        self.assertLess(np.percentile(dmag, 95), 0.02)
+        self.assertLess(np.median(np.abs(res.mag_err[bright] / dao.mag_err[bright] - 1)), 0.1)
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+from io import StringIO
+from astwro.pydaophot import batch_photometry, image_photometry
+from astwro.pydaophot import BatchPhotometry
+from astwro.pydaophot.OutputProviders import AsOp_result, StreamKeeper
+
+
+def fake_photometry(image, output_dir, fail=False, stars=10):
+    # stub of photometry chain, counts calls in output dir
+    with open(os.path.join(output_dir, os.path.basename(image) + '.calls'), 'a') as f:
+        f.write('x')
+    if fail:
+        raise ValueError('bad image')
+    return {'found': stars, 'als_stars': stars - 1}
+
+
+class Result(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class StubDaophot(object):
+    # runner with results of successful commands, copies nothing
+    def __init__(self, **kwargs):
+        self.dir = None
+        self.FInd_result = Result(stars=120, sky=100.0)
+        self.PIck_result = Result(stars=30)
+        self.PSf_result = Result(converged=True, chi=0.02)
+
+    def __getattr__(self, name):  # commands, run(), copy_from_runner_dir(), close()
+        return lambda *args, **kwargs: None
+
+
+class StubAllstar(StubDaophot):
+    # result of ALLSTAR parsed from recorded allstar output
+    def __init__(self, **kwargs):
+        output = u' Iteration   Remaining   Disappeared   Converged\n' \
+                 u'     12           0            4          116\n'
+        self.ALlstars_result = AsOp_result(prev_in_chain=StreamKeeper(stream=StringIO(output)))
+
+
+class TestBatchPhotometry(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.images = []
+        for i in range(4):
+            self.images.append(os.path.join(self.dir, 'img{}.fits'.format(i)))
+            open(self.images[-1], 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def calls(self, image):
+        with open(os.path.join(self.dir, 'out', os.path.basename(image) + '.calls')) as f:
+            return len(f.read())
+
+    def test_summary_and_resume(self):
+        out = os.path.join(self.dir, 'out')
+        s = batch_photometry(os.path.join(self.dir, '*.fits'), out, processes=2, fn=fake_photometry,
+                             image_options={'img2.fits': {'fail': True}, self.images[3]: {'stars': 20}})
+        self.assertEqual(list(s.image), self.images)
+        self.assertEqual(list(s.status), ['ok', 'ok', 'error', 'ok'])
+        self.assertEqual(list(s.found[s.status == 'ok']), [10, 10, 20])
+        self.assertIn('bad image', s.message[2])
+        s = batch_photometry(self.images, out, processes=2, fn=fake_photometry)
+        self.assertEqual(list(s.status), ['ok'] * 4)
+        self.assertEqual([self.calls(i) for i in self.images], [1, 1, 2, 1])
+
+    def test_image_photometry_summary(self):
+        runners = BatchPhotometry.Daophot, BatchPhotometry.Allstar
+        BatchPhotometry.Daophot, BatchPhotometry.Allstar = StubDaophot, StubAllstar
+        try:
+            summary = image_photometry(self.images[0], self.dir)
+        finally:
+            BatchPhotometry.Daophot, BatchPhotometry.Allstar = runners
+        self.assertEqual(summary, {'status': 'ok', 'found': 120, 'sky': 100.0, 'picked': 30, 'psf_chi': 0.02,
+                                   'als_stars': 116})
@@ -0,0 +1,284 @@
+import os
+import sys
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+from astropy.io import fits
+from astwro.pydaophot import Daophot, ResultsCache
+
+# stub of daophot: options at start, prompt after every command, FIND writes starlist file (with frames),
+# ATTACH of missing image asks for another name like daophot,
+# every start of process is counted in `calls` file next to stub
+STUB = """
+import os
+import sys
+
+with open(os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), 'calls'), 'a') as f:
+    f.write('x')
+
+def out(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+def options():
+    out(' FWHM OF OBJECT =     5.00   THRESHOLD (in sigmas) =     3.50\\n'
+        ' READ NOISE (ADU; 1 frame) =    1.00\\n WATCH PROGRESS =   -2.00\\n')
+
+options()
+out('\\n Command: ')
+while True:
+    line = sys.stdin.readline()
+    command = line.strip().upper()
+    if not line or command.startswith('EX'):
+        break
+    if command.startswith('AT'):
+        name = line.split()[1] if len(line.split()) > 1 else ''
+        while not (os.path.exists(name) or os.path.exists(name + '.fits')):  # asks for name until empty line
+            out('\\n\\n Cannot open file.\\n\\n Enter file name: ')
+            name = sys.stdin.readline().strip()
+            if not name:
+                break
+        else:
+            out('\\n\\n    Picture size:   16   16\\n')
+    elif command.startswith('OP'):
+        sys.stdin.readline()  # options file
+        while sys.stdin.readline().strip():  # options until empty line
+            pass
+        options()
+    elif command.startswith('FI'):
+        frames = sys.stdin.readline().strip()
+        name = sys.stdin.readline().strip()
+        sys.stdin.readline()  # confirmation
+        with open(name, 'w') as f:  # in place, runner has to remove files shared with clones before
+            f.write(' NL    NX    NY  LOWBAD HIGHBAD  THRESH  FRAMES\\n  1    16    16  ' + frames + '\\n\\n'
+                    '      1    8.000    8.000\\n')
+    elif not command:
+        continue
+    out('\\n Command: ')
+"""
+
+
+def make_stub(directory):
+    # executable stub of daophot in `directory`, run by current python interpreter
+    stub = os.path.join(directory, 'daophot')
+    with open(stub, 'w') as f:
+        f.write('#!' + sys.executable + '\n' + STUB)
+    os.chmod(stub, 0o755)
+    return stub
+
+
+class TestResultsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='astwro_cache_test_')
+        self.stub = make_stub(self.dir)
+        self.image = self.make_image('image.fits', 1.0)
+        self.cache = ResultsCache(os.path.join(self.dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def make_image(self, name, value):
+        path = os.path.join(self.dir, name)
+        fits.writeto(path, np.full((16, 16), value, dtype=np.float32))
+        return path
+
+    @property
+    def calls(self):
+        """number of stub process starts"""
+        path = os.path.join(self.dir, 'calls')
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def find(self, image=None, opt=None):
+        # FIND on `image` in new runner, returns content of found stars file
+        d = Daophot(image=image or self.image, batch=True)
+        d.executable = self.stub
+        d.results_cache = self.cache
+        if opt is not None:
+            os.remove(os.path.join(d.dir.path, 'daophot.opt'))
+            with open(os.path.join(d.dir.path, 'daophot.opt'), 'w') as f:
+                f.write(opt)
+        d.FInd()
+        d.run()
+        with open(os.path.join(d.dir.path, 'i.coo')) as f:
+            content = f.read()
+        d.close()
+        return content
+
+    def test_same_inputs_hit(self):
+        first = self.find()
+        self.assertEqual((self.calls, self.cache.hits, self.cache.misses), (1, 0, 1))
+        second = self.find()  # new runner directory, same inputs
+        self.assertEqual((self.calls, self.cache.hits, self.cache.misses), (1, 1, 1))
+        self.assertEqual(first, second)
+        self.assertIn('8.000', second)
+
+    def test_changed_input_miss(self):
+        self.find()
+        self.find(image=self.make_image('other.fits', 2.0))
+        self.assertEqual((self.calls, self.cache.hits, self.cache.misses), (2, 0, 2))
+        self.find(image=self.make_image('copy.fits', 1.0))  # other name, same content
+        self.assertEqual((self.calls, self.cache.hits, self.cache.misses), (2, 1, 2))
+
+    def test_changed_opt_miss(self):
+        self.find(opt='FW = 3.0\n')
+        self.find(opt='FW = 3.0\n')
+        self.find(opt='FW = 3.5\nTH = 4.0\n')
+        self.assertEqual((self.calls, self.cache.hits, self.cache.misses), (2, 1, 2))
+
+    def test_changed_executable_miss(self):
+        self.find()
+        with open(self.stub, 'a') as f:
+            f.write('# new version\n')
+        self.find()
+        self.assertEqual((self.calls, self.cache.hits, self.cache.misses), (2, 0, 2))
+
+    def test_image_without_extension(self):
+        # ATTACH of image name without extension, images differ only in content
+        for value in [1.0, 2.0, 1.0]:
+            d = Daophot(batch=True)
+            d.executable = self.stub
+            d.results_cache = self.cache
+            fits.writeto(os.path.join(d.dir.path, 'is.fits'), np.full((16, 16), value, dtype=np.float32))
+            d.ATtach('is')
+            d.FInd()
+            d.run()
+            d.close()
+        self.assertEqual((self.calls, self.cache.hits, self.cache.misses), (2, 1, 2))
+
+    def write(self, directory, name, content):
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(content)
+
+    def test_restore_files(self):
+        source = tempfile.mkdtemp(dir=self.dir)
+        target = tempfile.mkdtemp(dir=self.dir)
+        self.write(source, 'i.coo', 'stars')
+        self.write(source, 'i.ap', 'photometry')
+        self.cache.put('key', u'output', u'errors', source, ['i.coo', 'i.ap', 'i.missing'])
+        self.write(target, 'i.coo', 'old stars')  # replaced on restore
+        self.assertEqual(self.cache.get('key', target), (u'output', u'errors'))
+        self.assertEqual(sorted(os.listdir(target)), ['i.ap', 'i.coo'])
+        with open(os.path.join(target, 'i.coo')) as f:
+            self.assertEqual(f.read(), 'stars')
+        self.assertIsNone(self.cache.get('other key', target))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        source = tempfile.mkdtemp(dir=self.dir)
+        self.write(source, 'i.coo', 'x' * 1000)
+        entry_size = 1000 + len('output') + len('errors')
+        self.cache.max_size = 3 * entry_size
+        for i, key in enumerate(['a', 'b', 'c']):
+            self.cache.put(key, u'output', u'errors', source, ['i.coo'])
+            t = 1000000000 + i * 1000
+            os.utime(os.path.join(self.cache.directory, key), (t, t))  # a oldest
+        self.assertIsNotNone(self.cache.get('a', tempfile.mkdtemp(dir=self.dir)))  # a recently used
+        self.cache.put('d', u'output', u'errors', source, ['i.coo'])
+        self.assertEqual(sorted(os.listdir(self.cache.directory)), ['a', 'c', 'd'])
+        self.cache.clear()
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+
+class TestRunnerClone(unittest.TestCase):
+
+    def test_clone_outputs_isolated(self):
+        # clones of runner hardlink files of runner directory, output written by clone
+        # do not change file of source runner nor sibling clone
+        base = tempfile.mkdtemp(prefix='astwro_clone_test_')
+        try:
+            stub = make_stub(base)
+            image = os.path.join(base, 'image.fits')
+            fits.writeto(image, np.zeros((16, 16), dtype=np.float32))
+            d = Daophot(image=image, batch=True)
+            d.executable = stub
+            d.results_cache = None
+            d.FInd(1, 1)
+            d.run()
+            self.assertEqual(d.dir.clone_mode, 'link')
+            clone, sibling = d.clone(), d.clone()
+            coo = [os.path.join(r.dir.path, 'i.coo') for r in (d, clone, sibling)]
+            self.assertTrue(os.path.samefile(coo[0], coo[1]))
+            for name in os.listdir(d.dir.path):  # image and daophot.opt symlinks
+                path = os.path.join(d.dir.path, name)
+                if os.path.islink(path):
+                    self.assertEqual(os.readlink(os.path.join(clone.dir.path, name)), os.readlink(path))
+            clone.FInd(2, 2)
+            clone.run()
+            with open(coo[1]) as f:
+                self.assertIn('2,2', f.read())
+            for path in (coo[0], coo[2]):
+                with open(path) as f:
+                    self.assertIn('1,1', f.read())
+            self.assertGreater(clone.written_bytes, 0)
+            for r in (d, clone, sibling):
+                r.close()
+        finally:
+            shutil.rmtree(base, ignore_errors=True)
+
+
+class TestSharedCache(unittest.TestCase):
+
+    def test_single_instance(self):
+        # concurrent first calls of results_cache() create one shared cache
+        from astwro.pydaophot import config
+        import threading
+        singleton = getattr(config, '__SinglethonConfig')
+        cfg = config.dao_config()
+        base = tempfile.mkdtemp(prefix='astwro_cache_test_')
+        saved = singleton.results_cache, [cfg.get('cache', o) if cfg.has_option('cache', o) else None
+                                          for o in ('results', 'results_dir')]
+        try:
+            if not cfg.has_section('cache'):
+                cfg.add_section('cache')
+            cfg.set('cache', 'results', 'yes')
+            cfg.set('cache', 'results_dir', base)
+            singleton.results_cache = None
+            caches = []
+            threads = [threading.Thread(target=lambda: caches.append(config.results_cache())) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(len(set(id(c) for c in caches)), 1)
+            self.assertEqual(caches[0].directory, base)
+        finally:
+            singleton.results_cache = saved[0]
+            for option, value in zip(('results', 'results_dir'), saved[1]):
+                if value is None:
+                    cfg.remove_option('cache', option)
+                else:
+                    cfg.set('cache', option, value)
+            shutil.rmtree(base, ignore_errors=True)
+
+
+class TestPersistentProcess(unittest.TestCase):
+
+    def test_hung_process_killed(self):
+        # persistent daophot waiting for corrected input after error is killed, next run starts new process
+        base = tempfile.mkdtemp(prefix='astwro_persistent_test_')
+        try:
+            d = Daophot(batch=True, preserve_process=True)
+            d.executable = make_stub(base)
+            self.assertIsNotNone(d.persistent_timeout)  # hung process is killed by default
+            d.persistent_timeout = 0.5
+            d.ATtach('missing')
+            d.FInd(1, 1)
+            start = time.time()
+            self.assertRaises(Daophot.ExitError, d.run)
+            self.assertLess(time.time() - start, 5)
+            self.assertFalse(d.process_alive)
+            fits.writeto(os.path.join(d.dir.path, 'is.fits'), np.zeros((16, 16), dtype=np.float32))
+            d.ATtach('is')
+            d.FInd(2, 2)
+            d.run()
+            self.assertTrue(d.process_alive)
+            with open(os.path.join(d.dir.path, 'i.coo')) as f:
+                self.assertIn('2,2', f.read())
+            d.close()
+            with open(os.path.join(base, 'calls')) as f:
+                self.assertEqual(f.read(), 'xx')
+        finally:
+            shutil.rmtree(base, ignore_errors=True)
@@ -0,0 +1,208 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import astwro.sampledata as data
+from astwro.pydaophot import read_psf_file, subtract_stars
+
+
+class TestPsfModel(unittest.TestCase):
+
+    def setUp(self):
+        self.psf = read_psf_file(data.psf_file())
+
+    def test_read(self):
+        self.assertEqual(self.psf.label, 'GAUSSIAN')
+        self.assertEqual(self.psf.tables.shape, (6, 99, 99))
+        self.assertAlmostEqual(self.psf.par[1], 1.216833)
+        self.assertEqual(self.psf.radius, 24)
+
+    def test_glued_numbers(self):
+        f, path = tempfile.mkstemp(suffix='.psf')
+        with os.fdopen(f, 'w') as out:
+            out.write(' GAUSSIAN    7    2    1    0   12.000       1000.000     50.0     50.0\n')
+            out.write('  1.500000E+00 1.500000E+00\n')
+            out.write(''.join(' {:12.6E}'.format(v) if v >= 0 else '{:13.6E}'.format(v)
+                              for v in np.linspace(-1, 1, 49)) + '\n')
+        try:
+            psf = read_psf_file(path)
+        finally:
+            os.remove(path)
+        self.assertTrue(np.allclose(psf.tables.ravel(), np.linspace(-1, 1, 49)))
+
+    def test_volume(self):
+        # model of star of psfmag magnitude sums up to psfmag, anywhere in the image
+        stars = pd.DataFrame({'x': [624.5, 100.2, 1200.7], 'y': [574.5, 80.3, 1100.1], 'mag': [self.psf.psfmag] * 3})
+        image = self.psf.render(stars, (1150, 1250))
+        for x, y in zip(stars.x, stars.y):
+            flux = image[int(y) - 30:int(y) + 30, int(x) - 30:int(x) + 30].sum()
+            self.assertAlmostEqual(25 - 2.5 * np.log10(flux), self.psf.psfmag, delta=0.005)
+
+    def test_render_matches_evaluate(self):
+        stars = pd.DataFrame({'x': [30.3, 3.7], 'y': [40.8, 6.1], 'mag': [12.0, 14.0]})
+        image = self.psf.render(stars, (80, 60))
+        yy, xx = np.mgrid[1:81, 1:61]
+        expected = sum(self.psf.evaluate(xx - x, yy - y, x, y) * 10 ** (-0.4 * (m - self.psf.psfmag))
+                       for x, y, m in zip(stars.x, stars.y, stars.mag))
+        self.assertTrue(np.allclose(image, expected))
+        self.assertTrue(np.allclose(self.psf.subtract(image, stars), 0))
+
+    def test_subtract_stars_leave_in(self):
+        stars = pd.DataFrame({'id': [1, 2, 3], 'x': [20.2, 60.7, 40.0], 'y': [30.1, 50.5, 20.4],
+                              'mag': [12.0, 13.0, 12.5]})
+        image = self.psf.render(stars, (80, 80)) + 100.0
+        f, path = tempfile.mkstemp(suffix='.fits')
+        os.close(f)
+        try:
+            result = subtract_stars(image, self.psf, stars, leave_in=[2], output=path)
+            from astropy.io import fits
+            written = fits.getdata(path)
+        finally:
+            os.remove(path)
+        self.assertTrue(np.allclose(result, self.psf.render(stars[stars.id == 2], (80, 80)) + 100.0))
+        self.assertTrue(np.allclose(written, result, rtol=1e-6))
+
+
+# Gauss-Legendre points and weights of daophot's PROFIL (4 points per pixel axis)
+_D = [-0.43056816, -0.16999052, 0.16999052, 0.43056816]
+_W = [0.17392742, 0.32607258, 0.32607258, 0.17392742]
+
+# analytic profiles with tilt parameters set, so the cross terms matter
+_PARAMS = {
+    'GAUSSIAN': [1.8, 1.4],
+    'MOFFAT15': [1.8, 1.4, 0.12],
+    'MOFFAT25': [1.8, 1.4, 0.12],
+    'MOFFAT35': [1.8, 1.4, 0.12],
+    'LORENTZ': [1.8, 1.4, 0.12],
+    'PENNY1': [1.8, 1.4, 0.6, 0.15],
+    'PENNY2': [1.8, 1.4, 0.6, 0.15, -0.1],
+}
+
+
+def _profil(label, dx, dy, par):
+    # Straight (scalar, loop) transcription of analytic functions of daophot's PROFIL, reference for PsfModel
+    from math import erf, exp, log, sqrt
+    if label == 'GAUSSIAN':
+        def integral(d, hwhm):
+            c = sqrt(log(2.0)) / hwhm
+            return 0.5 * sqrt(np.pi) / c * (erf(c * (d + 0.5)) - erf(c * (d - 0.5)))
+        return integral(dx, par[0]) * integral(dy, par[1]) / (par[0] * par[1])
+    p1sq, p2sq = par[0] ** 2, par[1] ** 2
+    total = 0.0
+    for yj, wy in zip(_D, _W):
+        for xi, wx in zip(_D, _W):
+            x, y = dx + xi, dy + yj
+            xsq, ysq, xy = x * x, y * y, x * y
+            if label.startswith('MOFFAT'):
+                beta = int(label[-2:]) / 10.0
+                alpha = 2.0 ** (1.0 / beta) - 1.0
+                denom = 1.0 + alpha * (xsq / p1sq + ysq / p2sq + xy * par[2])
+                func = (beta - 1.0) * alpha / (par[0] * par[1]) / denom ** beta
+            elif label == 'LORENTZ':
+                func = 1.0 / (1.0 + xsq / p1sq + ysq / p2sq + xy * par[2])
+            elif label == 'PENNY1':  # Lorentzian along x or y, Gaussian may be tilted
+                rsq = xsq / p1sq + ysq / p2sq
+                f = 1.0 / (1.0 + rsq)
+                e = exp(-log(2.0) * (rsq + xy * par[3]))
+                func = par[2] * e + (1.0 - par[2]) * f
+            else:  # PENNY2, both tilted by different angles
+                rsq = xsq / p1sq + ysq / p2sq
+                f = 1.0 / (1.0 + rsq + par[4] * xy)
+                e = exp(-log(2.0) * (rsq + par[3] * xy))
+                func = par[2] * e + (1.0 - par[2]) * f
+            total += wx * wy * func
+    return total
+
+
+def _write_psf_file(filename, label, par, npsf=51, psfmag=12.0, bright=1000.0, xpsf=50.0, ypsf=50.0):
+    # analytic only PSF (zero constant look-up table) in daophot format
+    with open(filename, 'w') as f:
+        f.write(' {:8s}{:5d}{:5d}{:5d}{:5d}{:9.3f}{:15.3f}{:9.1f}{:9.1f}\n'.format(
+            label, npsf, len(par), 1, 0, psfmag, bright, xpsf, ypsf))
+        f.write(' ' + ''.join('{:13.6E}'.format(p) for p in par) + '\n')
+        zeros = ['{:13.6E}'.format(0.0)] * (npsf * npsf)
+        for i in range(0, len(zeros), 6):
+            f.write(' ' + ''.join(zeros[i:i + 6]) + '\n')
+
+
+def _daophot_available():
+    from astwro.pydaophot.config import dao_config
+    from astwro.pydaophot.Runner import _find_executable
+    return _find_executable(os.path.expanduser(dao_config().get('executables', 'daophot'))) is not None
+
+
+class TestProfiles(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.stars = pd.DataFrame({'id': [1, 2, 3], 'x': [20.3, 44.8, 30.5], 'y': [25.6, 40.1, 52.2],
+                                   'mag': [12.0, 11.5, 12.7]})
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def psf(self, label):
+        path = os.path.join(self.dir, label.lower() + '.psf')
+        _write_psf_file(path, label, _PARAMS[label])
+        return path, read_psf_file(path)
+
+    def test_profiles_match_profil(self):
+        points = [(0.0, 0.0), (1.3, 0.0), (0.0, -1.7), (1.2, 1.9), (-2.4, 1.1), (3.6, -4.2), (-5.5, -6.3)]
+        for label in _PARAMS:
+            _, psf = self.psf(label)
+            dx, dy = np.array(points).T
+            expected = np.array([_profil(label, x, y, psf.par) * psf.bright for x, y in points])
+            self.assertTrue(np.allclose(psf.evaluate(dx, dy), expected, rtol=1e-6), label)
+
+    def test_penny1_lorentzian_not_tilted(self):
+        # pure Lorentzian component of PENNY1 is symmetric in x, the 4th parameter tilts Gaussian only
+        par = [1.8, 1.4, 0.0, 0.5]
+        psf = read_psf_file(self.psf('PENNY1')[0])
+        psf.par = par
+        self.assertAlmostEqual(psf.evaluate(1.5, 2.0), psf.evaluate(-1.5, 2.0))
+        psf.par = [1.8, 1.4, 1.0, 0.5]
+        self.assertNotAlmostEqual(psf.evaluate(1.5, 2.0), psf.evaluate(-1.5, 2.0))
+
+    @unittest.skipUnless(_daophot_available(), 'daophot not available')
+    def test_profiles_match_substar(self):
+        # stars rendered by PsfModel are removed by daophot SUBSTAR with the same PSF file
+        from astropy.io import fits
+        from astwro.pydaophot import Daophot
+        from astwro.starlist import write_dao_file, DAO
+        for label in _PARAMS:
+            psf_path, psf = self.psf(label)
+            image = psf.render(self.stars, (70, 64))
+            image_path = os.path.join(self.dir, label.lower() + '.fits')
+            fits.PrimaryHDU((image + 100.0).astype(np.float32)).writeto(image_path, overwrite=True)
+            d = Daophot(image=image_path)
+            d.copy_to_runner_dir(psf_path, 'i.psf')
+            write_dao_file(self.stars, d.file_from_runner_dir('i.als'), DAO.ALS_FILE)
+            d.SUbstar(subtract='i.als')
+            d.run()
+            residuals = fits.getdata(d.file_from_runner_dir('is.fits')) - 100.0
+            d.close()
+            self.assertLess(np.abs(residuals).max(), 1e-3 * image.max(), label)
+
+
+@unittest.skipUnless(os.path.isfile(data.fits_image()) and _daophot_available(),
+                     'sample image or daophot not available')
+class TestSubstar(unittest.TestCase):
+
+    def test_subtract_stars_matches_substar(self):
+        # in process subtraction of sample als stars gives the same image as daophot SUBSTAR
+        from astropy.io import fits
+        from astwro.pydaophot import Daophot
+        d = Daophot(image=data.fits_image())
+        d.copy_to_runner_dir(data.psf_file(), 'i.psf')
+        d.copy_to_runner_dir(data.als_file(), 'i.als')
+        d.copy_to_runner_dir(data.lst_file(), 'i.lst')
+        d.SUbstar(subtract='i.als', leave_in='i.lst', subtracted_image='substar.fits')
+        d.run()
+        substar = fits.getdata(d.file_from_runner_dir('substar.fits')).astype(np.float64)
+        result = d.subtract_stars(subtract='i.als', leave_in='i.lst', subtracted_image='numpy.fits')
+        d.close()
+        image = fits.getdata(data.fits_image()).astype(np.float64)
+        difference = np.abs(result - substar)
+        self.assertLess(difference.max(), 1e-3 * np.abs(image - substar).max())
@@ -1,5 +1,5 @@
 import unittest
-from astwro.pydaophot import Daophot, Allstar
+from astwro.pydaophot import Daophot, Allstar, WorkersPool, as_completed
 
 # TODO: rewrite tests for v 0.4+ and switch to pytest
 
@@ -43,6 +43,43 @@ class TestRunners(unittest.TestCase):
         d.run()
         self.assertGreater(d.PSf_result.chi, 0)
 
+    def test_execution_daophot_persistent(self):
+        d = Daophot(image=self.image, preserve_process=True)
+        d.FInd(1, 1)
+        self.assertTrue(d.process_alive)
+        d.PHotometry(IS=35, OS=50, apertures=[8])
+        self.assertGreater(d.PHotometry_result.mag_limit, 0)
+        d.PIck()
+        self.assertGreater(d.PIck_result.stars, 0)
+        d.close()
+        self.assertFalse(d.process_alive)
+
+    def test_workers_pool(self):
+        d = Daophot(image=self.image)
+        d.FInd(1, 1)
+        d.PHotometry(IS=35, OS=50, apertures=[8])
+        d.PIck()
+        with WorkersPool(d, workers=2) as pool:
+            jobs = [pool.submit(psf_stars='i.lst', allstar_stars='i.ap') for _ in range(3)]
+            for job in as_completed(jobs):
+                psf, als = job.result()
+                self.assertGreater(psf.chi, 0)
+                self.assertTrue(als.success)
+
+    def test_workers_pool_interrupted(self):
+        import os
+        import time
+        d = Daophot(batch=True)  # no daophot process started, jobs do not use runners
+        jobs = []
+        with self.assertRaises(KeyboardInterrupt):
+            with WorkersPool(d, workers=2) as pool:
+                dirs = [w.daophot.dir.path for w in pool.workers]
+                jobs = [pool.submit(lambda worker: time.sleep(0.2)) for _ in range(10)]
+                raise KeyboardInterrupt
+        cancelled = [job for job in jobs if isinstance(job.exception(), RuntimeError)]
+        self.assertGreaterEqual(len(cancelled), 8)  # only jobs already taken by workers were executed
+        self.assertFalse(any(os.path.exists(p) for p in dirs))
+
 
 
 suite = unittest.TestLoader().loadTestsFromTestCase(TestRunners)
@@ -0,0 +1,32 @@
+import sys
+import subprocess
+import unittest
+from astwro.pydaophot import Timings
+from astwro.pydaophot.Timings import wait_process
+
+
+class TestTimings(unittest.TestCase):
+
+    def test_aggregation(self):
+        recorded = []
+        t1, t2 = Timings(), Timings()
+        t1.callbacks.append(lambda stage, wall, cpu: recorded.append(stage))
+        t1.add('process', 1.0, 0.5)
+        t1.add('process', 2.0, 1.0)
+        t2.add('process', 1.0)
+        with t2.measure('copy'):
+            pass
+        total = Timings.merged([t1, t2])
+        self.assertEqual(total.stages()['process'], (3, 4.0, 1.5))
+        self.assertEqual(total.stages()['copy'][0], 1)
+        self.assertEqual(recorded, ['process', 'process'])
+        self.assertIn('copy', total.report())
+        t1.reset()
+        self.assertEqual(len(t1.stages()), 0)
+
+    def test_wait_process(self):
+        p = subprocess.Popen([sys.executable, '-c', 'import sys; sum(range(3000000)); sys.exit(3)'])
+        cpu = wait_process(p)
+        self.assertEqual(p.returncode, 3)
+        if cpu is not None:  # POSIX
+            self.assertGreater(cpu, 0)
@@ -0,0 +1,24 @@
+import sys
+import threading
+import unittest
+from astwro.pydaophot import as_completed
+from astwro.pydaophot.WorkersPool import Job
+
+
+def leave(worker):
+    sys.exit(3)
+
+
+class TestJob(unittest.TestCase):
+
+    def test_base_exception(self):
+        # job raising SystemExit finishes, exception is re-raised by result()
+        jobs = [Job(leave, (), {}), Job(lambda worker, v: v, (5,), {})]
+        for job in jobs:
+            t = threading.Thread(target=job._execute, args=[None])
+            t.start()
+            t.join()
+        self.assertEqual(len(list(as_completed(jobs))), 2)
+        self.assertIsInstance(jobs[0].exception(timeout=1), SystemExit)
+        self.assertRaises(SystemExit, jobs[0].result, 1)
+        self.assertEqual(jobs[1].result(timeout=1), 5)
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 # Subclassing pandas:
@@ -9,6 +10,8 @@ class StarList(pd.DataFrame):
     _metadata = ['_DAO_hdr', '_DAO_type']
     _DAO_hdr = None
     _DAO_type = None
+    _xy_index = None  # (key, positions, rows, KD-tree) cache of spatial_index(), not propagated to derived lists
+    _xy_version = 0  # counter of columns assignments, part of spatial_index() cache key
 
     @staticmethod
     def new():
@@ -19,6 +22,10 @@ class StarList(pd.DataFrame):
         y = pd.Series(dtype='float64')
         return StarList({'id': id, 'x': x, 'y': y}, index=idx)
 
+    def __setitem__(self, key, value):
+        self._xy_version += 1  # column assigned, spatial index is rebuilt without comparing positions
+        super(StarList, self).__setitem__(key, value)
+
     @property
     def _constructor(self):
 
@@ -58,3 +65,183 @@ class StarList(pd.DataFrame):
         """Renumbers starlist (in place), updating `id` column and index to range start.. start+count"""
         self['id'] = range(start, self.count()+start)
         self.index = self.id
+
+    def spatial_index(self, rebuild=False):
+        """
+        Returns KD-tree of stars positions (`x`, `y` columns), built on first use and cached until positions change.
+        Stars with undefined position are not indexed.
+
+        Cached index is used if neither columns were assigned (e.g. ``sl['x'] = ...``, ``sl.x += 1.0``)
+        nor `x`, `y` arrays were replaced since it was built, and positions are equal to indexed ones, so
+        modifications in place (e.g. ``sl.loc[5, 'x'] = 100.0``, ``sl.x.values[5] = 100.0``) are noticed too.
+        The check is a single vectorized comparison, much cheaper than building the tree.
+
+        :param bool rebuild: build the index even if cached one is valid
+        :return: tuple (tree, rows) - :class:`scipy.spatial.cKDTree` and array of rows (positions in starlist)
+                 of indexed stars, tree point `i` is the star ``self.iloc[rows[i]]``; tree is None if there
+                 is no star with position
+        :rtype: (scipy.spatial.cKDTree, np.ndarray)
+        """
+        x, y = self['x'].values, self['y'].values
+        key = (self._xy_version, _buffer_key(x), _buffer_key(y))
+        if self._xy_index is not None and not rebuild:
+            cached_key, (cached_x, cached_y), rows, tree = self._xy_index
+            if cached_key == key and _same_values(cached_x, x) and _same_values(cached_y, y):
+                return tree, rows
+        from scipy.spatial import cKDTree
+        xy = np.column_stack([x, y]).astype(np.float64)
+        rows = np.flatnonzero(np.isfinite(xy).all(axis=1))
+        tree = cKDTree(xy[rows]) if len(rows) else None
+        self._xy_index = (key, (x.copy(), y.copy()), rows, tree)
+        return tree, rows
+
+    def within(self, x, y, r):
+        """
+        Returns stars within distance `r` from point (`x`, `y`)
+
+        :param float x: point x coordinate
+        :param float y: point y coordinate
+        :param float r: radius
+        :rtype: StarList
+        """
+        tree, rows = self.spatial_index()
+        found = rows[tree.query_ball_point([x, y], r)] if tree is not None else []
+        return self.iloc[np.sort(found)]
+
+    def nearest(self, k=1):
+        """
+        Finds `k` nearest neighbours of every star
+
+        :param int k: number of neighbours
+        :return: DataFrame indexed like starlist with columns `id1`...`idk` - ids of neighbours from the nearest
+                 and `dist1`...`distk` - distances to them; if there is less than `k` other stars, missing ids are
+                 -1 and distances are inf
+        :rtype: pd.DataFrame
+        """
+        tree, rows = self.spatial_index()
+        ids = np.full((self.count(), k), -1, dtype=np.int64)
+        dists = np.full((self.count(), k), np.inf)
+        if tree is not None:
+            d, i = tree.query(tree.data, k=k + 1)  # the nearest one is star itself
+            d = d.reshape(len(rows), k + 1)[:, 1:]
+            i = i.reshape(len(rows), k + 1)[:, 1:]
+            found = i < len(rows)
+            star_ids = self.id.values[rows]
+            ids[rows] = np.where(found, star_ids[np.minimum(i, len(rows) - 1)], -1)
+            dists[rows] = d
+        columns = ['id{}'.format(n) for n in range(1, k + 1)] + ['dist{}'.format(n) for n in range(1, k + 1)]
+        return pd.DataFrame(np.hstack([ids, dists]), index=self.index, columns=columns).astype(
+            dict(('id{}'.format(n), np.int64) for n in range(1, k + 1)))
+
+    def pairs_within(self, r):
+        """
+        Finds all pairs of stars within distance `r` from each other
+
+        :param float r: radius
+        :return: DataFrame with columns `id1`, `id2` (ids of stars in pair) and `dist` (distance),
+                 every pair is reported once
+        :rtype: pd.DataFrame
+        """
+        pairs = self.__pairs(r)
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        xy = self[['x', 'y']].values
+        dist = np.hypot(*(xy[pairs[:, 0]] - xy[pairs[:, 1]]).T)
+        ids = self.id.values
+        return pd.DataFrame({'id1': ids[pairs[:, 0]], 'id2': ids[pairs[:, 1]], 'dist': dist},
+                            columns=['id1', 'id2', 'dist'])
+
+    def crowding(self, r):
+        """
+        Counts neighbours of stars: number of other stars within distance `r`
+
+        :param float r: radius
+        :rtype: pd.Series
+        """
+        counts = np.bincount(self.__pairs(r).ravel(), minlength=self.count())
+        return pd.Series(counts, index=self.index, name='crowding')
+
+    def group(self, psf_radius, fitting_radius, critical_overlap=0.1, psf=None, gain=1.0, read_noise=0.0):
+        """
+        Groups stars as daophot GROUP does, returns copy of starlist with `group` column added.
+
+        Stars closer than `psf_radius` + `fitting_radius` to each other are linked, groups are connected
+        components of links, found by union-find over pairs from :meth:`spatial_index`.
+        With `psf` provided and positive `critical_overlap`, pair is linked only if light of brighter star
+        at the nearest point of fitting region of fainter one exceeds `critical_overlap` times expected
+        noise per pixel of fainter star: ``sqrt(read_noise**2 + sky / gain)`` (`sky` column, 0 if missing).
+
+        >>> grouped = stars.group(psf_radius=15, fitting_radius=3)
+        >>> grouped.groups_histogram()
+
+        :param float psf_radius: PSF radius
+        :param float fitting_radius: fitting radius
+        :param float critical_overlap: critical overlap, default 0.1 as in daophot GROUP, ignored without `psf`
+        :param psf: PSF model with ``evaluate(dx, dy, x, y)`` method and `psfmag` attribute,
+                    e.g. :class:`astwro.pydaophot.PsfModel`
+        :param float gain: gain in photons per ADU
+        :param float read_noise: readout noise in ADU
+        :return: starlist with `group` column - groups numbered from 1 in order of first star,
+                 stars without position forms separate groups
+        :rtype: StarList
+        """
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+        pairs = self.__pairs(psf_radius + fitting_radius)
+        if critical_overlap > 0 and psf is not None and len(pairs):
+            pairs = pairs[self.__overlapping(pairs, fitting_radius, critical_overlap, psf, gain, read_noise)]
+        n = self.count()
+        links = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+        _, labels = connected_components(links, directed=False)
+        grouped = self.copy()
+        grouped['group'] = labels + 1
+        return grouped
+
+    def groups_histogram(self):
+        """
+        Sizes of groups (`group` column, see :meth:`group`), like `DpOp_GRoup.groups_histogram`
+        of daophot GROUP
+
+        :return: list of tuples: (size_of_group, number_of_groups)
+        """
+        sizes = np.bincount(np.bincount(self['group'].values))
+        return [(size, int(count)) for size, count in enumerate(sizes) if size and count]
+
+    def __overlapping(self, pairs, fitting_radius, critical_overlap, psf, gain, read_noise):
+        # which of pairs pass daophot critical overlap test, pairs with undefined magnitudes do
+        mag = self.mag.values.astype(np.float64)
+        sky = self.sky.values.astype(np.float64) if 'sky' in self.columns else np.zeros(self.count())
+        xy = self[['x', 'y']].values.astype(np.float64)
+        i, j = pairs[:, 0], pairs[:, 1]
+        with np.errstate(invalid='ignore'):
+            swap = mag[i] > mag[j]  # i - brighter, j - fainter
+        i, j = np.where(swap, j, i), np.where(swap, i, j)
+        d = xy[j] - xy[i]
+        sep = np.hypot(d[:, 0], d[:, 1])
+        # nearest point of fainter star fitting region, relative to brighter star
+        shift = np.clip(sep - fitting_radius, 0, None) / np.where(sep > 0, sep, 1.0)
+        light = psf.evaluate(d[:, 0] * shift, d[:, 1] * shift, xy[i, 0], xy[i, 1]) \
+            * 10.0 ** (-0.4 * (mag[i] - psf.psfmag))
+        with np.errstate(invalid='ignore'):
+            noise = np.sqrt(read_noise ** 2 + np.clip(sky[j], 0, None) / gain)
+            return ~(light <= critical_overlap * noise)
+
+    def __pairs(self, r):
+        # rows of pairs of stars closer than r as (pairs x 2) array
+        tree, rows = self.spatial_index()
+        pairs = tree.query_pairs(r, output_type='ndarray') if tree is not None else []
+        if not len(pairs):
+            return np.empty((0, 2), dtype=np.int64)
+        return np.sort(rows[pairs], axis=1)
+
+
+def _buffer_key(values):
+    # identity of array memory: address of data, strides and shape
+    return values.__array_interface__['data'][0], values.strides, values.shape
+
+
+def _same_values(cached, values):
+    # element-wise equality of arrays of the same buffer key, undefined values (NaN) are equal
+    equal = cached == values
+    if equal.all():
+        return True
+    return bool(pd.isnull(cached[~equal]).all() and pd.isnull(values[~equal]).all())
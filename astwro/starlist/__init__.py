@@ -1,3 +1,4 @@
 from .daofiles import *
 from .ds9 import *
+from .crossmatch import *
 from _version import __version__, __version_info__
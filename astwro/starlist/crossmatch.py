@@ -0,0 +1,154 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import numpy as np
+import pandas as pd
+
+__all__ = ['match', 'apply_transform']
+
+_CANDIDATES = 4  # number of nearest neighbours considered for each star in one-to-one matching
+
+
+def match(starlist, other, radius, offset=None, one_to_one=True, transform=False, iterations=3):
+    """
+    Cross-matches stars of two lists by positions
+
+    Stars of `other` are matched against KD-tree of `starlist` positions (see :meth:`StarList.spatial_index`),
+    so matching many lists against the same `starlist` reuses the tree.
+
+    In one-to-one mode pairs are accepted from the closest, each star is matched at most once. Otherwise
+    all pairs closer than `radius` are returned.
+
+    With `transform` set, linear (affine) transformation of `other` coordinates onto `starlist` coordinates
+    is fitted to matched pairs and stars are re-matched using transformed coordinates, `iterations` times.
+    Fit of the transformation needs reasonable initial guess: coordinates of the same star differing less
+    than `radius` (after `offset` is applied).
+
+    >>> m = match(reference, frame, 2.0, offset=(12.5, -3.0))
+    >>> frame_mag = frame.loc[m.id2, 'mag']
+
+    :param StarList starlist: reference list of stars
+    :param StarList other: list of stars to be matched
+    :param float radius: max distance between matched stars
+    :param offset: (dx, dy) shift added to `other` coordinates before matching
+    :param bool one_to_one: resolve multiple matches, star can be matched only once
+    :param bool transform: fit and apply affine transformation of `other` coordinates
+    :param int iterations: number of fit and re-match iterations if `transform` is set
+    :return: DataFrame with columns `id1` (id of `starlist` star), `id2` (id of `other` star) and `dist`,
+             sorted by `id1`; if `transform` is set, tuple (matches, transformation) where transformation
+             is 2x3 matrix, see :func:`apply_transform`
+    :rtype: pd.DataFrame
+    """
+    xy = other[['x', 'y']].values.astype(np.float64)
+    t = np.array([[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+    if offset is not None:
+        t[:, 2] = offset
+    # KD-tree queries for spatially ordered points are a few times faster (cache locality),
+    # order remains spatially coherent after transformation, so it's computed once
+    valid = np.flatnonzero(np.isfinite(xy).all(axis=1))
+    query = valid[np.argsort(xy[valid, 0])]
+    rows1, rows2, dist = _match_rows(starlist, apply_transform(t, xy), query, radius, one_to_one)
+    if transform:
+        for _ in range(iterations):
+            if len(rows1) < 3:
+                raise ValueError('Too few stars matched ({}) to fit transformation'.format(len(rows1)))
+            t = _fit_transform(xy[rows2], starlist[['x', 'y']].values[rows1])
+            rows1, rows2, dist = _match_rows(starlist, apply_transform(t, xy), query, radius, one_to_one)
+    matches = pd.DataFrame({'id1': starlist.id.values[rows1], 'id2': other.id.values[rows2], 'dist': dist},
+                           columns=['id1', 'id2', 'dist'])
+    if transform:
+        return matches, t
+    return matches
+
+
+def apply_transform(transformation, xy):
+    """
+    Applies affine transformation to coordinates
+
+    :param transformation: 2x3 matrix: ``x' = t[0,0]*x + t[0,1]*y + t[0,2]``, ``y' = t[1,0]*x + t[1,1]*y + t[1,2]``
+    :param np.ndarray xy: (n x 2) array of coordinates
+    :return: (n x 2) array of transformed coordinates
+    """
+    t = np.asarray(transformation, dtype=np.float64)
+    return np.dot(xy, t[:, :2].T) + t[:, 2]
+
+
+def _fit_transform(xy, xy_ref, clip=3.0, iterations=5):
+    # least squares affine transformation xy -> xy_ref as 2x3 matrix,
+    # pairs with residuals above `clip` times median residual (false matches) are rejected and fit repeated
+    center = xy.mean(axis=0)  # centered coordinates for well conditioned normal equations
+    a = np.hstack([xy - center, np.ones((len(xy), 1))])
+    used = np.ones(len(xy), dtype=bool)
+    for _ in range(iterations):
+        coeffs = np.linalg.solve(np.dot(a[used].T, a[used]), np.dot(a[used].T, xy_ref[used]))
+        residuals = np.hypot(*(np.dot(a, coeffs) - xy_ref).T)
+        inliers = residuals <= clip * np.median(residuals[used])
+        if inliers.sum() < 3 or (inliers == used).all():
+            break
+        used = inliers
+    t = coeffs.T
+    t[:, 2] -= np.dot(t[:, :2], center)
+    return t
+
+
+def _match_rows(starlist, xy, query, radius, one_to_one):
+    # matched pairs as (rows of starlist, rows of xy, distances) sorted by starlist rows,
+    # query - rows of xy to be matched
+    tree, rows = starlist.spatial_index()
+    if tree is None or not len(query):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    k = min(_CANDIDATES, len(rows))
+    d, i = tree.query(xy[query], k=k, distance_upper_bound=radius)
+    d = d.reshape(len(query), k)
+    i = i.reshape(len(query), k)
+    found = i < len(rows)
+    r1, r2, dist = i[found], np.repeat(query, k)[found.ravel()], d[found]
+    if not one_to_one and k < len(rows):
+        # stars with all k candidates found may have more neighbours within radius
+        crowded = found.all(axis=1)
+        if crowded.any():
+            keep = ~crowded[np.nonzero(found)[0]]
+            r1, r2, dist = r1[keep], r2[keep], dist[keep]
+            neighbours = tree.query_ball_point(xy[query[crowded]], radius)
+            counts = np.array([len(n) for n in neighbours], dtype=np.int64)
+            more1 = np.fromiter((j for n in neighbours for j in n), dtype=np.int64, count=counts.sum())
+            more2 = np.repeat(query[crowded], counts)
+            r1, r2 = np.concatenate([r1, more1]), np.concatenate([r2, more2])
+            dist = np.concatenate([dist, np.hypot(*(tree.data[more1] - xy[more2]).T)])
+    if one_to_one:
+        r1, r2, dist = _resolve_one_to_one(r1, r2, dist, len(rows), len(xy))
+        slots = np.full(len(rows), -1, dtype=np.int64)  # r1 are unique, sort by placing in slots
+        slots[r1] = np.arange(len(r1))
+        order = slots[slots >= 0]
+    else:
+        order = np.lexsort((r2, r1))
+    return rows[r1[order]], r2[order], dist[order]
+
+
+def _first_occurrence(values, size):
+    # mask of elements which are the first occurrence of its value, values are ints in range(size)
+    positions = np.arange(len(values))
+    first = np.empty(size, dtype=np.int64)
+    first[values[::-1]] = positions[::-1]  # for repeated indices the last assignment wins
+    return first[values] == positions
+
+
+def _resolve_one_to_one(i1, i2, dist, size1, size2):
+    # greedy closest-first selection of pairs from candidates, every i1 and i2 used at most once;
+    # each round accepts pairs being the closest candidate for both of its stars
+    order = np.argsort(dist)
+    i1, i2, dist = i1[order], i2[order], dist[order]
+    used1 = np.zeros(size1, dtype=bool)
+    used2 = np.zeros(size2, dtype=bool)
+    accepted = []
+    while len(i1):
+        best = _first_occurrence(i1, size1) & _first_occurrence(i2, size2)
+        accepted.append((i1[best], i2[best], dist[best]))
+        used1[i1[best]] = True
+        used2[i2[best]] = True
+        left = ~(used1[i1] | used2[i2])
+        i1, i2, dist = i1[left], i2[left], dist[left]
+    if not accepted:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return tuple(np.concatenate(c) for c in zip(*accepted))
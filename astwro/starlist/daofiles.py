@@ -1,8 +1,17 @@
 from .StarList import StarList
 from .file_helpers import *
 import pandas as pd
+import numpy as np
+import re
+import glob
+import hashlib
+from string import Formatter
 from collections import namedtuple
 from itertools import chain
+try:
+    from StringIO import StringIO  # python2
+except ImportError:
+    from io import StringIO  # python3
 
 class DAO(object):
     FType = namedtuple('DAOFileType', ['columns', 'extension', 'NL', 'read_cols'])
@@ -154,7 +163,7 @@ def convert_dao_type(starlist, new_daotype, update_daotype=True):
     return True
 
 
-def read_dao_file(file, dao_type = None):
+def read_dao_file(file, dao_type = None, engine='pandas', cache=None):
     """
     Construct StarList from daophot output file.
     The header lines in file may be missing.
@@ -168,9 +177,21 @@ def read_dao_file(file, dao_type = None):
                     - DAO.ALS_FILE
                 If missing filename extension will be used to determine file type
                 if file is provided as filename
+    :param str engine: parser engine:
+                    - 'pandas' - whitespace separated columns parsed by pandas
+                    - 'numpy' - fixed-width columns (as written by daophot) sliced in numpy arrays, faster,
+                      falls back to 'pandas' if file does not match fixed-width layout of `dao_type`
+    :param cache: binary sidecar cache of parsed file (used only if file is provided as filename of known type):
+                    - None or False - no cache
+                    - True - sidecar file (hidden ``.npy`` file) next to the `file`
+                    - str - directory for sidecar files
+                  Sidecar is valid for path, size and modification time of `file`, changed file is parsed again
+                  and the sidecar is replaced. Sidecar is loaded memory-mapped.
     :return: StarList instance
     """
-    ret = _parse_file(file, dao_type)
+    if engine not in ('pandas', 'numpy'):
+        raise ValueError('Unknown engine: {}'.format(engine))
+    ret = _parse_file(file, dao_type, engine, cache)
     return ret
 
 
@@ -265,30 +286,199 @@ def _write_table(starlist, file, dao_type):
     pd.options.mode.chained_assignment = None  # default='warn'
     columns = [c for c in dao_type.columns if c in starlist.columns]
     coltypes = [_get_col_type(dao_type.extension, c) for c in columns]
-    towrite = starlist[columns]
 
-    for i, row in towrite.iterrows():
-        for col, coltype, val in zip(columns, coltypes, row):
-            if pd.isnull(val):
-                val = coltype.NaN[0]
-            file.write(coltype.format.format(val))
-        file.write('\n')
-
-def _parse_file(file, dao_type):
+    # NaNs replaced by sentinels for whole column at once
+    values = []
+    for col, coltype in zip(columns, coltypes):
+        column = starlist[col]
+        if coltype.NaN:
+            column = column.fillna(coltype.NaN[0])
+        values.append(column.values)
+    row_format = ''.join(coltype.format for coltype in coltypes) + '\n'
+    layouts = [_fixed_layout(coltype.format) for coltype in coltypes]
+    numeric = all(v.dtype.kind in 'iuf' for v in values)
+    if not values or not numeric or None in layouts:  # e.g. string columns of SKY_FILE: formatted row by row
+        rows = zip(*[v.tolist() for v in values]) if values else [()] * starlist.shape[0]
+        file.write(''.join([row_format.format(*row) for row in rows]))
+        return
+    # columnar: every column formatted into fixed-width characters by numpy, directly into (characters x rows)
+    # array of lines; values which str.format would not fit into the width or may round differently
+    # are rare, their rows are formatted by row_format
+    fields = []
+    width = 0
+    for prefix, size, precision, suffix in layouts:
+        fields.append((width, prefix, size, precision, suffix))
+        width += len(prefix) + size + len(suffix)
+    literals = np.full(width + 1, ord(' '), dtype=np.uint8)
+    literals[width] = ord('\n')
+    for start, prefix, size, _, suffix in fields:
+        literals[start:start + len(prefix)] = bytearray(prefix.encode('ascii'))
+        literals[start + len(prefix) + size:start + len(prefix) + size + len(suffix)] = \
+            bytearray(suffix.encode('ascii'))
+    for first in range(0, starlist.shape[0], _WRITE_CHUNK):
+        chunk = [v[first:first + _WRITE_CHUNK] for v in values]
+        rows = len(chunk[0]) if chunk else 0
+        lines = np.empty((rows, width + 1), dtype=np.uint8)
+        lines[:] = literals
+        fallback = np.zeros(rows, dtype=bool)
+        for v, (start, prefix, size, precision, _) in zip(chunk, fields):
+            begin = start + len(prefix)
+            fallback |= _format_fixed(v, precision, lines[:, begin:begin + size].T)
+        text = lines.tobytes()
+        if not isinstance(text, str):
+            text = text.decode('ascii')
+        pieces = []
+        last = 0
+        for i in np.flatnonzero(fallback):
+            pieces.append(text[last * (width + 1):i * (width + 1)])
+            pieces.append(row_format.format(*[v[i].item() for v in chunk]))
+            last = i + 1
+        pieces.append(text[last * (width + 1):])
+        file.write(''.join(pieces))
+
+
+_WRITE_CHUNK = 1 << 13  # rows formatted at once by _write_table, temporary arrays fit in CPU cache
+
+
+def _format_fixed(values, precision, chars):
+    # type: (np.ndarray, int, np.ndarray) -> np.ndarray
+    # Formats numbers as '{:<width>.<precision>f}'.format would do into blank (width x values) characters array,
+    # returns mask of values not formatted: result of str.format would be wider than width, value is not
+    # finite, or can not be rounded exactly in float64 arithmetic (is close to a tie)
+    width = chars.shape[0]
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid='ignore', over='ignore'):
+        scaled = np.abs(values) * 10.0 ** precision
+        inexact = ~(scaled < 2.0 ** 52)  # also NaN and inf
+        scaled[inexact] = 0.0
+        # float64 error of scaled is below 2**-52 relative, ties are checked with good margin
+        inexact |= np.abs(scaled - np.floor(scaled) - 0.5) <= scaled * 2.0 ** -46
+    rest = np.rint(scaled).astype(np.int64)
+    pos = width - 1
+    for k in range(width):  # k-th digit from the right
+        if precision and k == precision:
+            chars[pos] = ord('.')
+            pos -= 1
+        if pos < 0:
+            inexact |= k <= precision
+            break
+        blank = rest == 0 if k > precision else None  # no more digits, leading blank
+        if blank is not None and blank.all():
+            break
+        rest, digit = np.divmod(rest, 10)
+        digit += ord('0')
+        if blank is not None:
+            digit[blank] = ord(' ')
+        chars[pos] = digit
+        pos -= 1
+    inexact |= rest > 0
+    # minus sign before the first digit of negative numbers
+    negative = np.flatnonzero(np.signbit(values) & ~inexact)
+    if len(negative):
+        units = np.rint(scaled[negative]) // 10 ** precision
+        digits = np.searchsorted(10 ** np.arange(1, 19, dtype=np.int64), units, side='right') + 1
+        sign = width - digits - precision - (1 if precision else 0) - 1
+        inexact[negative[sign < 0]] = True
+        chars[sign[sign >= 0], negative[sign >= 0]] = ord('-')
+    return inexact
+
+
+def _parse_file(file, dao_type, engine='pandas', cache=None):
     if dao_type is None and isinstance(file, str):
         _, ext = os.path.splitext(file)
         dao_type = DAO.file_types.get(ext)
 
+    sidecar = None
+    if cache and isinstance(file, str) and dao_type is not None and dao_type != DAO.UNKNOWN_FILE:
+        sidecar = _sidecar_path(file, dao_type, engine, cache)
+        fl = _read_sidecar(sidecar, file, dao_type)
+        if fl is not None:
+            return fl
+
     f, to_close = get_stream(file, 'r')
     try:
-        hdr, _ = read_dao_header(f)
-        fl = _parse_table(f, hdr, dao_type)
+        hdr, stolen = read_dao_header(f)
+        fl = None
+        if engine == 'numpy':
+            text = f.read()
+            if stolen:
+                text = stolen + text
+            fl = _parse_fixed_table(text, hdr, dao_type)
+            if fl is None:  # not fixed-width layout, fallback to pandas
+                f = StringIO(text)
+        if fl is None:
+            fl = _parse_table(f, hdr, dao_type)
     finally:
         close_files(to_close)
     fl.DAO_hdr = hdr
+    if sidecar is not None:
+        _write_sidecar(sidecar, fl)
     return  fl
 
 
+_sidecar_version = 1
+
+
+def _sidecar_path(file, dao_type, engine, cache):
+    # type: (str, DAO.FType, str, object) -> str
+    # Sidecar file name contains hash of source file path, size and mtime - changed file has another sidecar
+    file = os.path.abspath(os.path.expanduser(file))
+    stat = os.stat(file)
+    key = (_sidecar_version, file, stat.st_size, getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_ino,
+           dao_type.extension, engine)
+    key = hashlib.md5(repr(key).encode('utf-8')).hexdigest()[:16]
+    directory, name = os.path.split(file)
+    if cache is True:
+        prefix = os.path.join(directory, '.' + name)
+    else:
+        prefix = os.path.join(os.path.expanduser(cache),
+                              name + '.' + hashlib.md5(file.encode('utf-8')).hexdigest()[:8])
+    return '{}.{}.npy'.format(prefix, key)
+
+
+def _read_sidecar(sidecar, file, dao_type):
+    # returns StarList from sidecar or None if there is no valid sidecar
+    try:
+        table = np.load(sidecar, mmap_mode='r')
+    except (IOError, OSError, ValueError):
+        return None
+    columns = list(table.dtype.names)
+    df = pd.DataFrame(dict([(c, np.array(table[c])) for c in columns]), columns=columns)
+    df.index = df.id
+    with open(os.path.expanduser(file), 'r') as f:
+        hdr, _ = read_dao_header(f)
+    ret = StarList(df)
+    ret.DAO_type = dao_type
+    ret.DAO_hdr = hdr
+    return ret
+
+
+def _write_sidecar(sidecar, starlist):
+    # writes columns of starlist as structured array, removes sidecars of previous versions of file
+    try:
+        dtype = np.dtype([(str(c), starlist[c].dtype) for c in starlist.columns])
+    except TypeError:
+        return
+    if dtype.hasobject:
+        return
+    table = np.empty(starlist.shape[0], dtype=dtype)
+    for c in starlist.columns:
+        table[str(c)] = starlist[c].values
+    prefix = sidecar[:-len('.0123456789abcdef.npy')]
+    try:
+        if not os.path.isdir(os.path.dirname(sidecar)):
+            os.makedirs(os.path.dirname(sidecar))
+        for old in glob.glob(prefix.replace('[', '[[]') + '.' + '[0-9a-f]' * 16 + '.npy'):
+            if old != sidecar:
+                os.remove(old)
+        tmp = '{}.{}.tmp'.format(sidecar, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, table)
+        os.rename(tmp, sidecar)
+    except (IOError, OSError):  # e.g. read-only directory, cache is optional
+        pass
+
+
 def read_dao_header(stream, line_prefix=''):
     """
     tries to read dao header, if fails returns already read characters
@@ -362,10 +552,185 @@ def _parse_table(f, hdr, dao_type):
     return ret
 
 
+def _fixed_layout(fmt):
+    # type: (str) -> (str, int, int, str)
+    # Layout of fixed-width float CType.format: tuple (prefix, width, precision, suffix),
+    # e.g. '{:8.0f}.' -> ('', 8, 0, '.'), '\n{:7.0f}' -> ('\n', 7, 0, '')
+    # None if format is not fixed-width float (or has other prefix than new line of AP files formats)
+    parsed = list(Formatter().parse(fmt))
+    literal, field, spec, _ = parsed[0]
+    m = re.match(r'(\d+)(?:\.(\d+))?f$', spec or '')
+    if field is None or literal.replace('\n', '') or m is None:
+        return None
+    if len(parsed) > 2 or len(parsed) == 2 and parsed[1][1] is not None:
+        return None
+    suffix = parsed[1][0] if len(parsed) == 2 else ''
+    return literal, int(m.group(1)), int(m.group(2) or 6), suffix
+
+
+def _fixed_format(fmt):
+    # type: (str) -> (int, str)
+    # Layout of fixed-width float CType.format: tuple (width, suffix), e.g. '{:8.0f}.' -> (8, '.')
+    # None if format is not fixed-width float (new line prefix of AP files formats is ignored)
+    layout = _fixed_layout(fmt)
+    return None if layout is None else (layout[1], layout[3])
+
+
+def _text_lines(text):
+    # Non-blank lines of text as tuple: (characters array, lines starts, lines lengths)
+    if not isinstance(text, bytes):
+        text = text.encode('ascii')
+    buf = np.frombuffer(text, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == ord('\n'))
+    starts = np.concatenate(([0], newlines + 1))
+    lengths = np.concatenate((newlines, [buf.size])) - starts
+    keep = lengths > 0
+    for i in np.flatnonzero(keep & (lengths < 7)):  # short lines, e.g. blank line after header
+        keep[i] = bool(text[starts[i]:starts[i] + lengths[i]].strip())
+    return buf, starts[keep], lengths[keep]
+
+
+def _fixed_columns(text_lines, dao_type, columns):
+    # Parses fixed-width `columns` of lines (as returned by _text_lines) into dict of numpy arrays,
+    # returns None if lines does not match fixed-width layout of right-aligned fixed-point numbers.
+    buf, starts, lengths = text_lines
+    if not len(starts):
+        return None
+    first = buf[starts[0]:starts[0] + lengths[0]].tobytes()
+    length = len(first.rstrip())
+    fields = []
+    end = 0
+    for col in columns:
+        layout = _fixed_format(_get_col_type(dao_type.extension, col).format)
+        if layout is None or end >= length:
+            break
+        width, suffix = layout
+        fields.append((col, end, width, suffix))
+        end += width + len(suffix)
+    if dao_type.read_cols is not None:
+        fields = fields[:dao_type.read_cols]
+    if not fields:
+        return None
+    end = fields[-1][1] + fields[-1][2] + len(fields[-1][3])
+    if (lengths < end).any():
+        return None
+    if dao_type.read_cols is None:  # nothing but blanks after last field
+        longer = np.flatnonzero(lengths > end)
+        if len(longer):
+            tail = np.arange(end, lengths[longer].max())
+            idx = starts[longer, np.newaxis] + tail
+            if (buf[np.minimum(idx, buf.size - 1)][tail < lengths[longer, np.newaxis]] != ord(' ')).any():
+                return None
+    steps = np.diff(starts)
+    if len(steps) and (steps == steps[0]).all():  # lines of equal length - view of buffer
+        chars = np.lib.stride_tricks.as_strided(buf[starts[0]:], shape=(len(starts), end), strides=(steps[0], 1))
+    else:
+        chars = None
+
+    # lines are parsed in chunks, characters of a chunk fit in CPU cache and are transposed
+    # (character position x line), so rows of fields are contiguous
+    data = dict((f[0], np.empty(len(starts), dtype=np.float64)) for f in fields)
+    points = {}
+    for first in range(0, len(starts), _READ_CHUNK):
+        if chars is None:
+            chunk = buf[starts[first:first + _READ_CHUNK, np.newaxis] + np.arange(end)]
+        else:
+            chunk = chars[first:first + _READ_CHUNK]
+        chunk = np.ascontiguousarray(chunk.T)
+        for col, start, width, suffix in fields:
+            for j, c in enumerate(suffix):
+                if not (chunk[start + width + j] == ord(c)).all():
+                    return None
+            point = _parse_fixed_field(chunk[start:start + width], data[col][first:first + _READ_CHUNK])
+            if point is None or points.setdefault(col, point) != point:
+                return None
+    for col, start, width, suffix in fields:
+        if points[col] >= 0:
+            data[col] /= 10.0 ** (width - 1 - points[col])
+    return [f[0] for f in fields], data
+
+
+_READ_CHUNK = 1 << 13  # lines parsed at once by _fixed_columns, transposed characters fit in CPU cache
+
+
+def _parse_fixed_field(chars, out):
+    # Parses right-aligned fixed-point numbers from (character position x line) array,
+    # stores in `out` integers of all digits and returns position of decimal point (-1 if none),
+    # the same in every line; returns None if there is anything else. Divided by 10**(number of decimal
+    # digits), integers (exact in float64) give correctly rounded results, identical to float(string).
+    width, lines = chars.shape
+    digits = chars - np.uint8(ord('0'))
+    isdigit = digits <= 9
+    if not isdigit[-1].all():  # blank field or not right-aligned
+        return None
+    nonblank = chars != ord(' ')
+    ispoint = chars == ord('.')
+    minus = chars == ord('-')
+    if (nonblank & ~isdigit & ~ispoint & ~minus).any():
+        return None
+    # blanks only on left, minus only on first nonblank position
+    if (nonblank[:-1] & (minus[1:] | ~nonblank[1:])).any():
+        return None
+    # decimal point at the same position in every line
+    point = np.flatnonzero(ispoint[:, 0])
+    point = point[0] if len(point) else -1
+    if np.count_nonzero(ispoint) != (lines if point >= 0 else 0) or point >= 0 and not ispoint[point].all():
+        return None
+    places = np.arange(width)
+    powers = np.where(places == point, 0.0, 10.0 ** (width - 1 - places - (places < point)))
+    out[:] = powers.dot(np.where(isdigit, digits, np.uint8(0)))
+    out[minus.any(axis=0)] *= -1
+    return point
+
+
+def _parse_fixed_table(text, hdr, dao_type):
+    # numpy engine of _parse_table, returns None if layout is not recognized
+    buf, starts, lengths = _text_lines(text)
+    if dao_type is None or dao_type == DAO.UNKNOWN_FILE:
+        if not hdr or not len(starts):
+            return None
+        NL = int(hdr['NL'])
+        first = buf[starts[0]:starts[0] + lengths[0]].tobytes()
+        dao_type = DAO.AP_FILE if NL == 2 else _guess_filetype(hdr, (len(first.rstrip()) - 7) // 9 + 1)
+        if dao_type == DAO.UNKNOWN_FILE:
+            return None
+    if dao_type.NL is None:  # not daophot-written file
+        return None
+    if dao_type == DAO.AP_FILE:  # two row per star format
+        if len(starts) % 2:
+            return None
+        odd = _fixed_columns((buf, starts[0::2], lengths[0::2]), dao_type, DAO.AP_FILE_ODD.columns)
+        even = _fixed_columns((buf, starts[1::2], lengths[1::2]), dao_type, DAO.AP_FILE_EVEN.columns)
+        if odd is None or even is None:
+            return None
+        columns = odd[0] + even[0]
+        data = odd[1]
+        data.update(even[1])
+    else:
+        parsed = _fixed_columns((buf, starts, lengths), dao_type, dao_type.columns)
+        if parsed is None:
+            return None
+        columns, data = parsed
+
+    # find NaN
+    for col in columns:
+        coltype = _get_col_type(dao_type.extension, col)
+        if coltype.NaN:
+            values = data[col]
+            values[np.in1d(values, coltype.NaN)] = np.nan
+    data['id'] = data['id'].astype(int)
+
+    df = pd.DataFrame(data, columns=columns)
+    df.index = df.id
+    ret = StarList(df)
+    ret.DAO_type = dao_type
+    return ret
+
+
 def _guess_filetype(header, table):
     type = DAO.UNKNOWN_FILE
     if header:
-        colno = table.columns.size
+        colno = table if isinstance(table, int) else table.columns.size
         NL = int(header['NL'])
         type = DAO.UNKNOWN_FILE
         if NL == 1:
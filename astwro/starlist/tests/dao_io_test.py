@@ -2,7 +2,12 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
+import os
 import os.path as path
+from shutil import copyfile
+from io import StringIO
+import numpy as np
+import pandas as pd
 import astwro.starlist as sl
 import astwro.sampledata as data
 from astwro.utils import tmpdir
@@ -22,6 +27,16 @@ def check_readwritereadqueals(f1):
     s2 = sl.read_dao_file(f2)
     assert s1.equals(s2)
 
+def check_writereadwrite_identical(f1):
+    s1 = sl.read_dao_file(f1)
+    d = tmpdir()
+    f2 = path.join(d.path, 'tmp1' + s1.DAO_type.extension)
+    f3 = path.join(d.path, 'tmp2' + s1.DAO_type.extension)
+    sl.write_dao_file(s1, f2)
+    sl.write_dao_file(sl.read_dao_file(f2), f3)
+    with open(f2) as c2, open(f3) as c3:
+        assert c2.read() == c3.read()
+
 
 def test_read_coo():
     s = sl.read_dao_file(data.coo_file())
@@ -60,6 +75,131 @@ def test_write_ap():
 def test_write_als():
     check_readwritereadqueals(data.als_file())
 
+def test_write_identical_ap():
+    check_writereadwrite_identical(data.ap_file())
+
+def test_write_identical_als():
+    check_writereadwrite_identical(data.als_file())
+
+def test_write_nan_sentinels():
+    s1 = sl.read_dao_file(data.als_file())
+    s1.loc[s1.index[0], 'mag'] = float('nan')
+    d = tmpdir()
+    f2 = path.join(d.path, 'tmp.als')
+    sl.write_dao_file(s1, f2)
+    with open(f2) as f:
+        assert '99.9990' in f.readlines()[3]
+
+# Golden files in `golden` directory were written by the original row by row (iterrows) writer
+# from golden_starlist() lists, for every DAO file type
+GOLDEN_DIR = path.join(path.dirname(path.abspath(__file__)), 'golden')
+GOLDEN_SPECIALS = [float('nan'), -0.0004, -0.0, 0.0005, 2.5, -2.5, 0.125, 123456789.123, -98765.4321, 1e20]
+
+def golden_starlist(dao_type):
+    # first stars of sample files, with NaNs, negative zeros, ties and values too wide for columns formats
+    sources = {'.coo': data.coo_file(), '.ap': data.ap_file(), '.lst': data.lst_file(), '.nei': data.nei_file(),
+               '.err': data.err_file()}
+    s = sl.read_dao_file(sources.get(dao_type.extension, data.als_file()))
+    hdr = s.DAO_hdr
+    s = s.iloc[:24].copy()
+    if dao_type == sl.DAO.UNKNOWN_FILE:
+        s = s[['id', 'x', 'y', 'mag']].rename(columns={'x': 1, 'y': 2, 'mag': 3})
+    elif dao_type.extension not in sources:
+        s = s[[c for c in dao_type.columns if c in s.columns]]
+    if dao_type == sl.DAO.SKY_FILE:
+        s['ra'] = ['20:06:{:07.4f}'.format(i / 3.0) for i in range(len(s))]
+        s['dec'] = ['+35:46:{:06.3f}'.format(i / 7.0) for i in range(len(s))]
+    for j, col in enumerate(s.columns):
+        if col in ('id', 'ra', 'dec'):
+            continue
+        for i, value in enumerate(GOLDEN_SPECIALS):
+            s.iloc[1 + (i + j) % (len(s) - 1), j] = value
+    s = sl.StarList(s)
+    s.DAO_hdr = hdr
+    s.DAO_type = dao_type
+    return s
+
+def golden_types():
+    return [sl.DAO.UNKNOWN_FILE, sl.DAO.COO_FILE, sl.DAO.AP_FILE, sl.DAO.LST_FILE, sl.DAO.NEI_FILE,
+            sl.DAO.ALS_FILE, sl.DAO.ERR_FILE, sl.DAO.SHORT_FILE, sl.DAO.XY_FILE, sl.DAO.SKY_FILE]
+
+def test_write_golden():
+    d = tmpdir()
+    for dao_type in golden_types():
+        f = path.join(d.path, 'tmp' + dao_type.extension)
+        sl.write_dao_file(golden_starlist(dao_type), f, dao_type, with_header=dao_type.NL is not None)
+        with open(f) as written, open(path.join(GOLDEN_DIR, 'golden' + dao_type.extension)) as golden:
+            assert written.read() == golden.read(), dao_type.extension
+
+def test_write_golden_large():
+    # many chunks of columnar writer, rows with values formatted by str.format between them
+    s = golden_starlist(sl.DAO.ALS_FILE)
+    big = sl.StarList(pd.concat([s] * 1000))
+    big.DAO_hdr = s.DAO_hdr
+    d = tmpdir()
+    f = path.join(d.path, 'tmp.als')
+    sl.write_dao_file(big, f, sl.DAO.ALS_FILE, with_header=False)
+    with open(f) as written, open(path.join(GOLDEN_DIR, 'golden.als')) as golden:
+        table = golden.read().split('\n', 3)[3]  # without header
+        assert written.read() == table * 1000
+
+def check_read_engines_equal(f1):
+    s1 = sl.read_dao_file(f1, engine='pandas')
+    s2 = sl.read_dao_file(f1, engine='numpy')
+    assert s1.DAO_type == s2.DAO_type
+    assert list(s1.columns) == list(s2.columns)
+    assert (s1.index == s2.index).all()
+    assert np.allclose(s1.values, s2.values, rtol=1e-15, equal_nan=True)
+
+def test_read_engines():
+    for f in [data.coo_file(), data.ap_file(), data.lst_file(), data.nei_file(), data.als_file()]:
+        check_read_engines_equal(f)
+
+def test_read_numpy_engine_fallback():
+    # not fixed-width file is read by pandas
+    s = sl.read_dao_file(StringIO(u'1 10.5 20.5 15.123 0.01\n2 11.5 22.5 16.123 0.02\n'),
+                         sl.DAO.SHORT_FILE, engine='numpy')
+    assert s.count() == 2
+    assert s.x[2] == 11.5
+
+def test_read_numpy_engine_chunks():
+    # many chunks of numpy engine, values identical to float() of fields
+    with open(data.als_file()) as f:
+        header, table = f.read().split('\n \n', 1)
+    lines = table.splitlines() * 3
+    d = tmpdir()
+    f = path.join(d.path, 'tmp.als')
+    with open(f, 'w') as out:
+        out.write(header + '\n \n' + '\n'.join(lines) + '\n')
+    s = sl.read_dao_file(f, engine='numpy')
+    expected = np.array([[float(v) for v in line.split()] for line in lines])
+    assert (s.id.values == expected[:, 0]).all()
+    assert (s[['x', 'y', 'mag', 'mag_err', 'sky', 'iter', 'chi', 'sharp']].values == expected[:, 1:]).all()
+    # moved decimal point in the last chunk, not fixed-width layout is read by pandas
+    lines[-1] = lines[-1][:7] + '{:9.4f}'.format(float(lines[-1][7:16]))[-9:] + lines[-1][16:]
+    with open(f, 'w') as out:
+        out.write(header + '\n \n' + '\n'.join(lines) + '\n')
+    check_read_engines_equal(f)
+    assert sl.read_dao_file(f, engine='numpy').count() == len(lines)
+
+def test_read_sidecar_cache():
+    d = tmpdir()
+    f = path.join(d.path, 'i.als')
+    copyfile(data.als_file(), f)
+    s1 = sl.read_dao_file(f, cache=True)
+    assert len(os.listdir(d.path)) == 2  # sidecar created
+    s2 = sl.read_dao_file(f, cache=True)
+    assert s1.equals(s2)
+    assert s2.DAO_type == sl.DAO.ALS_FILE
+    assert s2.DAO_hdr == s1.DAO_hdr
+    # changed file invalidates sidecar
+    short = s1.iloc[:10]
+    short.DAO_hdr = s1.DAO_hdr
+    sl.write_dao_file(short, f)
+    s3 = sl.read_dao_file(f, cache=True)
+    assert s3.count() == 10
+    assert len(os.listdir(d.path)) == 2  # old sidecar removed
+
 def test_convert_ap_to_als():
     s1 = sl.read_dao_file(data.als_file())
     d = tmpdir()
@@ -0,0 +1,49 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import numpy as np
+import astwro.starlist as sl
+import astwro.sampledata as data
+
+
+def shifted(s, t):
+    o = s.copy()
+    xy = sl.apply_transform(t, s[['x', 'y']].values)
+    o['x'] = xy[:, 0]
+    o['y'] = xy[:, 1]
+    o = o.iloc[np.random.RandomState(1).permutation(s.count())]
+    o['id'] = o.id + 100000
+    return o
+
+
+def test_match_offset():
+    s = sl.read_dao_file(data.ap_file())
+    o = shifted(s, [[1, 0, 10.0], [0, 1, -5.0]])
+    m = sl.match(s, o, 1.0, offset=(-10.0, 5.0))
+    assert len(m) == s.count()
+    assert (m.id2 == m.id1 + 100000).all()
+    assert np.allclose(m.dist, 0, atol=1e-6)
+    assert len(sl.match(s, o, 1.0)) < s.count()
+
+
+def test_match_one_to_one():
+    s = sl.read_dao_file(data.ap_file())
+    m = sl.match(s, s, 30.0)
+    assert len(m) == s.count()
+    assert (m.id1 == m.id2).all()
+    m = sl.match(s, s, 30.0, one_to_one=False)
+    assert len(m) == s.count() + 2 * len(s.pairs_within(30.0))
+    assert (m.dist <= 30.0).all()
+
+
+def test_match_transform():
+    s = sl.read_dao_file(data.ap_file())
+    a = 0.002
+    t = [[np.cos(a), -np.sin(a), 3.3], [np.sin(a), np.cos(a), -2.1]]
+    o = shifted(s, t)
+    m, fitted = sl.match(s, o, 2.0, offset=(-3.3, 2.1), transform=True)
+    assert len(m) == s.count()
+    assert (m.id2 == m.id1 + 100000).all()
+    assert np.allclose(sl.apply_transform(fitted, sl.apply_transform(t, s[['x', 'y']].values)),
+                       s[['x', 'y']].values, atol=1e-6)
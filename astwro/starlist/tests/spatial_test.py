@@ -0,0 +1,120 @@
+# coding=utf-8
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import numpy as np
+import astwro.starlist as sl
+import astwro.sampledata as data
+
+
+def distances(s):
+    xy = s[['x', 'y']].values
+    d = np.hypot(xy[:, np.newaxis, 0] - xy[np.newaxis, :, 0], xy[:, np.newaxis, 1] - xy[np.newaxis, :, 1])
+    np.fill_diagonal(d, np.inf)
+    return d
+
+
+def test_within():
+    s = sl.read_dao_file(data.ap_file())
+    found = s.within(500, 500, 50)
+    assert found.count() > 0
+    assert (np.hypot(found.x - 500, found.y - 500) <= 50).all()
+    assert found.count() == (np.hypot(s.x - 500, s.y - 500) <= 50).sum()
+
+
+def test_nearest():
+    s = sl.read_dao_file(data.ap_file())
+    n = s.nearest(2)
+    d = distances(s)
+    assert np.allclose(n.dist1, d.min(axis=1))
+    assert (n.dist1 <= n.dist2).all()
+    assert (n.id1 == s.id.values[d.argmin(axis=1)]).all()
+
+
+def test_pairs_and_crowding():
+    s = sl.read_dao_file(data.ap_file())
+    d = distances(s)
+    pairs = s.pairs_within(10)
+    assert len(pairs) == (d <= 10).sum() // 2
+    assert (pairs.dist <= 10).all()
+    assert (s.crowding(10).values == (d <= 10).sum(axis=1)).all()
+
+
+def test_index_invalidation():
+    s = sl.read_dao_file(data.ap_file())
+    assert s.within(2000, 2000, 1).count() == 0
+    s.loc[s.index[0], 'x'] = 2000.0
+    s.loc[s.index[0], 'y'] = 2000.0
+    assert s.within(2000, 2000, 1).count() == 1
+
+
+def test_index_invalidation_float_columns():
+    s = sl.StarList({'x': np.arange(10.0), 'y': np.arange(10.0)}, columns=['x', 'y'])
+    assert s.within(100, 100, 1).count() == 0
+    s.iat[3, 0] = 100.0
+    s.y[3] = 100.0
+    assert s.within(100, 100, 1).count() == 1
+    s.x.values[5] = s.y.values[5] = 100.0  # modification of underlying arrays
+    assert s.within(100, 100, 1).count() == 2
+    s.x = s.x + 1.0
+    assert s.within(101, 100, 1).count() == 2
+
+
+def test_index_cached():
+    s = sl.StarList({'x': [1.0, np.nan, 3.0], 'y': [1.0, 2.0, 3.0]}, columns=['x', 'y'])
+    tree, rows = s.spatial_index()
+    assert list(rows) == [0, 2]
+    assert s.spatial_index()[0] is tree  # undefined positions do not invalidate index
+    s['mag'] = 10.0  # any column assignment does
+    assert s.spatial_index()[0] is not tree
+    tree = s.spatial_index()[0]
+    assert s.spatial_index(rebuild=True)[0] is not tree
+
+
+def test_group():
+    s = sl.read_dao_file(data.ap_file())
+    g = s.group(psf_radius=7, fitting_radius=3)
+    d = distances(s)
+    groups = g['group'].values
+    # linked stars are in the same group, every group is connected
+    assert (groups[np.nonzero(d < 10)[0]] == groups[np.nonzero(d < 10)[1]]).all()
+    for label in np.unique(groups)[:50]:
+        members = np.flatnonzero(groups == label)
+        reached = {members[0]}
+        for _ in members:
+            reached |= set(np.flatnonzero((d[sorted(reached)] < 10).any(axis=0)))
+        assert reached == set(members)
+    histogram = g.groups_histogram()
+    assert sum(size * count for size, count in histogram) == s.count()
+    assert sum(count for _, count in histogram) == len(np.unique(groups))
+
+
+def test_group_critical_overlap():
+    from astwro.pydaophot import read_psf_file
+    s = sl.read_dao_file(data.als_file())
+    psf = read_psf_file(data.psf_file())
+    previous = s.group(psf_radius=10, fitting_radius=3)['group'].values  # distance only
+    counts = []
+    for overlap in [0.1, 1.0, 10.0]:
+        groups = s.group(psf_radius=10, fitting_radius=3, critical_overlap=overlap, psf=psf)['group'].values
+        # raising critical overlap splits groups, as in daophot GROUP, never merges them
+        for label in np.unique(groups):
+            assert len(np.unique(previous[groups == label])) == 1
+        counts.append(len(np.unique(groups)))
+        previous = groups
+    assert counts == sorted(counts) and counts[0] < counts[-1]
+    default = s.group(psf_radius=10, fitting_radius=3, psf=psf)['group'].values
+    assert (default == s.group(psf_radius=10, fitting_radius=3, critical_overlap=0.1, psf=psf)['group'].values).all()
+
+
+def test_group_pair_split():
+    from astwro.pydaophot import read_psf_file
+    psf = read_psf_file(data.psf_file())
+    s = sl.StarList({'id': [1, 2], 'x': [100.0, 106.0], 'y': [100.0, 100.0], 'mag': [psf.psfmag, psf.psfmag + 5.0],
+                     'sky': [100.0, 100.0]}, columns=['id', 'x', 'y', 'mag', 'sky'])
+    light = psf.evaluate(3.0, 0.0, 100.0, 100.0)  # brighter star at the nearest pixel of fitting region
+    noise = np.sqrt(100.0)
+    linked = s.group(psf_radius=10, fitting_radius=3, critical_overlap=0.5 * light / noise, psf=psf)
+    split = s.group(psf_radius=10, fitting_radius=3, critical_overlap=2.0 * light / noise, psf=psf)
+    assert list(linked['group']) == [1, 1]
+    assert list(split['group']) == [1, 2]
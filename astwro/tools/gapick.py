@@ -18,7 +18,6 @@ __metaclass__ = type
 # TODO: allstar.opt missing in result dir!
 # For later, on request:
 # TODO: Option for provide own PSF stars set, used for comaprision, including in candidates, put in initial population
-# TODO: Checkpoints - continue calculation
 
 
 
@@ -27,13 +26,16 @@ import logging
 import random
 import pickle
 import time
+import hashlib
+import glob
+import socket
+import threading
 from datetime import timedelta
 from copy import deepcopy
-from itertools import izip_longest
+from collections import OrderedDict
 
 import numpy
-from bitarray import bitarray
-from scipy.stats import sigmaclip
+from scipy.stats import sigmaclip, spearmanr
 from deap import base
 from deap import creator
 from deap import tools
@@ -63,40 +65,145 @@ def check_arguments(arg):
 
 # Definitions for genetic algorithm:
 # 'individual' - subset of candidates competing with other subsets to be the best in fitness
-# 'genome' - the individual's definition with subset of candidates stars, is represented by binary string
-#     of length equal to number of candidate stars. '1' means that star is in subset.
+# 'genome' - the individual's definition with subset of candidates stars, is represented by boolean numpy array
+#     of length equal to number of candidate stars. True means that star is in subset; stored as binary string
+#     ('1' for True) in files and as cache key.
 # 'fitness' - minimized function on individual, mean of errors form allstar if individual's stars are
 #     taken as PSF stars
-# 'population' - set of all individuals in some iteration
+# 'population' - set of all individuals in some iteration, genetic operators and statistics work on
+#     population stacked into (individuals x candidates) boolean matrix
 
 # 2.1 Definition of routines used by algorithms: initializations, scoring
 def select_stars(starlist, genome):
-    # type: (sl.StarList, bitarray) -> sl.StarList
+    # type: (sl.StarList, numpy.ndarray) -> sl.StarList
     #Select stars present in genome
-    return starlist[genome.tolist()]
+    return starlist[numpy.asarray(genome, dtype=bool)]
 
 
 def random_genome(ind_class, len, prob_limits):
-    # type: (type, int, [float, float]) -> bitarray
+    # type: (type, int, [float, float]) -> numpy.ndarray
     #Create random genome of length `len` in which probability of '1' on any position is from `prob_limits` range.
     prob = random.uniform(prob_limits[0], prob_limits[1])
-    return ind_class([random.random() <= prob for _ in range(len)])
+    return ind_class(numpy.random.random(len) <= prob)
+
+
+def genome_to01(genome):
+    # type: (numpy.ndarray) -> str
+    # Binary string of genome: '1' for star present in genome (like `bitarray.to01`), method of Individual class
+    s = (numpy.asarray(genome, dtype=numpy.uint8) + ord('0')).tobytes()
+    return s if isinstance(s, str) else s.decode('ascii')
+
+
+def genome_from01(s):
+    # type: (str) -> numpy.ndarray
+    # Genome from binary string created by genome_to01
+    return numpy.frombuffer(s.encode('ascii'), dtype=numpy.uint8) == ord('1')
 
 
 def clone_individual(individual):
-    # type: (bitarray) -> bitarray
-    #Make a deepcopy-clone - deepcopy genome bitarray and associated fitness
+    # type: (numpy.ndarray) -> numpy.ndarray
+    #Make a deepcopy-clone - deepcopy genome and associated fitness
     n = deepcopy(individual)
     n.fitness = deepcopy(individual.fitness)
     return n
 
+
+def vary_population(offspring, cross_prob, mut_prob, mut_str):
+    # type: (list, float, float, float) -> numpy.ndarray
+    # Genetic operators on whole population at once (in place): two-point crossover of pairs of consecutive
+    # individuals with probability `cross_prob` and bit flip mutation of individuals with probability
+    # `mut_prob`, flipping every bit with probability `mut_str` (as deap's cxTwoPoint and mutFlipBit).
+    # Fitnesses of changed individuals are invalidated.
+    # :return: mask of changed individuals
+    genomes = numpy.array(offspring, dtype=bool)  # population matrix
+    n, length = genomes.shape
+    changed = numpy.zeros(n, dtype=bool)
+    pairs = n // 2
+    if length > 1 and pairs:
+        crossed = numpy.random.random(pairs) < cross_prob
+        point1 = numpy.random.randint(1, length + 1, size=pairs)
+        point2 = numpy.random.randint(1, length, size=pairs)
+        point2 += point2 >= point1
+        low, high = numpy.minimum(point1, point2), numpy.maximum(point1, point2)
+        columns = numpy.arange(length)
+        swap = (columns >= low[:, numpy.newaxis]) & (columns < high[:, numpy.newaxis]) & crossed[:, numpy.newaxis]
+        first, second = genomes[0:2 * pairs:2], genomes[1:2 * pairs:2]
+        genomes[0:2 * pairs:2], genomes[1:2 * pairs:2] = numpy.where(swap, second, first), \
+            numpy.where(swap, first, second)
+        changed[0:2 * pairs:2] = changed[1:2 * pairs:2] = crossed
+    mutants = numpy.random.random(n) < mut_prob
+    genomes ^= (numpy.random.random((n, length)) < mut_str) & mutants[:, numpy.newaxis]
+    changed |= mutants
+    for i in numpy.flatnonzero(changed):
+        offspring[i][:] = genomes[i]
+        del offspring[i].fitness.values
+    return changed
+
+
+def individuals_to_list(individuals):
+    # type: (list) -> list
+    # Picklable form of individuals: (genome string, fitness values) tuples, empty values for not evaluated
+    return [(ind.to01(), ind.fitness.values if ind.fitness.valid else ()) for ind in individuals]
+
+
+def individuals_from_list(ind_class, genomes):
+    # type: (type, list) -> list
+    # Recreates individuals stored by individuals_to_list
+    individuals = []
+    for genome, values in genomes:
+        ind = ind_class(genome_from01(genome))
+        if values:
+            ind.fitness.values = values
+        individuals.append(ind)
+    return individuals
+
+
+def _dump_atomic(obj, filename):
+    # Pickles obj into temporary file, then renames it to `filename`, so the `filename` is always
+    # complete (previous or new) even if process is killed during writing
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    if os.name == 'nt' and os.path.exists(filename):  # no atomic rename over existing file on windows
+        os.remove(filename)
+    os.rename(tmp_filename, filename)
+
+
+def write_checkpoint(filename, generation, population, halloffame, logbook, context, cache=None, predicted=None,
+                     penalised=None):
+    # Saves state of evolution after `generation`, which allows resuming evolution by load_checkpoint.
+    # Individuals are stored as genome strings with fitnesses, RNG states are stored as well.
+    # `predicted`, `penalised` - genomes strings of individuals with fitnesses predicted by Surrogate
+    # and with Penalty fitnesses of EarlyAbort
+    checkpoint = dict(generation=generation,
+                      predicted=list(predicted or []),
+                      penalised=list(penalised or []),
+                      population=individuals_to_list(population),
+                      halloffame=individuals_to_list(halloffame),
+                      logbook=logbook,
+                      context=context,
+                      cache=cache.items() if cache is not None else None,
+                      random_state=random.getstate(),
+                      numpy_random_state=numpy.random.get_state())
+    _dump_atomic(checkpoint, filename)
+
+
+def load_checkpoint(filename):
+    # type: (str) -> dict
+    # Loads checkpoint written by write_checkpoint
+    with open(filename, 'rb') as f:
+        checkpoint = pickle.load(f)
+    population = checkpoint.get('population') if isinstance(checkpoint, dict) else None
+    if not population or not isinstance(population[0], tuple):
+        raise ValueError('Unsupported checkpoint file format or empty population: {}'.format(filename))
+    return checkpoint
+
 def calc_spectrum(pop):
     #calculates 'spectrogram' of population
     #which is a statistic of stars occurrences in population individuals
-    spec = numpy.zeros(len(pop[0]))
-    for ind in pop:
-        spec += ind.tolist()
-    return spec
+    return numpy.array(pop, dtype=bool).sum(axis=0).astype(float)
 
 
 def fitness_for_als(als):
@@ -105,180 +212,478 @@ def fitness_for_als(als):
     return sigmaclip(als.chi)[0].mean(),  # fitness is tuple (val,)
 
 
-def eval_population(population, candidates, workers, show_progress, fine_tune):
-    if fine_tune:
-        return eval_population_fine_psf(population, candidates, workers, show_progress)
-    else:
-        return eval_population_simple(population, candidates, workers, show_progress)
-
-
-def eval_population_fine_psf(population, candidates, workers, show_progress):
-    # type: (list(bitarray), sl.StarList, list(dict), bool) -> list
-    # Evaluates fitness for all individual in population.
-
-    # This version uses sofisticated process from daophot_bialkow
-    # Uses daophots and allstars processes form `workers` running them in parallel.
-    # :return: list fitnesses (1-element couples as `deap` lib likes)
-
-    progress = None
-    if show_progress:
-        progress = utils.progressbar(total=len(population), step=len(workers))
-        progress.print_progress(0)
-    fitnesses = []
-    f_max = None
-    # https://docs.python.org/3/library/itertools.html#itertools-recipes grouper()
-    # grouping population into chunks of size `parallel`
-    for chunk in izip_longest(*([iter(population)] * len(workers))):
-        active = [g is not None for g in chunk]  # all active, on errors some could be deactivated
-        # PSF
-        for individual, worker in zip(chunk, workers):
-            if individual:
-                pdf_s = select_stars(candidates, individual)
-                worker['daophot'].write_starlist(pdf_s, 'i.lst')
-                worker['daophot'].PSf(psf_stars='i.lst')  # add to queue only - batch mode
-                worker['daophot'].run(wait=False)  # parallel start all workers without waiting
-        # wait for PSF and start ALLSTAR nei
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['daophot'].wait_for_results()  # now wait before using results
-                active[i] = worker['daophot'].PSf_result.converged  # PSF is not always successful
-                if active[i]:
-                    worker['allstar'].ALlstar(stars='i.nei')       # enqueue calculation
-                    worker['allstar'].run(wait=False)  # asynchronous / parallel
-        # second PSF
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['allstar'].wait_for_results()
-                if worker['allstar'].ALlstars_result.success:
-                    worker['daophot'].SUbstar(subtract='i.als', leave_in='i.lst')
-                    worker['daophot'].run()  # quick run
-                    worker['daophot'].ATtach('is')
-                    worker['daophot'].PSf(photometry='i.als', psf_stars='i.lst')
-                    worker['daophot'].run(wait=False)
-                else:
-                    active[i] = False
-        # second allstar
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['daophot'].wait_for_results()
-                if worker['daophot'].PSf_result.success:
-                    worker['allstar'].ALlstar(stars='i.nei')       # enqueue calculation
-                    worker['allstar'].run(wait=False)  # asynchronous / parallel
-                else:
-                    active[i] = False
-        # third PSF
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['allstar'].wait_for_results()
-                if worker['allstar'].ALlstars_result.success:
-                    worker['daophot'].SUbstar(subtract='i.als', leave_in='i.lst')
-                    worker['daophot'].run()  # quick run
-                    worker['daophot'].ATtach('is')
-                    worker['daophot'].PSf(photometry='i.als', psf_stars='i.lst')
-                    worker['daophot'].run(wait=False)
-                else:
-                    active[i] = False
-        # final allstar
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['daophot'].wait_for_results()
-                if worker['daophot'].PSf_result.success:
-                    worker['allstar'].ALlstar(stars='als.ap')       # enqueue calculation
-                    worker['allstar'].run(wait=False)  # asynchronous / parallel
-                else:
-                    active[i] = False
-
-        # wait for allstar for workers and process results
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['allstar'].wait_for_results()
-                all_s = worker['allstar'].ALlstars_result.als_stars
-                f = fitness_for_als(all_s)
-                fitnesses.append(f)  # fitness is tuple (val,)
-                f_max = max(f_max, f)
+class FitnessCache(object):
+    # LRU cache of fitnesses of already evaluated genomes.
+    # Keys are genomes bits (`ind.to01()`), fitness is valid only for evaluation `context` -
+    # digest of options and input files, cache persisted in a file is used only when contexts matches.
+    # Failed evaluations are stored as None.
+
+    def __init__(self, context, maxsize=10000):
+        self.context = context
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__data = OrderedDict()
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __contains__(self, genome):
+        return genome.to01() in self.__data
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, genome):
+        # type: (numpy.ndarray) -> (bool, tuple)
+        # :return: tuple (found, fitness)
+        key = genome.to01()
+        try:
+            fitness = self.__data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return False, None
+        self.__data[key] = fitness  # most recently used at the end
+        self.hits += 1
+        return True, fitness
+
+    def put(self, genome, fitness):
+        if self.maxsize <= 0:
+            return
+        key = genome.to01()
+        self.__data.pop(key, None)
+        self.__data[key] = fitness
+        while len(self.__data) > self.maxsize:
+            self.__data.popitem(last=False)  # least recently used
+
+    def items(self):
+        # :return: list of (genome string, fitness) from least to most recently used
+        return list(self.__data.items())
+
+    def update(self, items):
+        # Adds (genome string, fitness) items, e.g. returned by `items()`
+        for key, fitness in items:
+            self.__data.pop(key, None)
+            self.__data[key] = fitness
+        while len(self.__data) > self.maxsize:
+            self.__data.popitem(last=False)
+
+    def dump(self, filename):
+        _dump_atomic({'context': self.context, 'items': self.items()}, filename)
+
+    def load(self, filename):
+        # Loads cache content from file if created for the same context
+        # :return: number of loaded items
+        with open(filename, 'rb') as f:
+            stored = pickle.load(f)
+        if stored['context'] != self.context:
+            logging.warning('Fitness cache {} created for different options or input files, ignored'.format(filename))
+            return 0
+        self.update(stored['items'])
+        return len(stored['items'])
+
+
+class Surrogate(object):
+    # Cheap model of fitness used for pre-screening of offspring: ridge regression of fitness on genome bits
+    # (contributions of individual stars), fitted online on genomes already evaluated by daophot.
+    # Offspring are ranked by predicted fitness, only the best `fraction` of them, and `explore` fraction
+    # of the rest chosen randomly, are evaluated by daophot, the rest gets predicted fitnesses.
+    # Individuals with predicted fitness are remembered (by genome), they are evaluated (not ranked again)
+    # when they survive to the next generation, and should not be taken as results.
+
+    def __init__(self, fraction, explore=0.1, min_samples=50, max_samples=5000, ridge=1.0):
+        self.fraction = fraction
+        self.explore = explore
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.ridge = ridge
+        self.__samples = OrderedDict()  # genome string -> fitness value
+        self.__weights = None  # intercept followed by per star weights, None if outdated
+        self.__predicted = set()  # genomes strings of individuals with predicted fitnesses
+        self.__screened = {}  # genome string -> prediction, for genomes chosen for evaluation
+
+    def __len__(self):
+        return len(self.__samples)
+
+    def add(self, genomes, fitnesses):
+        # Adds evaluated samples: genomes (individuals or genome strings) and fitnesses,
+        # failed (None) and dropped (Penalty) are skipped
+        for genome, fitness in zip(genomes, fitnesses):
+            if fitness is None or isinstance(fitness, Penalty):
+                continue
+            key = genome.to01() if hasattr(genome, 'to01') else genome
+            self.__samples.pop(key, None)
+            self.__samples[key] = fitness[0]
+            self.__predicted.discard(key)
+        while len(self.__samples) > self.max_samples:
+            self.__samples.popitem(last=False)  # the oldest
+        self.__weights = None
+
+    def predicted(self, individual):
+        return individual.to01() in self.__predicted
+
+    def set_predicted(self, genomes):
+        # Marks genomes (strings) as having predicted fitnesses, e.g. restored from checkpoint
+        self.__predicted.update(genomes)
+
+    def predict(self, individuals):
+        # :return: array of predicted fitness values, or None if model has not enough samples
+        if len(self.__samples) < self.min_samples:
+            return None
+        if self.__weights is None:
+            x = _design_matrix(list(self.__samples.keys()))
+            y = numpy.fromiter(self.__samples.values(), dtype=float)
+            a = x.T.dot(x) + self.ridge * numpy.eye(x.shape[1])
+            a[0, 0] -= self.ridge  # intercept is not regularized
+            self.__weights = numpy.linalg.solve(a, x.T.dot(y))
+        return _design_matrix(individuals).dot(self.__weights)
+
+    def screen(self, individuals, cache=None):
+        # type: (list, FitnessCache) -> (list, list)
+        # Chooses individuals for evaluation, the rest gets predicted fitnesses.
+        # Individuals with predicted fitnesses (survivors of previous generation) and with genomes found
+        # in fitness `cache` are always chosen.
+        # :return: tuple (chosen individuals, individuals with predicted fitnesses)
+        self.__screened = {}
+        candidates = [ind for ind in individuals if not self.predicted(ind) and (cache is None or ind not in cache)]
+        prediction = self.predict(candidates) if candidates else None
+        if prediction is None:
+            return individuals, []
+        order = numpy.argsort(prediction)  # the best (lowest) first
+        best = int(numpy.ceil(self.fraction * len(candidates)))
+        rest = list(order[best:])
+        chosen = set(order[:best]) | set(random.sample(rest, int(round(self.explore * len(rest)))))
+        predicted = []
+        for i, ind in enumerate(candidates):
+            if i in chosen:
+                self.__screened[ind.to01()] = prediction[i]
             else:
-                fitnesses.append(None)
-        # cut fitnesses if longer than population
-        # (finesses mod parallel == 0, some None at the end can appear if population mod parallel != 0)
-        fitnesses = fitnesses[:len(population)]
-        # fill gaps in fitnesses by maximum of rest of population
-        for i, f in enumerate(fitnesses):
-            if f is None:
-                fitnesses[i] = f_max
-        if progress:
-            progress.print_progress()
-
-    return fitnesses
-
-
-def eval_population_simple(population, candidates, workers, show_progress):
-    # type: (list(bitarray), sl.StarList, list(dict), bool) -> list
+                ind.fitness.values = (prediction[i],)
+                self.__predicted.add(ind.to01())
+                predicted.append(ind)
+        predicted_ids = set(id(ind) for ind in predicted)
+        return [ind for ind in individuals if id(ind) not in predicted_ids], predicted
+
+    def accuracy(self, individuals, fitnesses):
+        # Spearman rank correlation of predicted and evaluated fitnesses of individuals chosen by last `screen`,
+        # failed (None) and dropped (Penalty) evaluations are skipped
+        pairs = [(self.__screened[ind.to01()], fitness[0]) for ind, fitness in zip(individuals, fitnesses)
+                 if ind.to01() in self.__screened and fitness is not None and not isinstance(fitness, Penalty)]
+        if len(pairs) < 3:
+            return float('nan')
+        return spearmanr(*zip(*pairs))[0]
+
+
+def evaluated_individuals(population, surrogate):
+    # type: (list, Surrogate) -> list
+    # Individuals of population with fitnesses evaluated (not predicted by `surrogate`), there is always
+    # at least one of them in population of offspring screened by `surrogate`
+    if surrogate is None:
+        return population
+    return [ind for ind in population if not surrogate.predicted(ind)]
+
+
+def _design_matrix(genomes):
+    # type: (list) -> numpy.ndarray
+    # Rows of intercept term followed by genome bits, genomes can be given as binary strings
+    bits = numpy.array([genome_from01(g) if isinstance(g, (str, type(u''))) else g for g in genomes],
+                       dtype=float).reshape(len(genomes), -1)
+    return numpy.hstack([numpy.ones((len(genomes), 1)), bits])
+
+
+class Migration(object):
+    # Island model: gapick processes (islands) sharing migration `directory` (local or network one, so islands
+    # can run on many nodes) evolve their populations independently, and every `interval` generations
+    # exchange `migrants` best individuals. Island publishes its best individuals in `<island>.mig` file
+    # of the directory, and takes the newest ones published by others. Islands can join or leave any time.
+    # Only islands of the same evaluation `context` exchange individuals, so migrants fitnesses are comparable.
+
+    def __init__(self, directory, island, context, interval=5, migrants=2):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.island = island
+        self.context = context
+        self.interval = interval
+        self.migrants = migrants
+        self.__received = {}  # island -> generation of last received migrants
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:  # created meanwhile by other island
+                pass
+
+    def due(self, generation):
+        return self.interval > 0 and generation % self.interval == 0
+
+    def emigrate(self, generation, population):
+        # Publishes the best individuals of population
+        best = tools.selBest([ind for ind in population if ind.fitness.valid], self.migrants)
+        _dump_atomic({'island': self.island, 'context': self.context, 'generation': generation,
+                      'individuals': individuals_to_list(best)},
+                     os.path.join(self.directory, self.island + '.mig'))
+
+    def immigrate(self, ind_class):
+        # type: (type) -> list
+        # :return: individuals published by other islands since last call
+        immigrants = []
+        for filename in sorted(glob.glob(os.path.join(self.directory, '*.mig'))):
+            try:
+                with open(filename, 'rb') as f:
+                    migration = pickle.load(f)
+            except (IOError, OSError, EOFError, pickle.UnpicklingError):  # removed or being replaced
+                continue
+            island = migration['island']
+            if island == self.island or migration['context'] != self.context \
+                    or self.__received.get(island) == migration['generation']:
+                continue
+            self.__received[island] = migration['generation']
+            immigrants += individuals_from_list(ind_class, migration['individuals'])
+        return immigrants
+
+
+def migrate(population, immigrants):
+    # type: (list, list) -> int
+    # Replaces the worst individuals of population (in place) by the better immigrants,
+    # genomes already present in population are not taken
+    # :return: number of accepted immigrants
+    present = set(ind.to01() for ind in population)
+    newcomers = []
+    for ind in immigrants:
+        if ind.fitness.valid and ind.to01() not in present:
+            present.add(ind.to01())
+            newcomers.append(ind)
+    newcomers = tools.selBest(newcomers, min(len(newcomers), len(population)))
+    order = sorted(range(len(population)), key=lambda i: population[i].fitness)  # the worst first
+    accepted = 0
+    for i, ind in zip(order, newcomers):
+        if population[i].fitness.valid and not ind.fitness > population[i].fitness:
+            break
+        population[i] = ind
+        accepted += 1
+    return accepted
+
+
+def evaluation_context(candidates, runner, allstaropt, fine_tune, allstar_options, numpy_substar=False):
+    # type: (sl.StarList, dao.Daophot, str, bool, dict, bool) -> str
+    # Digest of everything, except genome, what fitness depends on: image, options files,
+    # stars for allstar, candidates and evaluation mode (including stars subtraction method of fine mode).
+    md5 = hashlib.md5()
+    for filename in [runner.image, runner.file_from_runner_dir('daophot.opt'),
+                     runner.file_from_runner_dir('i.ap'), runner.file_from_runner_dir('als.ap'), allstaropt]:
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                md5.update(block)
+    md5.update(candidates.to_csv().encode('ascii'))
+    md5.update(repr((fine_tune, sorted(runner.options.items()), sorted(allstar_options.items()))).encode('ascii'))
+    if fine_tune and numpy_substar:
+        md5.update(b'numpy substar')
+    return md5.hexdigest()
+
+
+class Penalty(tuple):
+    # Fitness (1-element couple) given to individual dropped by EarlyAbort, not the real fitness of genome
+    pass
+
+
+class EarlyAbort(object):
+    # Racing of fine mode evaluations: after every stage of evaluation (PSF and ALLSTAR iterations) metric of stage
+    # (PSF chi, fitness of ALLSTAR result) is compared with the worst metric of that stage among individuals
+    # of current population multiplied by `margin`. Clearly worse individuals are dropped without further stages,
+    # and get Penalty fitness: the worst fitness of current population multiplied by `margin`.
+    # Metrics of completed evaluations are remembered by genome, thresholds are set by `new_generation`.
+    # Genomes with Penalty fitnesses are remembered as well (Penalty assigned to individual becomes plain tuple),
+    # so penalties are not taken as real fitnesses for next penalties.
+    # Used concurrently by workers threads.
+
+    def __init__(self, margin=1.2, maxsize=10000):
+        self.margin = margin
+        self.maxsize = maxsize
+        self.penalty = None
+        self.aborted = 0  # number of individuals dropped since `new_generation`
+        self.__thresholds = {}
+        self.__metrics = OrderedDict()  # genome string -> {stage: metric} of completed evaluations
+        self.__penalised = set()  # genomes strings of individuals with Penalty fitnesses
+        self.__lock = threading.Lock()
+
+    def add(self, genomes, fitnesses):
+        # Notes results of evaluations: genomes (individuals or genome strings) and fitnesses
+        for genome, fitness in zip(genomes, fitnesses):
+            key = genome.to01() if hasattr(genome, 'to01') else genome
+            if isinstance(fitness, Penalty):
+                self.__penalised.add(key)
+            else:
+                self.__penalised.discard(key)
+
+    def penalised(self, individual):
+        return individual.to01() in self.__penalised
+
+    def set_penalised(self, genomes):
+        # Marks genomes (strings) as having Penalty fitnesses, e.g. restored from checkpoint
+        self.__penalised.update(genomes)
+
+    def new_generation(self, population):
+        # Sets thresholds and penalty for evaluation of offspring of `population`
+        worst = {}
+        with self.__lock:
+            for ind in population:
+                for stage, value in self.__metrics.get(ind.to01(), {}).items():
+                    worst[stage] = max(worst.get(stage, value), value)
+            self.__thresholds = dict((stage, self.margin * value) for stage, value in worst.items())
+            self.aborted = 0
+        valid = [ind.fitness.values[0] for ind in population if ind.fitness.valid and not self.penalised(ind)]
+        self.penalty = Penalty((self.margin * max(valid),)) if valid else None
+
+    def passes(self, stage, value):
+        # :return: False if individual with `value` metric on `stage` should be dropped
+        threshold = self.__thresholds.get(stage)
+        if threshold is None or self.penalty is None or not value > threshold:
+            return True
+        with self.__lock:
+            self.aborted += 1
+        return False
+
+    def record(self, genome, metrics):
+        # Remembers metrics {stage: value} of completed evaluation of genome (string)
+        with self.__lock:
+            self.__metrics.pop(genome, None)
+            self.__metrics[genome] = metrics
+            while len(self.__metrics) > self.maxsize:
+                self.__metrics.popitem(last=False)
+
+
+def eval_population(population, candidates, pool, show_progress, fine_tune, cache=None, race=None,
+                    numpy_substar=False):
+    # type: (list(numpy.ndarray), sl.StarList, dao.WorkersPool, bool, bool, FitnessCache, EarlyAbort, bool) -> list
     # Evaluates fitness for all individual in population.
-    # Uses daophots and allstars processes form `workers` running them in parallel.
-    # :return: list fitnesses (1-element couples as `deap` lib likes)
-
+    # Each individual is evaluated as separate job by the first free worker of the `pool`, there is no
+    # synchronization between workers.
+    # Fitnesses found in `cache` are not evaluated, as well as duplicates of genomes in population.
+    # Fine mode evaluations of individuals clearly worse than population are dropped by `race`,
+    # their Penalty fitnesses are not cached.
+    # `numpy_substar` - fine mode subtracts stars in process (dao.subtract_stars) instead of daophot SUBSTAR.
+    # :return: list fitnesses (1-element couples as `deap` lib likes), in order of population
+
+    evaluate = eval_individual_fine_psf if fine_tune else eval_individual_simple
+    fitnesses = [None] * len(population)
+    jobs = OrderedDict()  # genome -> (job, indexes of individuals with that genome)
+    for i, individual in enumerate(population):
+        key = individual.to01()
+        if key in jobs:  # duplicate in population
+            jobs[key][1].append(i)
+            if cache is not None:
+                cache.hits += 1
+            continue
+        if cache is not None:
+            found, fitnesses[i] = cache.get(individual)
+            if found:
+                continue
+        args = (race, key, numpy_substar) if fine_tune else ()
+        jobs[key] = (pool.submit(evaluate, select_stars(candidates, individual), *args), [i])
     progress = None
-    if show_progress:
-        progress = utils.progressbar(total=len(population), step=len(workers))
+    if show_progress and jobs:
+        progress = utils.progressbar(total=len(jobs), step=1)
         progress.print_progress(0)
-    fitnesses = []
-    f_max = None
-    # https://docs.python.org/3/library/itertools.html#itertools-recipes grouper()
-    # grouping population into chunks of size `parallel`
-    for chunk in izip_longest(*([iter(population)] * len(workers))):
-        active = [g is not None for g in chunk]  # all active, on errors some could be deactivated
-        # PSF
-        for individual, worker in zip(chunk, workers):
-            if individual:
-                pdf_s = select_stars(candidates, individual)
-                worker['daophot'].PSf(psf_stars=pdf_s)  # add to queue only - batch mode
-                worker['daophot'].run(wait=False)  # parallel start all workers without waiting
-        # wait for PSF and start ALLSTAR
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['daophot'].wait_for_results()  # now wait before using results
-                active[i] = worker['daophot'].PSf_result.converged  # PSF is not always successful
-                if active[i]:
-                    worker['allstar'].ALlstar(stars='als.ap')       # enqueue calculation
-                    worker['allstar'].run(wait=False)  # asynchronous / parallel
-        # wait for allstar for workers and process results
-        for i, worker in enumerate(workers):
-            if active[i]:
-                worker['allstar'].wait_for_results()
-                all_s = worker['allstar'].ALlstars_result.als_stars
-                f = fitness_for_als(all_s)
-                fitnesses.append(f)  # fitness is tuple (val,)
-                f_max = max(f_max, f)
-            else:
-                fitnesses.append(None)
-        # cut fitnesses if longer than population
-        # (finesses mod parallel == 0, some None at the end can appear if population mod parallel != 0)
-        fitnesses = fitnesses[:len(population)]
-        # fill gaps in fitnesses by maximum of rest of population
-        for i, f in enumerate(fitnesses):
-            if f is None:
-                fitnesses[i] = f_max
-        if progress:
+        for _ in dao.as_completed([job for job, _ in jobs.values()]):
             progress.print_progress()
-
-    return fitnesses
-
-
-def _prepare_output_dir(outdir, overwrite, srcdir, arg):
-    # type: (str, bool, str, object) -> (utils.CycleFile, utils.CycleFile, utils.CycleFile, str)
+    for job, indexes in jobs.values():
+        try:
+            f = job.result()
+        except dao.Daophot.ExitError as e:  # e.g. persistent daophot killed as hung, not cached
+            logging.warning('Evaluation failed: {}'.format(e))
+            continue
+        for i in indexes:
+            fitnesses[i] = f
+        if cache is not None and not isinstance(f, Penalty):
+            cache.put(population[indexes[0]], f)
+    # fill gaps (failed evaluations) in fitnesses by maximum of rest of population
+    valid = [f for f in fitnesses if f is not None]
+    f_max = max(valid) if valid else None
+    return [f_max if f is None else f for f in fitnesses]
+
+
+def eval_individual_fine_psf(worker, psf_stars, race=None, genome=None, numpy_substar=False):
+    # type: (dao.Worker, sl.StarList, EarlyAbort, str, bool) -> (float,)
+    # Evaluates fitness of individual (PSF stars) on `worker`, job for `dao.WorkersPool`
+    # This version uses sofisticated process from daophot_bialkow:
+    # three iterations of PSF, with neighbours subtraction before second and third.
+    # With `race`, evaluation is dropped after stage on which individual is clearly worse than population,
+    # metrics of stages of completed evaluation are recorded under `genome` string.
+    # With `numpy_substar` neighbours are subtracted in process by Daophot.subtract_stars instead of SUBSTAR.
+    # :return: fitness (1-element couple as `deap` lib likes), Penalty when dropped or None on failure
+    daophot = worker.daophot
+    allstar = worker.allstar
+    metrics = {}  # stage -> metric, lower is better
+    daophot.write_starlist(psf_stars, 'i.lst')
+    # PSF
+    daophot.PSf(psf_stars='i.lst')
+    daophot.run()
+    if not daophot.PSf_result.converged:  # PSF is not always successful
+        return None
+    metrics['psf1'] = daophot.PSf_result.chi
+    if race is not None and not race.passes('psf1', metrics['psf1']):
+        return race.penalty
+    allstar.ALlstar(stars='i.nei')
+    allstar.run()
+    # second and third PSF, each followed by allstar, the final one on all stars
+    for n, allstar_stars in [(2, 'i.nei'), (3, 'als.ap')]:
+        if not allstar.ALlstars_result.success:
+            return None
+        if race is not None:  # fitness of intermediate ALLSTAR is needed only for race
+            stage = 'als{}'.format(n - 1)
+            metrics[stage] = fitness_for_als(allstar.ALlstars_result.als_stars)[0]
+            if not race.passes(stage, metrics[stage]):
+                return race.penalty
+        if numpy_substar:
+            daophot.subtract_stars(subtract='i.als', leave_in='i.lst')  # in process, instead of SUBSTAR run
+        else:
+            daophot.SUbstar(subtract='i.als', leave_in='i.lst')
+            daophot.run()  # quick run
+        daophot.ATtach('is')
+        daophot.PSf(photometry='i.als', psf_stars='i.lst')
+        daophot.run()
+        if not daophot.PSf_result.success:
+            return None
+        stage = 'psf{}'.format(n)
+        metrics[stage] = daophot.PSf_result.chi
+        if race is not None and not race.passes(stage, metrics[stage]):
+            return race.penalty
+        allstar.ALlstar(stars=allstar_stars)
+        allstar.run()
+    if race is not None and genome is not None:
+        race.record(genome, metrics)
+    return fitness_for_als(allstar.ALlstars_result.als_stars)
+
+
+def eval_individual_simple(worker, psf_stars):
+    # type: (dao.Worker, sl.StarList) -> (float,)
+    # Evaluates fitness of individual (PSF stars) on `worker`, job for `dao.WorkersPool`
+    # :return: fitness (1-element couple as `deap` lib likes) or None on failure
+    psf, als = dao.psf_allstar(worker, psf_stars=psf_stars, allstar_stars='als.ap')
+    if als is None:  # PSF is not always successful
+        return None
+    return fitness_for_als(als.als_stars)
+
+
+def _prepare_output_dir(outdir, overwrite, srcdir, arg, resume=False):
+    # type: (str, bool, str, object, bool) -> (utils.CycleFile, utils.CycleFile, utils.CycleFile, str)
     # Prepare output directory for results
+    # When `resume`-ing from checkpoint, existing directory is used as is (results of previous generations are kept)
     if outdir:
         from shutil import copytree, rmtree
 
         outdir = os.path.abspath(os.path.expanduser(outdir))
-        if os.path.exists(outdir):
-            if overwrite:
-                rmtree(outdir)
-            else:
-                logging.error('--out_dir:{} already exists and no --overwrite requested.'.format(outdir))
-                raise Exception('Output directory {} exists.'.format(outdir))
-        copytree(srcdir, outdir)
-        logging.info('Results dir created: {}'.format(outdir))
+        if resume and os.path.isdir(outdir):
+            logging.info('Results dir reused: {}'.format(outdir))
+        else:
+            if os.path.exists(outdir):
+                if overwrite:
+                    rmtree(outdir)
+                else:
+                    logging.error('--out_dir:{} already exists and no --overwrite requested.'.format(outdir))
+                    raise Exception('Output directory {} exists.'.format(outdir))
+            copytree(srcdir, outdir)
+            logging.info('Results dir created: {}'.format(outdir))
         # todo allstar.opt missing in result dir!
         basename = 'gen'
         lst_file = utils.cyclefile(outdir, basename, '.lst')
@@ -310,6 +715,13 @@ def __do(arg):
 
     check_arguments(arg)
 
+    # checkpoint is loaded before any processing, it could be deleted with --overwrite-ed output directory
+    checkpoint = None
+    if arg.checkpoint:
+        arg.checkpoint = os.path.expanduser(arg.checkpoint)
+        checkpoint = load_checkpoint(arg.checkpoint)
+        logging.info('Checkpoint {} of generation {} loaded'.format(arg.checkpoint, checkpoint['generation']))
+
 
     # image_file
     if arg.image is None:
@@ -388,11 +800,20 @@ def __do(arg):
         arg.max_psf_err_mult * averr)
     )
 
+    # reject candidates with neighbours (from all stars photometry) closer than --isolation
+    if arg.isolation > 0:
+        crowding = photometry.photometry_starlist.crowding(arg.isolation)
+        isolated = crowding.reindex(candidates.index).fillna(0).values == 0
+        logging.info('{} isolated candidates ({} rejected: other stars closer than isolation radius {})'.format(
+            isolated.sum(), (~isolated).sum(), arg.isolation))
+        candidates = candidates[isolated]
+
     if candidates.count() < 15:
         logging.error("Number of candidates lass than 15. GA needs more. Sorry")
 
     # Prepare output directory for results
-    lst_file, reg_file, gen_file, result_dir = _prepare_output_dir(arg.out_dir, arg.overwrite, str(dp.dir), arg)
+    lst_file, reg_file, gen_file, result_dir = _prepare_output_dir(arg.out_dir, arg.overwrite, str(dp.dir), arg,
+                                                                   resume=checkpoint is not None)
 
 
     #  From all candidates find best subset, where best means minimizing mean of errors form allstar
@@ -401,7 +822,7 @@ def __do(arg):
     #       http://deap.gel.ulaval.ca/doc/default/examples/ga_onemax.html
 
     creator.create("FitnessMax", base.Fitness, weights=(-1.0,))
-    creator.create("Individual", bitarray, fitness=creator.FitnessMax)
+    creator.create("Individual", numpy.ndarray, fitness=creator.FitnessMax, to01=genome_to01)
 
     toolbox = base.Toolbox()
     # Structure initializes
@@ -412,127 +833,228 @@ def __do(arg):
     # The Genetic Operators
 
     # set min_stars to all_cand_no*ga_init_prob/2
-    toolbox.register('mate', tools.cxTwoPoint)
-    toolbox.register('mutate', tools.mutFlipBit, indpb=arg.ga_mut_str)
+    # crossover and mutation are applied on whole population matrix by vary_population
     toolbox.register('select', tools.selTournament, tournsize=3)
 
     # setup stats
     stats_fits = tools.Statistics(key=lambda ind: ind.fitness.values)
-    stats_star = tools.Statistics(key=sum)  # number of stars is an sum of bitarray: [001101010001] has 5 stars
+    stats_star = tools.Statistics(key=numpy.count_nonzero)  # number of stars: [001101010001] has 5 stars
     stats = tools.MultiStatistics(fitness=stats_fits, size=stats_star)
     stats.register('avg', numpy.mean)
     stats.register('std', numpy.std)
     stats.register('min', numpy.min)
     stats.register('max', numpy.max)
 
-    # Initiate workers. Each worker has Daophot and Allstar objects sharing runner directory,
-    # working in batch mode.
-    workers = []
+    # Initiate workers. Each worker has Daophot and Allstar objects sharing runner directory
+    # (clone of previously used daophot dir), working in batch mode.
     workers_logger = logging.getLogger('worker')
     workers_logger.setLevel('ERROR')  # prevent workers flood output with logrecords
-    for i in range(arg.parallel):
-        d = dp.clone()       # clone previously used daophot
-        d.batch_mode = True
-        a = dao.Allstar(dir=d.dir, image=d.image, batch=True, options={'MA': 100})
-        d.logger = workers_logger
-        a.logger = workers_logger
-        workers.append({'daophot': d, 'allstar': a})
-
-    # Setup initial population, HoF and logbook and  or load it from checkpoint when continuing previous calculation
-    start_gen = 0
-
-#    if arg.checkpoint:   ## Not implemented
-    if False:
-        with open(os.path.expanduser(arg.checkpoint), "rb") as f:
-            checkpoint = pickle.load(f)
-        pop = checkpoint['population']
-        start_gen = checkpoint['generation']
-        hof = checkpoint['halloffame']
-        logbook = checkpoint['logbook']
-        logging.info('Restoring genetic algorithm on {} of {} generations'.format(start_gen, arg.ga_max_iter))
-    else:
-        hof = tools.HallOfFame(maxsize=10)
+    allstar_options = {'MA': 100}
+    # workers (and their runner directories) are closed also when evolution fails or is interrupted
+    with dao.WorkersPool(dp, workers=arg.parallel, allstar_options=allstar_options,
+                         preserve_process=arg.persistent or None, logger=workers_logger) as pool:
+        # Fitness cache - genomes evaluated before (also in previous runs) are not evaluated again
+        context = evaluation_context(candidates, dp, pool.workers[0].allstar.allstaropt, arg.fine, allstar_options,
+                                     numpy_substar=arg.numpy_substar)
+        cache = None
+        if arg.cache_size > 0:
+            cache = FitnessCache(context, maxsize=arg.cache_size)
+            if arg.cache_file is None and result_dir:
+                arg.cache_file = os.path.join(result_dir, 'fitness_cache.pkl')
+            if arg.cache_file and os.path.exists(arg.cache_file):
+                logging.info('{} fitnesses loaded from cache {}'.format(cache.load(arg.cache_file), arg.cache_file))
+
+        # Island model - exchange of best individuals with other gapick processes
+        migration = None
+        if arg.island_dir:
+            if not arg.island:
+                arg.island = '{}-{}'.format(socket.gethostname(), os.getpid())
+            migration = Migration(arg.island_dir, arg.island, context, interval=arg.migration_interval,
+                                  migrants=arg.migrants)
+            logging.info('Island {} exchanging {} individuals every {} generations through {}'.format(
+                arg.island, arg.migrants, arg.migration_interval, migration.directory))
+
+        # Early abort - fine mode evaluations of individuals clearly worse than population are dropped
+        race = EarlyAbort(margin=arg.early_abort) if arg.early_abort > 0 and arg.fine else None
+
+        # Surrogate model - only the most promising offspring are evaluated
+        surrogate = None
+        if arg.surrogate < 1.0:
+            surrogate = Surrogate(arg.surrogate, explore=arg.surrogate_explore, min_samples=arg.ga_pop)
+            if cache is not None:
+                items = cache.items()
+                surrogate.add([genome for genome, _ in items], [fitness for _, fitness in items])
+
+        # Setup initial population, HoF and logbook and  or load it from checkpoint when continuing previous calculation
+        start_gen = 0
+        hof = tools.HallOfFame(maxsize=10, similar=numpy.array_equal)
+
+        if checkpoint is not None:
+            pop = individuals_from_list(creator.Individual, checkpoint['population'])
+            if len(pop[0]) != candidates.count():
+                logging.error('Checkpoint genomes length {} differs from number of candidates {}, '
+                              'different image or options?'.format(len(pop[0]), candidates.count()))
+                raise ValueError('Checkpoint {} does not match candidates'.format(arg.checkpoint))
+            if checkpoint['context'] != context:
+                logging.warning('Checkpoint created for different options or input files, '
+                                'fitnesses of restored population may be not comparable with new ones')
+            elif cache is not None and checkpoint['cache']:
+                cache.update(checkpoint['cache'])
+            start_gen = checkpoint['generation']
+            hof.update(individuals_from_list(creator.Individual, checkpoint['halloffame']))
+            logbook = checkpoint['logbook']
+            random.setstate(checkpoint['random_state'])
+            numpy.random.set_state(checkpoint['numpy_random_state'])
+            # fitnesses predicted by surrogate model or penalties of early abort are not results,
+            # without surrogate or early abort they are evaluated
+            predicted = set(checkpoint.get('predicted', ()))
+            penalised = set(checkpoint.get('penalised', ()))
+            if surrogate is not None:
+                surrogate.set_predicted(predicted)
+                predicted = set()
+            if race is not None:
+                race.set_penalised(penalised)
+                penalised = set()
+            unevaluated = [ind for ind in pop if ind.to01() in predicted | penalised]
+            if unevaluated:
+                fitnesses = eval_population(unevaluated, candidates, pool, show_progress=not arg.no_progress,
+                                            fine_tune=arg.fine, cache=cache, numpy_substar=arg.numpy_substar)
+                for ind, fit in zip(unevaluated, fitnesses):
+                    ind.fitness.values = fit
+            logging.info('Restoring genetic algorithm on {} of {} generations'.format(start_gen, arg.ga_max_iter))
+        else:
+            logbook = tools.Logbook()
+            logbook.header = 'gen', 'evals', 'cached', 'fitness', 'size'
+            if migration is not None:
+                logbook.header += ('migrants',)
+            if surrogate is not None:
+                logbook.header += ('predicted', 'sur_corr')
+            if race is not None:
+                logbook.header += ('aborted',)
+            logbook.chapters['fitness'].header = 'min', 'avg', 'max', 'std'
+            logbook.chapters['size'].header = 'min', 'avg', 'max'
+
+            pop = toolbox.population(n=arg.ga_pop)
+            logging.info('Starting genetic algorithm for {} generations at {}'.format(
+                arg.ga_max_iter,
+                time.strftime(_time_format, time.localtime())
+            ))
+            logging.info('{} parallel threads, ETA will be calculated after generation 1'.format(arg.parallel))
+
+            # Calculate fitnesses of initial population
+            hits = cache.hits if cache else 0
+            fitnesses = eval_population(pop, candidates, pool, show_progress=not arg.no_progress, fine_tune=arg.fine,
+                                        cache=cache, race=race, numpy_substar=arg.numpy_substar)
+            for ind, fit in zip(pop, fitnesses):
+                ind.fitness.values = fit
+            if surrogate is not None:
+                surrogate.add(pop, fitnesses)
+            hof.update(pop)
+
+            record = stats.compile(pop)
+            cached = cache.hits - hits if cache else 0
+            logbook.record(gen=0, evals=len(pop) - cached, cached=cached, spectrum=calc_spectrum(pop), **record)
+            clogger.info('{}\t ETA: [... to be determined]'.format(logbook.stream))
+            if arg.timings:
+                clogger.info(pool.timings(reset=True).report())
+
+        evolution_start_time = time.time()
+
+        # Begin the evolution
+        for g in range(start_gen + 1, arg.ga_max_iter):
+            #  New Generation
+            #  select the next generation individuals
+            offspring = toolbox.select(pop, len(pop))
+            # Clone the selected individuals
+            offspring = list(map(toolbox.clone, offspring))
+            # Apply crossover and mutation on the offspring
+            vary_population(offspring, arg.ga_cross_prob, arg.ga_mut_prob, arg.ga_mut_str)
+
+            # calculate fitnesses of new individuals (and survivors with predicted fitnesses)
+            extra = {}  # additional logbook values
+            if surrogate is None:
+                invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
+            else:
+                invalid_ind = [ind for ind in offspring if not ind.fitness.valid or surrogate.predicted(ind)]
+                invalid_ind, predicted = surrogate.screen(invalid_ind, cache)
+                extra['predicted'] = len(predicted)
+            if race is not None:
+                race.new_generation(evaluated_individuals(pop, surrogate))  # thresholds from evaluated parents
+            hits = cache.hits if cache else 0
+            fitnesses = eval_population(invalid_ind, candidates, pool, show_progress=not arg.no_progress,
+                                        fine_tune=arg.fine, cache=cache, race=race, numpy_substar=arg.numpy_substar)
+            for ind, fit in zip(invalid_ind, fitnesses):
+                ind.fitness.values = fit
+            cached = cache.hits - hits if cache else 0
+            if race is not None:
+                extra['aborted'] = race.aborted
+                race.add(invalid_ind, fitnesses)
+            if surrogate is not None:
+                extra['sur_corr'] = surrogate.accuracy(invalid_ind, fitnesses)
+                surrogate.add(invalid_ind, fitnesses)
+            # New population from offspring
+            pop[:] = offspring
+            # evaluated individuals (surrogate model predictions are not results)
+            evaluated = evaluated_individuals(pop, surrogate)
+
+            # Island model: send the best, replace the worst by the best of other islands
+            if migration is not None and migration.due(g):
+                migration.emigrate(g, evaluated)
+                immigrants = migration.immigrate(creator.Individual)
+                if cache is not None:
+                    for ind in immigrants:
+                        cache.put(ind, ind.fitness.values)
+                if surrogate is not None:
+                    surrogate.add(immigrants, [ind.fitness.values for ind in immigrants])
+                if race is not None:
+                    race.add(immigrants, [ind.fitness.values for ind in immigrants])
+                extra['migrants'] = migrate(pop, immigrants)
+                evaluated = evaluated_individuals(pop, surrogate)
+
+            # Stats
+            hof.update(evaluated)
+            ETA = time.strftime(_time_format, time.localtime(
+                evolution_start_time
+                + (time.time() - evolution_start_time) * (arg.ga_max_iter - start_gen) / (g - start_gen)))
+            record = stats.compile(pop)
+            record.update(extra)
+            logbook.record(gen=g, evals=len(invalid_ind) - cached, cached=cached, spectrum=calc_spectrum(pop), **record)
+            clogger.info('{}\t ETA: {}'.format(logbook.stream, ETA))
+            if arg.timings:
+                clogger.info(pool.timings(reset=True).report())
+
+            # For every generation create lst file and ds9 reg file of best and point symlinks to last generation
+            if result_dir:
+                best_ind = tools.selBest(evaluated, 1)[0]
+                best_stars = select_stars(candidates, best_ind)
+                lst_file.next_file(g)
+                reg_file.next_file(g)
+                gen_file.next_file(g)
+                sl.write_dao_file(best_stars, lst_file.file, sl.DAO.LST_FILE)
+                sl.write_ds9_regions(best_stars, reg_file.file)
+                for ind in pop:
+                    gen_file.file.write(ind.to01() + '\n')
+                _dump_atomic(logbook, os.path.join(result_dir, 'logbook.pkl'))
+                if cache is not None and arg.cache_file:
+                    cache.dump(arg.cache_file)
+                predicted = [ind.to01() for ind in pop if surrogate.predicted(ind)] if surrogate is not None else None
+                penalised = [ind.to01() for ind in pop if race.penalised(ind)] if race is not None else None
+                write_checkpoint(os.path.join(result_dir, 'checkpoint.chk'), g, pop, hof, logbook, context, cache,
+                                 predicted, penalised)
+            # end of evolution loop
+
+        logging.info('Successful evolution finished at {} (elapsed time: {:s})'.format(
+            time.strftime(_time_format, time.localtime()),
+            timedelta(seconds=time.time() - start_time)
+        ))
 
-        logbook = tools.Logbook()
-        logbook.header = 'gen', 'fitness', 'size'
-        logbook.chapters['fitness'].header = 'min', 'avg', 'max', 'std'
-        logbook.chapters['size'].header = 'min', 'avg', 'max'
+        logging.info('Runner dirs in {}, max size of files written by worker: {:.1f} MB'.format(
+            os.path.dirname(pool.workers[0].daophot.dir.path), max(pool.written_bytes) / 1024 ** 2))
+    if cache is not None:
+        logging.info('Fitness cache: {} hits of {} lookups ({:.1%}), {} genomes cached'.format(
+            cache.hits, cache.hits + cache.misses, cache.hit_rate, len(cache)))
 
-        pop = toolbox.population(n=arg.ga_pop)
-        logging.info('Starting genetic algorithm for {} generations at {}'.format(
-            arg.ga_max_iter,
-            time.strftime(_time_format, time.localtime())
-        ))
-        logging.info('{} parallel threads, ETA will be calculated after generation 1'.format(arg.parallel))
-
-    # Calculate fitnesses of initial population
-    fitnesses = eval_population(pop, candidates, workers, show_progress=not arg.no_progress, fine_tune=arg.fine)
-    for ind, fit in zip(pop, fitnesses):
-        ind.fitness.values = fit
-
-    record = stats.compile(pop)
-    logbook.record(gen=0, spectrum=calc_spectrum(pop), **record)
-    clogger.info('{}\t ETA: [... to be determined]'.format(logbook.stream))
-
-    evolution_start_time = time.time()
-
-    # Begin the evolution
-    for g in range(start_gen + 1, arg.ga_max_iter):
-        #  New Generation
-        #  select the next generation individuals
-        offspring = toolbox.select(pop, len(pop))
-        # Clone the selected individuals
-        offspring = list(map(toolbox.clone, offspring))
-        # Apply crossover and mutation on the offspring
-        for child1, child2 in zip(offspring[::2], offspring[1::2]):
-            if random.random() < arg.ga_cross_prob:
-                toolbox.mate(child1, child2)
-                del child1.fitness.values
-                del child2.fitness.values
-        for mutant in offspring:
-            if random.random() < arg.ga_mut_prob:
-                toolbox.mutate(mutant)
-                del mutant.fitness.values
-
-        # calculate fitnesses of new individuals
-        invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
-        fitnesses = eval_population(invalid_ind, candidates, workers, show_progress=not arg.no_progress, fine_tune=arg.fine)
-        for ind, fit in zip(invalid_ind, fitnesses):
-            ind.fitness.values = fit
-        # New population from offspring
-        pop[:] = offspring
-
-        # Stats
-        # hof.update(pop)  # not implemented yet, __deapcopy__ of the Individual should work first
-        ETA = time.strftime(_time_format, time.localtime(evolution_start_time + (time.time() - evolution_start_time) * arg.ga_max_iter / g))
-        record = stats.compile(pop)
-        logbook.record(gen=g, spectrum=calc_spectrum(pop), **record)
-        clogger.info('{}\t ETA: {}'.format(logbook.stream, ETA))
-
-        # For every generation create lst file and ds9 reg file of best and point symlinks to last generation
-        if result_dir:
-            best_ind = tools.selBest(pop, 1)[0]
-            best_stars = select_stars(candidates, best_ind)
-            lst_file.next_file(g)
-            reg_file.next_file(g)
-            gen_file.next_file(g)
-            sl.write_dao_file(best_stars, lst_file.file, sl.DAO.LST_FILE)
-            sl.write_ds9_regions(best_stars, reg_file.file)
-            for ind in pop:
-                gen_file.file.write(ind.to01() + '\n')
-            with open(os.path.join(result_dir, 'logbook.pkl'), 'wb') as f:
-                pickle.dump(logbook, f)
-            checkpoint = dict(population=pop, generation=g, halloffame=hof, logbook=logbook)
-            with open(os.path.join(result_dir, 'checkpoint.chk'), 'wb') as f:
-                pickle.dump(checkpoint, f)
-        # end of evolution loop
-
-    logging.info('Successful evolution finished at {} (elapsed time: {:s})'.format(
-        time.strftime(_time_format, time.localtime()),
-        timedelta(seconds=time.time() - start_time)
-    ))
-
-    best_ind = tools.selBest(pop, 1)[0]
+    best_ind = tools.selBest(evaluated_individuals(pop, surrogate), 1)[0]
     logging.info('Best individual is {}, {}'.format(best_ind, best_ind.fitness.values))
 
     best_stars = select_stars(candidates, best_ind)
@@ -575,6 +1097,14 @@ def __arg_parser():
     parser.add_argument('--fine', '-f', action='store_true',
                         help='fine tuned PSF calculation (3 iter) for crowded fields, without this option no neighbours'
                              'subtraction will be performed')
+    parser.add_argument('--numpy-substar', action='store_true',
+                        help='fine mode (--fine): subtract neighbours in process with numpy PSF model instead of'
+                             ' daophot SUBSTAR runs; faster, but not yet verified against SUBSTAR for all analytic'
+                             ' PSF profiles (default: daophot SUBSTAR)')
+    parser.add_argument('--persistent', action='store_true',
+                        help='keep single daophot process of each worker alive between evaluations instead of'
+                             ' starting daophot for every run; hung process is killed after 300s of silence'
+                             ' (default: new process for every run)')
     parser.add_argument('--max-psf-err-mult', metavar='x', type=float, default=3.0,
                         help='threshold for PSF errors of candidates - multipler of average error; '
                              'candidates with PSF error greater than x*av_err will be rejected '
@@ -589,6 +1119,9 @@ def __arg_parser():
                              'stars for which aperture photometry (daophot PHOTO) magnitude is greater than m '
                              '(fainter than m) will be excluded form allstar run and have no effect on quality '
                              'measurement (default 20)')
+    parser.add_argument('--isolation', metavar='r', type=float, default=0,
+                        help='reject PSF candidates having any other star (from aperture photometry of all stars) '
+                             'closer than r pixels (default: 0 - no rejection)')
     parser.add_argument('--parallel', '-p', metavar='n', type=int, default=8,
                         help='how many parallel processes can be forked; '
                              'n=1 avoids parallelism (default: 8)')
@@ -599,9 +1132,44 @@ def __arg_parser():
     parser.add_argument('--overwrite', '-o', action='store_true',
                         help='if directory specified by --out_dir parameter exists, '
                              'then ALL its content WILL BE DELETED')
-    # parser.add_argument('--checkpoint', '-C', metavar='file.chk', type=str, default=None,
-    #                     help='restore evaluation from checkpoint; algorithm saves checkpoint.chk file every generation,'
-    #                          ' which allows resuming evolution, even with another parameters')
+    parser.add_argument('--checkpoint', '-C', metavar='file.chk', type=str, default=None,
+                        help='restore evaluation from checkpoint; algorithm saves checkpoint.chk file every generation'
+                             ' in --out_dir, which allows resuming evolution (population, random generator state,'
+                             ' logbook, hall of fame and fitness cache), even with another parameters;'
+                             ' existing --out_dir is reused when resuming (default: start new evolution)')
+    parser.add_argument('--cache-size', metavar='n', type=int, default=10000,
+                        help='size of fitness cache - number of remembered fitnesses of evaluated genomes, '
+                             'genomes found in cache are not evaluated again; 0 disables cache (default: 10000)')
+    parser.add_argument('--cache-file', metavar='FILE', type=str, default=None,
+                        help='fitness cache file, loaded on start if exists (and created for the same image, '
+                             'options and stars), updated every generation '
+                             '(default: fitness_cache.pkl in --out_dir)')
+    parser.add_argument('--early-abort', metavar='x', type=float, default=0,
+                        help='fine mode (--fine) evaluation of individual is dropped after PSF or ALLSTAR stage,'
+                             ' when chi of stage is greater than x times the worst chi of that stage in current'
+                             ' population; dropped individual gets x times the worst fitness of population'
+                             ' (default: 0 - evaluations are not dropped)')
+    parser.add_argument('--surrogate', metavar='x', type=float, default=1.0,
+                        help='surrogate model pre-screening: offspring are ranked by fitness predicted by model'
+                             ' fitted on already evaluated genomes, and only x fraction of the best of them is'
+                             ' evaluated by daophot, the rest gets predicted fitness (default: 1.0 - no'
+                             ' pre-screening, all offspring evaluated)')
+    parser.add_argument('--surrogate-explore', metavar='x', type=float, default=0.1,
+                        help='surrogate model pre-screening: fraction of offspring not chosen by the model,'
+                             ' which are chosen randomly for evaluation (default: 0.1)')
+    parser.add_argument('--island-dir', metavar='DIR', type=str, default=None,
+                        help='island model: directory shared by gapick processes (islands), possibly on different'
+                             ' nodes, evolving populations independently and exchanging the best individuals'
+                             ' through this directory; all islands should be run for the same image, stars'
+                             ' and options (default: no island model, single population)')
+    parser.add_argument('--island', metavar='name', type=str, default=None,
+                        help='name of island, unique in --island-dir (default: hostname-pid)')
+    parser.add_argument('--migration-interval', metavar='k', type=int, default=5,
+                        help='island model: exchange individuals with other islands every k generations'
+                             ' (default: 5)')
+    parser.add_argument('--migrants', metavar='n', type=int, default=2,
+                        help='island model: number of best individuals sent to other islands, received ones'
+                             ' replace the worst individuals of population if better (default: 2)')
     parser.add_argument('--ga_init_prob', '-I', metavar='x', default=[0.3, 0.8], type=float, nargs='+',
                         help='what portion of candidates is used to initialize GA individuals;'
                              ' e.g. if there is 100 candidates, each of them will be '
@@ -621,6 +1189,9 @@ def __arg_parser():
                         help='mutation probability of GA - probability to became a mutant (default: 0.2)')
     parser.add_argument('--ga_mut_str', metavar='x', default=0.05, type=float,
                         help='mutation strength of GA - probability of every bit flip in mutant (default: 0.05)')
+    parser.add_argument('--timings', action='store_true',
+                        help='print time spent by daophot and allstar runners in stages (process start, commands,'
+                             ' output parsing, etc.) every generation')
     parser.add_argument('--loglevel', '-L', metavar='level', default='info',
                         help='logging level: debug, info, warning, error, critical (default: info)')
     parser.add_argument('--no_stdout', '-t', action='store_true',
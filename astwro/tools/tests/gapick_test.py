@@ -4,10 +4,32 @@ from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
 import os.path as path
+import numpy as np
 from astwro.tools.gapick import main
 from astwro.utils.TmpDir import TmpDir
 from astwro.starlist import read_dao_file, read_ds9_regions
 
+
+def individual_class():
+    # gapick-like DEAP individual class, DEAP classes are created once
+    from deap import base, creator
+    from astwro.tools.gapick import genome_to01
+    if not hasattr(creator, 'TestIndividual'):
+        creator.create('TestFitness', base.Fitness, weights=(-1.0,))
+        creator.create('TestIndividual', np.ndarray, fitness=creator.TestFitness, to01=genome_to01)
+    return creator.TestIndividual
+
+
+def individual(genome, fitness=None):
+    # individual from genome string or boolean array
+    from astwro.tools.gapick import genome_from01
+    if isinstance(genome, (str, type(u''))):
+        genome = genome_from01(genome)
+    ind = individual_class()(genome)
+    if fitness is not None:
+        ind.fitness.values = (fitness,)
+    return ind
+
 def test_gapick_short():
     d = TmpDir()
     r = main(
@@ -25,3 +47,244 @@ def test_gapick_short():
     nei = read_dao_file(path.join(d.path, 'i.nei'))
     reg = read_ds9_regions(path.join(d.path, 'gen_last.reg'))
 
+
+
+def test_migration():
+    from astwro.tools.gapick import Migration, migrate
+    d = TmpDir()
+    a = Migration(d.path, 'a', 'context', interval=2, migrants=2)
+    b = Migration(d.path, 'b', 'context', interval=2, migrants=2)
+    other = Migration(d.path, 'c', 'other context', interval=2, migrants=2)
+    assert a.due(4) and not a.due(3)
+    a.emigrate(2, [individual('1100', 1.0), individual('0110', 2.0), individual('0011', 3.0)])
+    other.emigrate(2, [individual('1111', 0.1)])
+    immigrants = b.immigrate(individual_class())
+    assert sorted(ind.to01() for ind in immigrants) == ['0110', '1100']
+    assert b.immigrate(individual_class()) == []  # already received
+    population = [individual('1000', 0.5), individual('0100', 1.5), individual('0010', 5.0)]
+    assert migrate(population, immigrants) == 1  # 1100 (1.0) replaces 0010 (5.0), 0110 (2.0) is too weak
+    assert sorted(ind.to01() for ind in population) == ['0100', '1000', '1100']
+
+
+def test_surrogate():
+    import random
+    from astwro.tools.gapick import Surrogate, evaluated_individuals
+    random.seed(1)
+    np.random.seed(1)
+    weights = np.linspace(-1, 1, 30)
+
+    def random_individual():
+        return individual(np.random.random(len(weights)) < 0.5)
+
+    def fitness(ind):
+        return float(np.dot(weights, ind)) + random.gauss(0, 0.1),
+
+    s = Surrogate(0.25, explore=0.1, min_samples=40)
+    samples = [random_individual() for _ in range(40)]
+    offspring = [random_individual() for _ in range(40)]
+    chosen, predicted = s.screen(offspring)
+    assert len(chosen) == 40 and not predicted  # not enough samples yet
+    s.add(samples, [fitness(ind) for ind in samples])
+    chosen, predicted = s.screen(offspring)
+    assert len(chosen) == 10 + 3 and len(predicted) == 27
+    assert all(s.predicted(ind) and ind.fitness.valid for ind in predicted)
+    for ind in chosen:
+        ind.fitness.values = fitness(ind)
+    assert s.accuracy(chosen, [ind.fitness.values for ind in chosen]) > 0.5
+    s.add(chosen, [ind.fitness.values for ind in chosen])
+    assert not any(s.predicted(ind) for ind in chosen)
+    survivors = predicted[:10]
+    chosen, predicted = s.screen(survivors + [random_individual() for _ in range(30)])
+    assert set(map(id, survivors)) <= set(map(id, chosen))  # evaluated, not predicted again
+    assert evaluated_individuals(predicted, s) == []
+
+
+def test_vary_population():
+    from astwro.tools.gapick import vary_population, calc_spectrum
+    np.random.seed(2)
+    # pairs of complementary genomes
+    population = [individual(np.arange(20) % 2 == i % 2, 1.0) for i in range(8)]
+    spectrum = calc_spectrum(population)
+    changed = vary_population(population, cross_prob=1.0, mut_prob=0.0, mut_str=0.5)
+    assert changed.all() and not any(ind.fitness.valid for ind in population)
+    assert (calc_spectrum(population) == spectrum).all()  # crossover preserves stars occurrences
+    for first, second in zip(population[::2], population[1::2]):
+        assert (first ^ second).all()
+    changed = vary_population(population, cross_prob=0.0, mut_prob=1.0, mut_str=0.0)
+    assert (calc_spectrum(population) == spectrum).all()
+
+
+def test_early_abort():
+    from astwro.tools.gapick import EarlyAbort, Penalty, Surrogate
+    population = []
+    race = EarlyAbort(margin=1.5)
+    race.new_generation(population)
+    assert race.passes('psf1', 100.0)  # no thresholds for the initial population
+    for genome, psf1, fitness in [('1100', 0.02, 1.0), ('0110', 0.04, 2.0)]:
+        race.record(genome, {'psf1': psf1, 'als1': fitness})
+        population.append(individual(genome, fitness))
+    race.new_generation(population)
+    assert race.passes('psf1', 0.059) and race.passes('als2', 100.0)
+    assert not race.passes('psf1', 0.061) and not race.passes('als1', 3.1)
+    assert race.aborted == 2
+    assert isinstance(race.penalty, Penalty) and race.penalty == (3.0,)
+    # penalised survivors do not raise the next penalty
+    offspring = [individual('0011'), individual('1001')]
+    fitnesses = [race.penalty, (2.5,)]
+    for ind, fitness in zip(offspring, fitnesses):
+        ind.fitness.values = fitness
+    race.add(offspring, fitnesses)
+    assert race.penalised(offspring[0]) and not race.penalised(offspring[1])
+    race.new_generation(population + offspring)
+    assert race.penalty == (3.75,)  # 1.5 * 2.5, not 1.5 * 3.0
+    # nor are taken as real fitnesses by surrogate model
+    surrogate = Surrogate(1.0, explore=0.0, min_samples=2)
+    surrogate.add(population, [ind.fitness.values for ind in population])
+    screened = population + offspring
+    surrogate.screen(screened)
+    fitnesses = [(1.0,), (2.0,), (2.5,), (0.5,)]
+    without_penalty = surrogate.accuracy(screened, fitnesses)
+    fitnesses[3] = Penalty((100.0,))
+    assert surrogate.accuracy(screened, fitnesses) == surrogate.accuracy(screened[:3], fitnesses[:3])
+    assert surrogate.accuracy(screened, fitnesses) != without_penalty
+
+
+def test_fitness_cache():
+    from astwro.tools.gapick import FitnessCache
+    cache = FitnessCache('context', maxsize=3)
+    assert cache.get(individual('1100')) == (False, None)
+    for genome, fitness in [('1100', (1.0,)), ('0110', (2.0,)), ('0011', None)]:
+        cache.put(individual(genome), fitness)
+    assert len(cache) == 3 and individual('0011') in cache
+    assert cache.get(individual('1100')) == (True, (1.0,))  # 1100 becomes the most recently used
+    assert cache.get(individual('0011')) == (True, None)  # failed evaluation is remembered as well
+    cache.put(individual('1111'), (4.0,))  # evicts the least recently used: 0110
+    assert individual('0110') not in cache
+    assert [genome for genome, _ in cache.items()] == ['1100', '0011', '1111']
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert abs(cache.hit_rate - 2 / 3) < 1e-12
+    disabled = FitnessCache('context', maxsize=0)
+    disabled.put(individual('1100'), (1.0,))
+    assert len(disabled) == 0
+
+
+def test_fitness_cache_dump_load():
+    from astwro.tools.gapick import FitnessCache
+    d = TmpDir()
+    filename = path.join(d.path, 'cache.pkl')
+    cache = FitnessCache('context', maxsize=10)
+    cache.put(individual('1100'), (1.0,))
+    cache.put(individual('0110'), (2.0,))
+    cache.dump(filename)
+    loaded = FitnessCache('context', maxsize=10)
+    assert loaded.load(filename) == 2
+    assert loaded.items() == cache.items()
+    assert loaded.get(individual('0110')) == (True, (2.0,))
+    small = FitnessCache('context', maxsize=1)
+    small.load(filename)
+    assert small.items() == [('0110', (2.0,))]  # the most recently used are kept
+    other = FitnessCache('other context', maxsize=10)
+    assert other.load(filename) == 0  # other image, options or stars
+    assert len(other) == 0
+
+
+def test_checkpoint():
+    import random
+    import pytest
+    from deap import tools
+    from astwro.tools.gapick import (FitnessCache, write_checkpoint, load_checkpoint, individuals_from_list,
+                                     _dump_atomic)
+    d = TmpDir()
+    filename = path.join(d.path, 'checkpoint.chk')
+    population = [individual('1100', 1.0), individual('0110', 2.0), individual('0011')]  # last not evaluated
+    halloffame = tools.HallOfFame(2, similar=np.array_equal)
+    halloffame.update(population[:2])
+    logbook = tools.Logbook()
+    logbook.record(gen=0, evals=3, fitness={'min': 1.0})
+    cache = FitnessCache('context')
+    cache.put(individual('1100'), (1.0,))
+    random.seed(3)
+    np.random.seed(3)
+    write_checkpoint(filename, 7, population, halloffame, logbook, 'context', cache=cache,
+                     predicted={'0110'}, penalised=['0011'])
+    expected = random.random(), np.random.random(5)
+
+    checkpoint = load_checkpoint(filename)
+    assert checkpoint['generation'] == 7 and checkpoint['context'] == 'context'
+    restored = individuals_from_list(individual_class(), checkpoint['population'])
+    assert [ind.to01() for ind in restored] == ['1100', '0110', '0011']
+    assert [ind.fitness.values for ind in restored[:2]] == [(1.0,), (2.0,)]
+    assert not restored[2].fitness.valid
+    assert [ind.to01() for ind in individuals_from_list(individual_class(), checkpoint['halloffame'])] == \
+        ['1100', '0110']
+    assert checkpoint['logbook'].select('evals') == [3]
+    assert checkpoint['cache'] == cache.items()
+    assert checkpoint['predicted'] == ['0110'] and checkpoint['penalised'] == ['0011']
+    random.setstate(checkpoint['random_state'])
+    np.random.set_state(checkpoint['numpy_random_state'])
+    assert random.random() == expected[0]
+    assert (np.random.random(5) == expected[1]).all()
+
+    _dump_atomic(dict(checkpoint, population=[]), filename)
+    with pytest.raises(ValueError):
+        load_checkpoint(filename)
+    _dump_atomic(['not a checkpoint'], filename)
+    with pytest.raises(ValueError):
+        load_checkpoint(filename)
+
+
+class ReversePool(object):
+    # WorkersPool replacement: jobs are executed in threads, the later submitted the sooner completed;
+    # fitness is number of stars, individuals with 3 stars fail (None), with 4 stars are dropped (Penalty)
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, psf_stars, *args):
+        import threading
+        from astwro.pydaophot import Job
+        from astwro.tools.gapick import Penalty
+        self.submitted.append((fn, len(psf_stars), args))
+        results = {3: None, 4: Penalty((100.0,))}
+        job = Job(lambda worker: results.get(len(psf_stars), (float(len(psf_stars)),)), (), {})
+        threading.Timer(0.2 - 0.01 * len(self.submitted), job._execute, [None]).start()
+        return job
+
+
+def test_eval_population():
+    from astwro.tools.gapick import eval_population, eval_individual_simple, FitnessCache, Penalty
+    from astwro.starlist import StarList
+    candidates = StarList({'id': range(1, 7), 'x': np.arange(6.0), 'y': np.arange(6.0)}, columns=['id', 'x', 'y'])
+    genomes = ['110000', '111100', '110000', '111000', '100000', '111110', '111100']
+    population = [individual(g) for g in genomes]
+    cache = FitnessCache('context')
+    cache.put(individual('111110'), (42.0,))
+    pool = ReversePool()
+    fitnesses = eval_population(population, candidates, pool, show_progress=False, fine_tune=False, cache=cache)
+    # in order of population, despite of reversed completion order; failed evaluation (111000) filled
+    # by the maximum of population, here the Penalty
+    assert fitnesses == [(2.0,), (100.0,), (2.0,), (100.0,), (1.0,), (42.0,), (100.0,)]
+    assert isinstance(fitnesses[1], Penalty)
+    # duplicates and cached genomes are not evaluated
+    assert sorted(n for _, n, _ in pool.submitted) == [1, 2, 3, 4]
+    assert all(fn is eval_individual_simple and args == () for fn, _, args in pool.submitted)
+    assert cache.hits == 3
+    # failed evaluation is cached as None, Penalty is not cached
+    assert cache.get(individual('111000')) == (True, None)
+    assert individual('111100') not in cache
+    assert cache.get(individual('100000')) == (True, (1.0,))
+    fitnesses = eval_population([individual('111000'), individual('110000'), individual('100000')], candidates,
+                                ReversePool(), show_progress=False, fine_tune=False)
+    assert fitnesses == [(2.0,), (2.0,), (1.0,)]
+
+
+def test_eval_population_fine():
+    from astwro.tools.gapick import eval_population, eval_individual_fine_psf, EarlyAbort
+    from astwro.starlist import StarList
+    candidates = StarList({'id': range(1, 4), 'x': np.arange(3.0), 'y': np.arange(3.0)}, columns=['id', 'x', 'y'])
+    race = EarlyAbort()
+    pool = ReversePool()
+    fitnesses = eval_population([individual('110'), individual('011')], candidates, pool, show_progress=False,
+                                fine_tune=True, race=race, numpy_substar=True)
+    assert fitnesses == [(2.0,), (2.0,)]
+    assert [(fn, args) for fn, _, args in pool.submitted] == \
+        [(eval_individual_fine_psf, (race, '110', True)), (eval_individual_fine_psf, (race, '011', True))]
@@ -2,9 +2,19 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
+import os
+import stat
+import errno
 import shutil
+from fnmatch import fnmatch
 from tempfile import mkdtemp
 from copy import deepcopy
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+_FICLONE = 0x40049409  # linux ioctl creating copy-on-write clone of file (reflink), btrfs, xfs...
 
 
 class TmpDir(object):
@@ -13,17 +23,31 @@ class TmpDir(object):
     """
     path = None
     dir_is_tmp = True
+    clone_mode = 'copy'  #: how content of dir is cloned: 'copy' or 'link', see :func:`clone_tree`
+    copy_patterns = ()  #: in 'link' clone mode, files matching these patterns are copied, see :func:`clone_tree`
     _prefix = ''
     _base = None
 
-    def __init__(self, use_existing=None, prefix='astwro_tmp_', base_dir=None):
+    def __init__(self, use_existing=None, prefix='astwro_tmp_', base_dir=None, clone_mode=None, copy_patterns=None,
+                 min_free=0):
         """
         :param str use_existing:    If provided, instance will point to that directory and not delete it on destruct
         :param str prefix:          Prefix for temporary dir
-        :param str base_dir:        Where to crate tem dir, in None system default is used
+        :param base_dir:            Where to crate tem dir, in None system default is used. If list of directories
+                                    is provided, the first one with `min_free` bytes available is used,
+                                    see :func:`select_base_dir`
+        :param str clone_mode:      'copy' or 'link' - how clones get content of the dir, see :func:`clone_tree`
+        :param copy_patterns:       in 'link' mode, patterns of names of files which are copied rather than linked
+        :param int min_free:        min free space in bytes required for base_dir from list
         """
+        if isinstance(base_dir, (list, tuple)):
+            base_dir = select_base_dir(base_dir, min_free)
         self._prefix = prefix
-        self._base = base_dir
+        self._base = base_dir  # clones are created in the same base dir (hardlinks require the same filesystem)
+        if clone_mode is not None:
+            self.clone_mode = clone_mode
+        if copy_patterns is not None:
+            self.copy_patterns = tuple(copy_patterns)
         if use_existing is None:
             self.path = mkdtemp(prefix=prefix, dir=base_dir)
             self.dir_is_tmp = True
@@ -49,14 +73,33 @@ class TmpDir(object):
     def __str__(self):
         return self.path
 
+    def disk_usage(self, shared=True):
+        """
+        Returns size of files in directory (symlinks are not followed)
+
+        :param bool shared: whether count files hardlinked also in other directories (e.g. shared with clones),
+                            ``disk_usage(shared=False)`` is the size of files written in this directory
+        :rtype: int
+        """
+        total = 0
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                try:
+                    st = os.lstat(os.path.join(root, name))
+                except OSError:  # removed meanwhile
+                    continue
+                if stat.S_ISREG(st.st_mode) and (shared or st.st_nlink == 1):
+                    total += st.st_size
+        return total
+
     def __deepcopy__(self, memo):
         cls = self.__class__
         new = cls.__new__(cls)
         memo[id(self)] = new
         if self.dir_is_tmp:
-            new.__init__(prefix=self._prefix, base_dir=self._base)
-            shutil.rmtree(new.path)
-            shutil.copytree(self.path, new.path, symlinks=True)
+            new.__init__(prefix=self._prefix, base_dir=self._base, clone_mode=self.clone_mode,
+                         copy_patterns=self.copy_patterns)
+            clone_tree(self.path, new.path, mode=self.clone_mode, copy_patterns=self.copy_patterns)
         else:
             new.__init__(use_existing=self.path)
         return new
@@ -68,3 +111,143 @@ class TmpDir(object):
                 shutil.rmtree(self.path)
             except OSError:
                 pass
+
+
+def select_base_dir(candidates, min_free=0):
+    """
+    Selects base directory for temporary directories
+
+    Returns the first of `candidates` which is writable directory with at least `min_free` bytes available.
+    For RAM-backed filesystems (``tmpfs``, e.g. ``/dev/shm``), available memory is also checked.
+
+    :param list candidates: paths of directories in order of preference
+    :param int min_free: required free space in bytes
+    :return: selected directory or None (system default temp dir should be used) if no candidate is suitable
+    """
+    for d in candidates:
+        d = os.path.expanduser(d)
+        if not os.path.isdir(d) or not os.access(d, os.W_OK | os.X_OK):
+            continue
+        free = free_space(d)
+        if free is not None and free < min_free:
+            continue
+        if _is_ram_backed(d):
+            memory = available_memory()
+            if memory is not None and memory < min_free:
+                continue
+        return d
+    return None
+
+
+def free_space(path):
+    """Returns space available on filesystem of `path` in bytes, None if unknown (e.g. on Windows)"""
+    if not hasattr(os, 'statvfs'):
+        return None
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+def available_memory():
+    """Returns memory available for new allocations in bytes (``MemAvailable`` of linux), None if unknown"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def _is_ram_backed(path):
+    # whether path is on tmpfs/ramfs mount (linux), the longest matching mount point decides
+    path = os.path.realpath(path)
+    fs, best = None, ''
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount = fields[1]
+                if (path == mount or path.startswith(mount.rstrip('/') + '/')) and len(mount) >= len(best):
+                    fs, best = fields[2], mount
+    except (IOError, OSError):
+        return False
+    return fs in ('tmpfs', 'ramfs')
+
+
+def clone_tree(src, dst, mode='copy', copy_patterns=()):
+    """
+    Clones content of directory `src` into existing directory `dst`.
+
+    Symlinks are recreated as symlinks (pointing the same target). Regular files are cloned depending on `mode`:
+
+    * ``'copy'`` - files are copied, copy-on-write clones (reflinks) are used where filesystem supports them,
+    * ``'link'`` - files are hardlinked, so cloning is O(1) in file size and clones share disk space.
+      Files matching any of `copy_patterns` (:func:`fnmatch.fnmatch` patterns of file name)
+      and files which can not be hardlinked (e.g. other filesystem) are copied as in ``'copy'`` mode.
+
+    Hardlinked files are shared between directories, they must be replaced (removed and created again),
+    not modified in place. `copy_patterns` should cover files which are modified in place.
+
+    :param str src: source directory
+    :param str dst: destination directory, have to exist
+    :param str mode: 'copy' or 'link'
+    :param copy_patterns: patterns of names of files copied in 'link' mode
+    """
+    if mode not in ('copy', 'link'):
+        raise ValueError('Unknown clone mode: {}'.format(mode))
+    for name in os.listdir(src):
+        s = os.path.join(src, name)
+        d = os.path.join(dst, name)
+        if os.path.islink(s):
+            os.symlink(os.readlink(s), d)
+        elif os.path.isdir(s):
+            os.mkdir(d)
+            shutil.copystat(s, d)
+            clone_tree(s, d, mode, copy_patterns)
+        elif mode == 'link' and not any(fnmatch(name, p) for p in copy_patterns) and _hardlink(s, d):
+            pass
+        else:
+            _copy_file(s, d)
+
+
+def _hardlink(src, dst):
+    # creates hardlink, returns False if not possible
+    if not hasattr(os, 'link'):
+        return False
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EACCES):
+            return False
+        raise
+    return True
+
+
+def _copy_file(src, dst):
+    # copies file with metadata, reflink (copy-on-write clone) is tried first
+    if fcntl is not None:
+        with open(src, 'rb') as fs, open(dst, 'wb') as fd:
+            try:
+                fcntl.ioctl(fd.fileno(), _FICLONE, fs.fileno())
+                cloned = True
+            except (IOError, OSError):
+                cloned = False
+            if not cloned:
+                shutil.copyfileobj(fs, fd, 1024 * 1024)
+        shutil.copystat(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+def link_or_copy(src, dst):
+    """
+    Hardlinks file `src` as `dst`, copies it (reflink where supported) if hardlink is not possible
+
+    :param str src: source file
+    :param str dst: destination path, must not exist
+    """
+    if not _hardlink(src, dst):
+        _copy_file(src, dst)
@@ -1,17 +1,22 @@
-from .TmpDir import TmpDir
+from .TmpDir import TmpDir, clone_tree, link_or_copy, select_base_dir, free_space, available_memory
 from .CycleFile import CycleFile
 from .ProgressBar import ProgressBar
 
 
-def tmpdir(use_existing=None, prefix='astwro_tmp_', base_dir=None):
+def tmpdir(use_existing=None, prefix='astwro_tmp_', base_dir=None, clone_mode=None, copy_patterns=None, min_free=0):
     """
     Creates instance of TmpDir which creates and keeps lifetime of temporary directory
     :param str use_existing:    If provided, instance will point to that directory and not delete it on destruct
     :param str prefix:          Prefix for temporary dir
-    :param str base_dir:        Where to crate tem dir, in None system default is used
+    :param base_dir:            Where to crate tem dir, in None system default is used,
+                                list of directories - the first one with `min_free` bytes available
+    :param str clone_mode:      'copy' or 'link' - how clones get content of the dir, see :func:`clone_tree`
+    :param copy_patterns:       in 'link' mode, patterns of names of files which are copied rather than linked
+    :param int min_free:        min free space in bytes required for base_dir from list
     :rtype: TmpDir
     """
-    return TmpDir(use_existing, prefix, base_dir)
+    return TmpDir(use_existing, prefix, base_dir, clone_mode=clone_mode, copy_patterns=copy_patterns,
+                  min_free=min_free)
 
 
 def cyclefile(path, basename, extension='', create_symlinks=True, symlink_suffix='_last', auto_close=True):
@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import unittest
+from astwro.utils import tmpdir, clone_tree, select_base_dir, free_space
+
+
+def write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestCloneTree(unittest.TestCase):
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp(prefix='astwro_tmpdir_test_')
+        self.src = os.path.join(self.base, 'src')
+        os.mkdir(self.src)
+        write(os.path.join(self.src, 'i.fits'), 'image')
+        write(os.path.join(self.src, 'i.coo'), 'stars')
+        write(os.path.join(self.src, 'log.txt'), 'log')
+        os.mkdir(os.path.join(self.src, 'sub'))
+        write(os.path.join(self.src, 'sub', 'i.ap'), 'photometry')
+        os.symlink(os.path.join(self.base, 'external.opt'), os.path.join(self.src, 'daophot.opt'))  # dangling
+        os.symlink('i.fits', os.path.join(self.src, 'image.fits'))
+
+    def tearDown(self):
+        shutil.rmtree(self.base, ignore_errors=True)
+
+    def clone(self, name, mode, copy_patterns=()):
+        dst = os.path.join(self.base, name)
+        os.mkdir(dst)
+        clone_tree(self.src, dst, mode=mode, copy_patterns=copy_patterns)
+        return dst
+
+    def test_link_mode(self):
+        dst = self.clone('dst', 'link', copy_patterns=['*.txt'])
+        self.assertEqual(sorted(os.listdir(dst)), sorted(os.listdir(self.src)))
+        for name in ['i.fits', 'i.coo', os.path.join('sub', 'i.ap')]:
+            self.assertTrue(os.path.samefile(os.path.join(self.src, name), os.path.join(dst, name)))
+        self.assertFalse(os.path.samefile(os.path.join(self.src, 'log.txt'), os.path.join(dst, 'log.txt')))
+        self.assertEqual(read(os.path.join(dst, 'log.txt')), 'log')
+
+    def test_copy_mode(self):
+        dst = self.clone('dst', 'copy')
+        for name in ['i.fits', 'i.coo', 'log.txt', os.path.join('sub', 'i.ap')]:
+            self.assertFalse(os.path.samefile(os.path.join(self.src, name), os.path.join(dst, name)))
+            self.assertEqual(read(os.path.join(self.src, name)), read(os.path.join(dst, name)))
+
+    def test_symlinks_recreated(self):
+        for mode in ['copy', 'link']:
+            dst = self.clone(mode, mode)
+            for name in ['daophot.opt', 'image.fits']:
+                self.assertTrue(os.path.islink(os.path.join(dst, name)))
+                self.assertEqual(os.readlink(os.path.join(dst, name)), os.readlink(os.path.join(self.src, name)))
+            self.assertEqual(read(os.path.join(dst, 'image.fits')), 'image')  # relative link points to clone
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, clone_tree, self.src, self.base, mode='move')
+
+
+class TestTmpDirClone(unittest.TestCase):
+
+    def test_outputs_isolated(self):
+        # clones replace outputs (remove and write) and modify copied files in place,
+        # neither is visible in source nor in sibling clone
+        base = tempfile.mkdtemp(prefix='astwro_tmpdir_test_')
+        try:
+            src = tmpdir(base_dir=base, clone_mode='link', copy_patterns=['*.log'])
+            write(os.path.join(src.path, 'i.coo'), 'stars')
+            write(os.path.join(src.path, 'run.log'), 'log')
+            clone, sibling = src.clone(), src.clone()
+            self.assertEqual((clone.clone_mode, clone.copy_patterns), ('link', ('*.log',)))
+            self.assertEqual(os.path.dirname(clone.path), base)
+            os.remove(os.path.join(clone.path, 'i.coo'))
+            write(os.path.join(clone.path, 'i.coo'), 'other stars')
+            with open(os.path.join(clone.path, 'run.log'), 'a') as f:
+                f.write(' appended')
+            for d in [src, sibling]:
+                self.assertEqual(read(os.path.join(d.path, 'i.coo')), 'stars')
+                self.assertEqual(read(os.path.join(d.path, 'run.log')), 'log')
+            self.assertEqual(read(os.path.join(clone.path, 'i.coo')), 'other stars')
+            clone_path = clone.path
+            del clone
+            self.assertFalse(os.path.exists(clone_path))
+            self.assertEqual(read(os.path.join(sibling.path, 'i.coo')), 'stars')
+        finally:
+            shutil.rmtree(base, ignore_errors=True)
+
+
+class TestBaseDir(unittest.TestCase):
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp(prefix='astwro_tmpdir_test_')
+
+    def tearDown(self):
+        os.chmod(self.base, 0o700)
+        shutil.rmtree(self.base, ignore_errors=True)
+
+    def test_select(self):
+        missing = os.path.join(self.base, 'missing')
+        not_dir = os.path.join(self.base, 'file')
+        write(not_dir, '')
+        self.assertEqual(select_base_dir([missing, not_dir, self.base]), self.base)
+        self.assertEqual(select_base_dir([missing, self.base], min_free=free_space(self.base) // 2), self.base)
+
+    def test_fallback_to_system_temp(self):
+        missing = os.path.join(self.base, 'missing')
+        too_small = free_space(self.base) + 1024 ** 4
+        self.assertIsNone(select_base_dir([missing], min_free=0))
+        self.assertIsNone(select_base_dir([missing, self.base], min_free=too_small))
+        d = tmpdir(base_dir=[missing, self.base], min_free=too_small)
+        self.assertEqual(os.path.dirname(d.path), tempfile.gettempdir())
+
+    def test_fallback_unwritable(self):
+        os.chmod(self.base, 0o500)
+        access = os.access
+        if access(self.base, os.W_OK):  # e.g. root, permissions do not apply
+            os.access = lambda path, mode: path != self.base and access(path, mode)
+        try:
+            self.assertIsNone(select_base_dir([self.base]))
+        finally:
+            os.access = access
+
+    def test_disk_usage_shared(self):
+        with tmpdir(base_dir=self.base, clone_mode='link', copy_patterns=['*.log']) as src:
+            write(os.path.join(src.path, 'i.fits'), 'x' * 100)
+            write(os.path.join(src.path, 'run.log'), 'x' * 10)
+            os.symlink(os.path.join(src.path, 'i.fits'), os.path.join(src.path, 'image.fits'))
+            self.assertEqual(src.disk_usage(), 110)
+            with src.clone() as clone:
+                self.assertEqual(clone.disk_usage(), 110)
+                self.assertEqual(clone.disk_usage(shared=False), 10)  # hardlinked i.fits excluded
+                self.assertEqual(src.disk_usage(shared=False), 10)
+                write(os.path.join(clone.path, 'i.coo'), 'x' * 50)
+                self.assertEqual(clone.disk_usage(shared=False), 60)
+            self.assertEqual(src.disk_usage(shared=False), 110)  # clone removed, not shared anymore
@@ -0,0 +1,60 @@
+# coding=utf-8
+""" Helpers shared by benchmarks """
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import timeit
+
+import numpy as np
+import astwro.starlist as sl
+import astwro.sampledata as data
+
+
+def best_time(fn, repeat=3, min_time=0.2):
+    # type: (callable, int, float) -> float
+    # Best of `repeat` mean times of `fn` call, in seconds. Fast functions are called in loops
+    # lasting at least `min_time` seconds, so milliseconds timings are not dominated by timer resolution.
+    first = timeit.timeit(fn, number=1)
+    number = max(1, int(min_time / first)) if first > 0 else 1000
+    if number == 1 and repeat == 1:
+        return first
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def random_starlist(dao_type, stars, seed=0):
+    # type: (sl.DAO.FType, int, int) -> sl.StarList
+    # Random star list with all columns of `dao_type`, values in ranges typical for daophot files
+    rnd = np.random.RandomState(seed)
+    columns = {}
+    for col in dao_type.columns:
+        if col == 'id':
+            values = np.arange(1, stars + 1)
+        elif col in ('x', 'y'):
+            values = rnd.uniform(1.0, 4000.0, stars)
+        elif col in ('ra', 'dec'):
+            values = ['12:34:56.7890'] * stars
+        elif col.endswith('err'):
+            values = rnd.uniform(0.0, 0.5, stars)
+        elif col == 'sky':
+            values = rnd.uniform(100.0, 1000.0, stars)
+        elif col == 'iter':
+            values = rnd.randint(1, 50, stars)
+        elif col == 'mag' or col[0] == 'A' or col == 'rmag':
+            values = rnd.uniform(10.0, 20.0, stars)
+        else:
+            values = rnd.uniform(-1.0, 1.0, stars)
+        columns[col] = values
+    s = sl.StarList(columns, columns=dao_type.columns)
+    s.index = s.id
+    s.DAO_hdr = dict(sl.read_dao_file(data.coo_file()).DAO_hdr)
+    s.DAO_type = dao_type
+    return s
+
+
+def print_table(header, rows):
+    # type: ([str], list) -> None
+    # Prints rows of values, columns wide enough for header and values
+    rows = [['{:.4g}'.format(v) if isinstance(v, float) else str(v) for v in row] for row in rows]
+    widths = [max([10, len(h)] + [len(row[i]) for row in rows]) for i, h in enumerate(header)]
+    for row in [header] + rows:
+        print(' '.join('{:>{}s}'.format(v, w) for v, w in zip(row, widths)))
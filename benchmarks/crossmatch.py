@@ -0,0 +1,52 @@
+# coding=utf-8
+""" Benchmark of :func:`astwro.starlist.match`
+
+    Random star field of requested size (constant density of 100000 stars per 4000x4000 pixels)
+    is matched against its perturbed, shifted and rotated copy.
+
+    Usage::
+
+        python benchmarks/crossmatch.py [stars] [repeat]
+"""
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import sys
+import timeit
+
+import numpy as np
+import astwro.starlist as sl
+
+
+def make_lists(stars):
+    # type: (int) -> (sl.StarList, sl.StarList, np.ndarray)
+    rnd = np.random.RandomState(0)
+    side = 4000 * np.sqrt(stars / 100000)
+    xy = rnd.uniform(0, side, (stars, 2))
+    ref = sl.StarList({'id': np.arange(1, stars + 1), 'x': xy[:, 0], 'y': xy[:, 1]})
+    ref.index = ref.id
+    perm = rnd.permutation(stars)
+    a = 0.00005  # small rotation, initial match within radius is needed for transformation fit
+    t = [[np.cos(a), -np.sin(a), 5.0], [np.sin(a), np.cos(a), -3.0]]
+    xy = sl.apply_transform(t, xy[perm] + rnd.normal(0, 0.1, (stars, 2)))
+    other = sl.StarList({'id': perm + 1, 'x': xy[:, 0], 'y': xy[:, 1]})
+    other.index = np.arange(1, stars + 1)
+    return ref, other
+
+
+def bench(stars=100000, repeat=3):
+    ref, other = make_lists(stars)
+    index_time = timeit.timeit(ref.spatial_index, number=1)
+    print('{:>8s} {:>10s} {:>10s} {:>12s} {:>12s}'.format('stars', 'index[s]', 'match[s]', 'transform[s]', 'correct'))
+    match_time = min(timeit.repeat(lambda: sl.match(ref, other, 1.0, offset=(-5.0, 3.0)), number=1, repeat=repeat))
+    transform_time = min(timeit.repeat(lambda: sl.match(ref, other, 1.0, offset=(-5.0, 3.0), transform=True),
+                                       number=1, repeat=repeat))
+    m, _ = sl.match(ref, other, 1.0, offset=(-5.0, 3.0), transform=True)
+    correct = (m.id1 == m.id2).sum() / stars
+    print('{:8d} {:10.3f} {:10.3f} {:12.3f} {:12.4f}'.format(stars, index_time, match_time, transform_time, correct))
+    return {'spatial_index.{}'.format(stars): index_time, 'match.{}'.format(stars): match_time,
+            'match_transform.{}'.format(stars): transform_time}
+
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:3]])
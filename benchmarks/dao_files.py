@@ -0,0 +1,54 @@
+# coding=utf-8
+""" Benchmark of DAO files reading engines
+
+    Sample files from :mod:`astwro.sampledata` are multiplied to reach requested number of stars,
+    then read by ``pandas`` and ``numpy`` engines of :func:`astwro.starlist.read_dao_file`,
+    and from binary sidecar cache.
+
+    Usage::
+
+        python benchmarks/dao_files.py [stars] [repeat]
+"""
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import sys
+import timeit
+
+import pandas as pd
+import astwro.starlist as sl
+import astwro.sampledata as data
+from astwro.utils import tmpdir
+
+
+def make_file(src, dst, stars):
+    # type: (str, str, int) -> None
+    s = sl.read_dao_file(src)
+    copies = -(-stars // len(s))
+    big = pd.concat([s] * copies).iloc[:stars]
+    big.id = range(1, len(big) + 1)
+    big.index = big.id
+    big.DAO_hdr = s.DAO_hdr
+    big.DAO_type = s.DAO_type
+    sl.write_dao_file(big, dst)
+
+
+def bench(stars=50000, repeat=3):
+    d = tmpdir(prefix='dao_bench')
+    print('{:6s} {:>8s} {:>10s} {:>10s} {:>8s} {:>10s}'.format(
+        'file', 'stars', 'pandas[s]', 'numpy[s]', 'speedup', 'sidecar[s]'))
+    for src in [data.coo_file(), data.ap_file(), data.lst_file(), data.nei_file(), data.als_file()]:
+        ext = os.path.splitext(src)[1]
+        dst = os.path.join(d.path, 'bench' + ext)
+        make_file(src, dst, stars)
+        times = [min(timeit.repeat(lambda: sl.read_dao_file(dst, engine=engine), number=1, repeat=repeat))
+                 for engine in ('pandas', 'numpy')]
+        sl.read_dao_file(dst, cache=True)  # create sidecar
+        times.append(min(timeit.repeat(lambda: sl.read_dao_file(dst, cache=True), number=1, repeat=repeat)))
+        print('{:6s} {:8d} {:10.3f} {:10.3f} {:8.1f} {:10.3f}'.format(
+            ext, stars, times[0], times[1], times[0] / times[1], times[2]))
+
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,93 @@
+# coding=utf-8
+""" Benchmark of genetic algorithm of :mod:`astwro.tools.gapick`
+
+    One generation of gapick evolution: selection, cloning, crossover and mutation, evaluation
+    and statistics, with fake fitness function computed in-process instead of daophot and allstar runs,
+    so only overhead of genetic algorithm is measured.
+
+    Usage::
+
+        python benchmarks/gapick_generation.py [candidates] [population] [repeat]
+"""
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import sys
+import random
+
+import numpy as np
+from deap import base, creator, tools
+import astwro.starlist as sl
+from astwro.tools import gapick
+from common import best_time, random_starlist, print_table
+
+
+class FakeJob:
+    # completed job, as returned by WorkersPool.submit
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+class FakePool:
+    # evaluates fake fitness immediately instead of submitting evaluation to workers
+    def submit(self, fn, psf_stars, *args):
+        return FakeJob(fake_fitness(psf_stars))
+
+
+def fake_fitness(psf_stars):
+    # type: (sl.StarList) -> tuple
+    # the best are about 100 bright stars
+    return abs(len(psf_stars) - 100) / 100.0 + psf_stars.mag.mean() / 20.0,
+
+
+def make_population(candidates, population):
+    # type: (sl.StarList, int) -> (base.Toolbox, list)
+    if not hasattr(creator, 'BenchIndividual'):
+        creator.create('BenchFitness', base.Fitness, weights=(-1.0,))
+        creator.create('BenchIndividual', np.ndarray, fitness=creator.BenchFitness, to01=gapick.genome_to01)
+    toolbox = base.Toolbox()
+    toolbox.register('individual', gapick.random_genome, creator.BenchIndividual, len(candidates), [0.3, 0.8])
+    toolbox.register('clone', gapick.clone_individual)
+    toolbox.register('select', tools.selTournament, tournsize=3)
+    pop = [toolbox.individual() for _ in range(population)]
+    for ind, fit in zip(pop, gapick.eval_population(pop, candidates, FakePool(), False, False)):
+        ind.fitness.values = fit
+    return toolbox, pop
+
+
+def generation(toolbox, pop, candidates, hof, stats, logbook):
+    # loop body of gapick evolution (without surrogate, migration and result files)
+    offspring = list(map(toolbox.clone, toolbox.select(pop, len(pop))))
+    gapick.vary_population(offspring, 0.5, 0.2, 0.05)
+    invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
+    fitnesses = gapick.eval_population(invalid_ind, candidates, FakePool(), False, False)
+    for ind, fit in zip(invalid_ind, fitnesses):
+        ind.fitness.values = fit
+    pop[:] = offspring
+    hof.update(pop)
+    logbook.record(evals=len(invalid_ind), spectrum=gapick.calc_spectrum(pop), **stats.compile(pop))
+
+
+def bench(candidates=1000, population=80, repeat=3):
+    # type: (int, int, int) -> dict
+    """:return: {benchmark name: seconds}"""
+    random.seed(0)
+    np.random.seed(0)
+    stars = random_starlist(sl.DAO.LST_FILE, candidates)
+    toolbox, pop = make_population(stars, population)
+    hof = tools.HallOfFame(10, similar=np.array_equal)
+    stats = tools.Statistics(key=lambda ind: ind.fitness.values)
+    stats.register('min', np.min)
+    stats.register('avg', np.mean)
+    logbook = tools.Logbook()
+    name = 'gapick.generation.{}x{}'.format(candidates, population)
+    results = {name: best_time(lambda: generation(toolbox, pop, stars, hof, stats, logbook), repeat)}
+    print_table(['benchmark', 'time[ms]', 'best fitness'], [[name, 1000.0 * results[name], hof[0].fitness.values[0]]])
+    return results
+
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:4]])
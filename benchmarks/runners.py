@@ -0,0 +1,118 @@
+# coding=utf-8
+""" Benchmark of runners overhead
+
+    :class:`astwro.pydaophot.Daophot` runs against stub executable, which presents daophot's options and prompts
+    but does no work, so only overhead of runners is measured: process spawn and teardown (whole runner
+    lifecycle and single run), run in persistent process, and cloning of runner directory
+    (:class:`astwro.utils.TmpDir` with image and results files) in 'copy' and 'link' modes.
+
+    Usage::
+
+        python benchmarks/runners.py [runs] [repeat]
+"""
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import sys
+import shutil
+
+import numpy as np
+from astropy.io import fits
+from astwro.pydaophot import Daophot
+from astwro.utils import tmpdir
+import astwro.sampledata as data
+from common import best_time, print_table
+
+IMAGE_SIZE = 2048  # float32 image of 16 MB
+
+# stub of daophot: options at start, prompt after every command, ATTACH and OPTIONS outputs
+STUB = """
+import sys
+
+def out(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+def options():
+    out(' FWHM OF OBJECT =     5.00   THRESHOLD (in sigmas) =     3.50\\n'
+        ' READ NOISE (ADU; 1 frame) =    1.00\\n WATCH PROGRESS =   -2.00\\n')
+
+options()
+out('\\n Command: ')
+while True:
+    line = sys.stdin.readline()
+    command = line.strip().upper()
+    if not line or command.startswith('EX'):
+        break
+    if command.startswith('AT'):
+        out('\\n\\n    Picture size:  {0}  {0}\\n')
+    elif command.startswith('OP'):
+        sys.stdin.readline()  # options file
+        while sys.stdin.readline().strip():  # options until empty line
+            pass
+        options()
+    elif not command:
+        continue
+    out('\\n Command: ')
+""".format(IMAGE_SIZE)
+
+
+def make_stub(directory):
+    # type: (str) -> str
+    # executable stub of daophot in `directory`, run by current python interpreter
+    stub = os.path.join(directory, 'daophot')
+    with open(stub, 'w') as f:
+        f.write('#!' + sys.executable + '\n' + STUB)
+    os.chmod(stub, 0o755)
+    return stub
+
+
+def new_daophot(image, stub, **kwargs):
+    # type: (str, str) -> Daophot
+    d = Daophot(image=image, batch=True, **kwargs)
+    d.executable = stub
+    d.results_cache = None
+    return d
+
+
+def lifecycle(image, stub):
+    # runner created, run (ATTACH) and closed
+    d = new_daophot(image, stub)
+    d.run()
+    d.close()
+
+
+def run_options(d, fwhm):
+    # single run of OPTIONS command on existing runner
+    d.OPtions({'FW': fwhm})
+    d.run()
+    d.OPtion_result.get_option('FW')
+
+
+def bench(runs=20, repeat=3):
+    # type: (int, int) -> dict
+    """:return: {benchmark name: seconds}"""
+    d = tmpdir(prefix='runners_bench')
+    stub = make_stub(d.path)
+    image = os.path.join(d.path, 'bench.fits')
+    fits.writeto(image, np.zeros((IMAGE_SIZE, IMAGE_SIZE), dtype=np.float32))
+    results = {'runner.lifecycle': best_time(lambda: lifecycle(image, stub), repeat)}
+    for persistent in (False, True):
+        name = 'runner.run_persistent' if persistent else 'runner.run'
+        with new_daophot(image, stub, preserve_process=persistent) as runner:
+            run_options(runner, 3.0)  # attach image (and start persistent process)
+            results[name] = best_time(lambda: [run_options(runner, 3.0 + i % 2) for i in range(runs)],
+                                      repeat) / runs
+    for mode in ('copy', 'link'):
+        src = tmpdir(prefix='runners_bench', base_dir=d.path, clone_mode=mode)
+        shutil.copy(image, os.path.join(src.path, 'i.fits'))  # runner dir with image and results files
+        for f in (data.coo_file(), data.ap_file(), data.lst_file(), data.psf_file(), data.als_file()):
+            shutil.copy(f, os.path.join(src.path, 'i' + os.path.splitext(f)[1]))
+        results['tmpdir.clone_{}'.format(mode)] = best_time(src.clone, repeat)  # clone is removed on return
+    print_table(['benchmark', 'time[ms]'], [[name, 1000.0 * t] for name, t in sorted(results.items())])
+    return results
+
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,67 @@
+# coding=utf-8
+""" Benchmark of star lists files I/O
+
+    Random star lists of every ``DAO.*_FILE`` type are written by :func:`astwro.starlist.write_dao_file`
+    and read back by :func:`astwro.starlist.read_dao_file` (``pandas`` and ``numpy`` engines),
+    ds9 regions files by :func:`astwro.starlist.write_ds9_regions` and :func:`astwro.starlist.read_ds9_regions`.
+
+    Usage::
+
+        python benchmarks/starlist_io.py [max_stars] [repeat]
+"""
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import sys
+import warnings
+
+import astwro.starlist as sl
+from astwro.utils import tmpdir
+from common import best_time, random_starlist, print_table
+
+SIZES = [1000, 10000, 100000, 1000000]
+DS9_MAX_STARS = 100000  # regions are written row by row, larger files take minutes
+
+
+def dao_types():
+    # type: () -> list
+    # all file types which can be written and read back, ordered by extension
+    return sorted((t for name, t in vars(sl.DAO).items()
+                   if name.endswith('_FILE') and t is not sl.DAO.UNKNOWN_FILE), key=lambda t: t.extension)
+
+
+def bench(max_stars=1000000, repeat=3):
+    # type: (int, int) -> dict
+    """:return: {benchmark name: seconds}"""
+    d = tmpdir(prefix='starlist_io_bench')
+    results = {}
+    rows = []
+    warnings.simplefilter('ignore')  # pandas deprecation and mixed types warnings
+    for stars in [n for n in SIZES if n <= max_stars]:
+        for dao_type in dao_types():
+            ext = dao_type.extension
+            s = random_starlist(dao_type, stars)
+            f = os.path.join(d.path, 'bench' + ext)
+            with_header = dao_type.NL is not None
+            row = [ext, stars, best_time(lambda: sl.write_dao_file(s, f, dao_type, with_header=with_header), repeat)]
+            row += [best_time(lambda: sl.read_dao_file(f, dao_type, engine=engine), repeat)
+                    for engine in ('pandas', 'numpy')]
+            results['write_dao_file{}.{}'.format(ext, stars)] = row[2]
+            results['read_dao_file{}.pandas.{}'.format(ext, stars)] = row[3]
+            results['read_dao_file{}.numpy.{}'.format(ext, stars)] = row[4]
+            rows.append(row)
+        if stars <= DS9_MAX_STARS:
+            s = random_starlist(sl.DAO.XY_FILE, stars)
+            f = os.path.join(d.path, 'bench.reg')
+            row = ['.reg', stars, best_time(lambda: sl.write_ds9_regions(s, f), repeat),
+                   best_time(lambda: sl.read_ds9_regions(f), repeat), '']
+            results['write_ds9_regions.{}'.format(stars)] = row[2]
+            results['read_ds9_regions.{}'.format(stars)] = row[3]
+            rows.append(row)
+    print_table(['file', 'stars', 'write[s]', 'read[s]', 'read numpy[s]'], rows)
+    return results
+
+
+if __name__ == '__main__':
+    bench(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,168 @@
+# coding=utf-8
+""" Benchmark suite: runs benchmarks, stores results and compares them with results of previous release
+
+    Results are stored in ``benchmarks/results/<machine>/<astwro version>.json`` (timings in seconds),
+    and compared with results of the same machine for the latest earlier version (or `--compare` version).
+    Baseline is read before results are stored; existing results file is not replaced without `--overwrite`.
+    Benchmarks slower than baseline by more than `--threshold` factor are reported as regressions,
+    and the exit status is 1.
+
+    Baseline of a machine is created by running the suite on released version (results of that version
+    are stored), development versions are numbered above the release, so they are compared with it.
+    Results committed in ``benchmarks/results/reference`` are recorded for version 0.5.10 (platform and
+    library versions are stored in the file); other machines may compare with them
+    (``--baseline-machine reference``) on similar hardware only, timings of different machines are not comparable.
+    Reference results are not written without `--update-reference`.
+
+    Usage::
+
+        python benchmarks/suite.py [--max-stars n] [--repeat n] [--machine name] [--baseline-machine name]
+                                   [--compare version] [--threshold x] [--no-save] [--overwrite]
+                                   [--update-reference]
+"""
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import sys
+import json
+import glob
+import time
+import socket
+import platform
+import argparse
+from distutils.version import LooseVersion
+
+import numpy as np
+import pandas as pd
+import astwro
+
+import starlist_io
+import crossmatch
+import runners
+import gapick_generation
+from common import print_table
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+REFERENCE_MACHINE = 'reference'  # committed results, not written without --update-reference
+
+
+def run_benchmarks(max_stars, repeat):
+    # type: (int, int) -> dict
+    results = {}
+    for title, fn in [('Star lists I/O', lambda: starlist_io.bench(max_stars, repeat)),
+                      ('Cross-match', lambda: crossmatch.bench(min(max_stars, 100000), repeat)),
+                      ('Runners', lambda: runners.bench(repeat=repeat)),
+                      ('GA generation', lambda: gapick_generation.bench(repeat=repeat))]:
+        print('\n*** {}'.format(title))
+        results.update(fn())
+    return results
+
+
+def results_file(machine, version):
+    # type: (str, str) -> str
+    return os.path.join(RESULTS_DIR, machine, version + '.json')
+
+
+def baseline_version(machine, version, inclusive=False):
+    # type: (str, str, bool) -> str
+    # the latest version earlier than (or `inclusive` equal to) `version` with stored results, None if there is no such
+    versions = [os.path.splitext(os.path.basename(f))[0] for f in glob.glob(results_file(machine, '*'))]
+    earlier = [v for v in versions if LooseVersion(v) < LooseVersion(version)
+               or inclusive and LooseVersion(v) == LooseVersion(version)]
+    return max(earlier, key=LooseVersion) if earlier else None
+
+
+def compare(results, baseline, threshold):
+    # type: (dict, dict, float) -> list
+    # prints comparison table, returns names of benchmarks slower than baseline more than `threshold` times
+    rows = []
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name] / baseline[name]
+        regressed = ratio > threshold
+        if regressed:
+            regressions.append(name)
+        rows.append([name, 1000.0 * baseline[name], 1000.0 * results[name], ratio, 'REGRESSION' if regressed else ''])
+    print_table(['benchmark', 'baseline[ms]', 'current[ms]', 'ratio', ''], rows)
+    return regressions
+
+
+def save_results(filename, version, max_stars, results):
+    # type: (str, str, int, dict) -> None
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, 'w') as f:
+        json.dump({'version': version,
+                   'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'numpy': np.__version__,
+                   'pandas': pd.__version__,
+                   'max_stars': max_stars,
+                   'results': results}, f, indent=1, sort_keys=True)
+    print('\nResults stored in {}'.format(filename))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs astwro benchmarks, stores and compares results')
+    parser.add_argument('--max-stars', metavar='n', type=int, default=1000000,
+                        help='the largest star lists size (default: 1000000)')
+    parser.add_argument('--repeat', metavar='n', type=int, default=3,
+                        help='best of n measurements is taken (default: 3)')
+    parser.add_argument('--machine', metavar='name', default=socket.gethostname(),
+                        help='name of machine results are stored for (default: hostname)')
+    parser.add_argument('--baseline-machine', metavar='name', default=None,
+                        help='machine of baseline results, e.g. {} (default: --machine)'.format(REFERENCE_MACHINE))
+    parser.add_argument('--compare', metavar='version', default=None,
+                        help='version of baseline results (default: the latest earlier version, '
+                             'for other baseline machine: the latest version not later than current)')
+    parser.add_argument('--threshold', metavar='x', type=float, default=1.2,
+                        help='slowdown factor reported as regression (default: 1.2)')
+    parser.add_argument('--no-save', action='store_true',
+                        help='do not store results')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='replace stored results of this version on this machine')
+    parser.add_argument('--update-reference', action='store_true',
+                        help='allow storing results as committed {} results'.format(REFERENCE_MACHINE))
+    arg = parser.parse_args()
+
+    version = astwro.__version__
+    filename = results_file(arg.machine, version)
+    if not arg.no_save:  # refuse before long run
+        if arg.machine == REFERENCE_MACHINE and not arg.update_reference:
+            parser.error('results of --machine {0} are committed, use --baseline-machine {0} to compare with them, '
+                         'or --update-reference to replace them'.format(REFERENCE_MACHINE))
+        if os.path.exists(filename) and not arg.overwrite:
+            parser.error('{} exists, use --overwrite to replace it or --no-save'.format(filename))
+
+    # baseline is read before results are stored, stored file may be replaced by this run
+    baseline_machine = arg.baseline_machine or arg.machine
+    baseline = arg.compare or baseline_version(baseline_machine, version,
+                                               inclusive=baseline_machine != arg.machine)
+    stored = None
+    if baseline is not None:
+        with open(results_file(baseline_machine, baseline)) as f:
+            stored = json.load(f)
+
+    results = run_benchmarks(arg.max_stars, arg.repeat)
+    if not arg.no_save:
+        save_results(filename, version, arg.max_stars, results)
+
+    if stored is None:
+        print('No results of earlier versions on {} to compare with, '
+              'results of this version will be the baseline for next versions'.format(baseline_machine))
+        return 0
+    print('\n*** Comparison with {} on {} (python {}, numpy {}, pandas {})'.format(
+        baseline, baseline_machine, stored.get('python'), stored.get('numpy'), stored.get('pandas')))
+    regressions = compare(results, stored['results'], arg.threshold)
+    if regressions:
+        print('{} regressions (slower more than {} times than {})'.format(len(regressions), arg.threshold, baseline))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -83,7 +83,6 @@ setup(
         'astropy',
         'scipy',
         'deap',
-        'bitarray>=0.8'
         ],
 
     # List additional groups of dependencies here (e.g. development
@@ -93,14 +92,14 @@ setup(
 #    extras_require={
 #        'dev': ['check-manifest'],
 #        'test': ['coverage'],
-#        'genetic': ['deap', 'bitarray>=0.8'],
+#        'genetic': ['deap'],
 #    },
 
     # If there are data files included in your packages that need to be
     # installed, specify them here.  If using Python 2.6 or less, then these
     # have to be included in MANIFEST.in as well.
     package_data={
-        'astwro': ['sampledata/*', 'pydaophot/config/*'],
+        'astwro': ['sampledata/*', 'pydaophot/config/*', 'starlist/tests/golden/*'],
     },
 
     # Although 'package_data' is the preferred approach, in some case you may